@@ -0,0 +1,106 @@
+"""
+Async variants of the classify endpoints, for ASGI deployments (uvicorn).
+
+They answer like their DRF counterparts in ``views``, but wait on the LLM,
+Overpass and speech upstreams through httpx on the event loop and read the
+database through the async ORM, so one worker process holds hundreds of
+slow requests without a thread for each. Under WSGI they still work, each
+request then running on an event loop of its own.
+"""
+import json
+import logging
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .chatbot import AsyncChatbotStages
+from .router import aroute_page
+from .utils import aprocess_audio, agenerate_text_response
+from .views import chatbot_response
+
+logger = logging.getLogger(__name__)
+
+
+def json_body(request):
+    """The request's JSON object, or None if the body is not one."""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@csrf_exempt
+@require_POST
+async def process_voice_input(request):
+    if 'multipart/form-data' not in request.content_type:
+        return JsonResponse(
+            {'error': f'Unsupported media type: {request.content_type}. Use multipart/form-data with an "audio" file.'},
+            status=415,
+        )
+    audio_file = request.FILES.get('voice_input')
+    if not audio_file:
+        return JsonResponse({'error': 'No audio file provided'}, status=400)
+    if audio_file.size > settings.AUDIO_MAX_UPLOAD_SIZE:
+        logger.warning(f"Audio file {audio_file.name} is too large: {audio_file.size} bytes")
+        return JsonResponse({'error': 'Audio file is too large'}, status=413)
+
+    result = await aprocess_audio(audio_file)
+    if result['text'].startswith("Error") or result['text'] == "Speech could not be recognized":
+        logger.error(f"Error processing audio: {result['text']}")
+        return JsonResponse({'error': result['text']}, status=400)
+
+    return JsonResponse({
+        'category': result['category'],
+        'text': result['text'],
+        'lang': result['lang'],
+        'segments': result['segments'],
+        'response': result['response'],
+        'voice_response': result['voice_response'],
+    }, status=200)
+
+
+@csrf_exempt
+@require_POST
+async def voice_navigation(request):
+    data = json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+    input_text = data.get('query', '')
+    lang = data.get('lang', 'en')
+    if not input_text:
+        return JsonResponse({'error': 'No query provided'}, status=400)
+
+    category, source = await aroute_page(input_text, lang)
+    if "Error" in category:
+        return JsonResponse({'error': category}, status=500)
+    logger.info(f"Query categorized under: {category} (via {source})")
+
+    response_data = {'category': category}
+    if category == 'medibot':
+        detailed_response = await agenerate_text_response(input_text, lang)
+        if detailed_response.startswith("Error"):
+            return JsonResponse({'error': detailed_response}, status=500)
+        response_data['text_response'] = detailed_response
+    return JsonResponse(response_data)
+
+
+def chatbot_pipeline(input_text, lang, phone_number):
+    """``views.chatbot_pipeline`` with every stage a coroutine."""
+    return AsyncChatbotStages(input_text, lang, phone_number).pipeline()
+
+
+@csrf_exempt
+@require_POST
+async def medical_chatbot(request):
+    data = json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+    input_text = data.get('text')
+    lang = data.get('lang', 'en')
+    phone_number = request.GET.get('id')
+    if not input_text:
+        return JsonResponse({"error": "Query is required"}, status=400)
+
+    result = await chatbot_pipeline(input_text, lang, phone_number).run()
+    return chatbot_response(result)
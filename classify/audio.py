@@ -0,0 +1,282 @@
+"""
+Streaming ingestion of voice uploads.
+
+Uploads are decoded chunk by chunk into 16 kHz mono 16-bit PCM, the format
+speech recognizers want: PCM WAV in process, everything else (opus, webm,
+m4a, mp3, ...) through an ffmpeg pipe. The ffmpeg binary has to be on the
+PATH; the ``ffmpeg`` package in requirements.txt does not provide it, and
+the ``ffmpeg_available`` system check warns when it is missing. Leading and trailing silence is
+trimmed as the frames go by, so only the voiced part is ever held in memory
+and sent upstream.
+"""
+import wave
+import shutil
+import logging
+import threading
+import subprocess
+from collections import deque, namedtuple
+import numpy as np
+import speech_recognition as sr
+from django.conf import settings
+from pydub import AudioSegment
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+logger = logging.getLogger(__name__)
+
+PCM_RATE = 16000
+PCM_WIDTH = 2
+FRAME_MS = 30
+FRAME_BYTES = PCM_RATE * PCM_WIDTH * FRAME_MS // 1000
+CHUNK_SECONDS = 1
+
+Ingested = namedtuple('Ingested', ['audio', 'duration', 'voiced_duration'])
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+def pcm_seconds(size):
+    return size / (PCM_RATE * PCM_WIDTH)
+
+
+def is_wav(upload):
+    upload.seek(0)
+    header = upload.read(12)
+    upload.seek(0)
+    return header[:4] == b'RIFF' and header[8:12] == b'WAVE'
+
+
+def resample(pcm, rate, state=None):
+    """
+    Linearly resample mono 16-bit ``pcm`` from ``rate`` to PCM_RATE, as
+    audioop.ratecv did before it left the standard library in Python 3.13.
+    Returns ``(pcm, state)``; passing ``state`` on to the next chunk carries
+    the last sample and the phase over, so chunk edges are seamless.
+    """
+    samples = np.frombuffer(pcm, dtype='<i2').astype(np.float64)
+    previous, position = state or (None, 0.0)
+    if previous is not None:
+        samples = np.concatenate(([previous], samples))
+    if len(samples) < 2:
+        return b'', (samples[-1] if len(samples) else previous, position)
+    # Output samples fall every ``step`` input samples, between two known ones
+    step = rate / PCM_RATE
+    positions = np.arange(position, len(samples) - 1, step)
+    resampled = np.interp(positions, np.arange(len(samples)), samples)
+    position = (positions[-1] + step if len(positions) else position) - (len(samples) - 1)
+    return np.round(resampled).astype('<i2').tobytes(), (samples[-1], position)
+
+
+def wav_chunks(upload):
+    """Read a PCM WAV a second at a time, downmixed and resampled to 16 kHz mono."""
+    with wave.open(upload) as wav:
+        width, channels, rate = wav.getsampwidth(), wav.getnchannels(), wav.getframerate()
+        state = None
+        while True:
+            frames = wav.readframes(rate * CHUNK_SECONDS)
+            if not frames:
+                return
+            segment = AudioSegment(data=frames, sample_width=width, frame_rate=rate, channels=channels)
+            pcm = segment.set_channels(1).set_sample_width(PCM_WIDTH).raw_data
+            if rate != PCM_RATE:
+                pcm, state = resample(pcm, rate, state)
+            yield pcm
+
+
+def ffmpeg_path():
+    """Path of the ffmpeg binary pydub found, or None when it is not installed."""
+    return shutil.which(AudioSegment.converter)
+
+
+def ffmpeg_chunks(upload):
+    """Decode any format ffmpeg knows, streaming the upload in and PCM out."""
+    # Containers such as m4a may keep their index at the end of the file, so
+    # ffmpeg reads uploads spooled to disk directly rather than from a pipe
+    path = upload.temporary_file_path() if hasattr(upload, 'temporary_file_path') else None
+    command = [
+        AudioSegment.converter, '-hide_banner', '-loglevel', 'error',
+        '-i', path or 'pipe:0',
+        '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(PCM_RATE), 'pipe:1',
+    ]
+    try:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL if path else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise AudioDecodeError("ffmpeg is required to decode this audio format")
+
+    def feed():
+        try:
+            upload.seek(0)
+            for chunk in upload.chunks():
+                process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg gave up on the input or we stopped reading
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    writer = None
+    if not path:
+        writer = threading.Thread(target=feed, name='ffmpeg-feed', daemon=True)
+        writer.start()
+    try:
+        while True:
+            pcm = process.stdout.read(PCM_RATE * PCM_WIDTH * CHUNK_SECONDS)
+            if not pcm:
+                break
+            yield pcm
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        error = process.stderr.read().decode(errors='replace').strip()
+        process.stderr.close()
+        process.wait()
+        if writer:
+            writer.join()
+    if process.returncode != 0:
+        raise AudioDecodeError(f"Could not decode audio: {error or 'ffmpeg exited with ' + str(process.returncode)}")
+
+
+def pcm_chunks(upload):
+    if is_wav(upload):
+        try:
+            yield from wav_chunks(upload)
+            return
+        except (wave.Error, EOFError) as e:
+            # Compressed or extensible WAVs are left to ffmpeg
+            logger.info(f"Decoding WAV with ffmpeg: {str(e)}")
+    yield from ffmpeg_chunks(upload)
+
+
+class VoiceDetector:
+    """
+    Tells voiced 30 ms frames from silent ones: webrtcvad when it is
+    installed, otherwise a loudness threshold (``threshold_dbfs``).
+    """
+
+    def __init__(self, threshold_dbfs=None, aggressiveness=None):
+        self.threshold_dbfs = settings.AUDIO_VAD_THRESHOLD_DBFS if threshold_dbfs is None else threshold_dbfs
+        aggressiveness = settings.AUDIO_VAD_AGGRESSIVENESS if aggressiveness is None else aggressiveness
+        self.vad = webrtcvad.Vad(aggressiveness) if webrtcvad else None
+
+    def is_voiced(self, frame):
+        if self.vad:
+            return self.vad.is_speech(frame, PCM_RATE)
+        return AudioSegment(data=frame, sample_width=PCM_WIDTH, frame_rate=PCM_RATE, channels=1).dBFS > self.threshold_dbfs
+
+
+class SilenceTrimmer:
+    """
+    Drops everything before the first voiced frame and after the last one,
+    keeping ``padding_frames`` of silence either side so words are not
+    clipped. Silence between words is held back and only released once
+    voice resumes.
+    """
+
+    def __init__(self, padding_frames, detector=None):
+        self.detector = detector or VoiceDetector()
+        self.leading = deque(maxlen=padding_frames)
+        self.padding_frames = padding_frames
+        self.held = []
+        self.voiced = False
+        self._pending = b''
+
+    def feed(self, pcm):
+        """Take the next PCM chunk and return the bytes known to be kept so far."""
+        data = self._pending + pcm
+        end = len(data) - len(data) % FRAME_BYTES
+        self._pending = data[end:]
+        kept = []
+        for start in range(0, end, FRAME_BYTES):
+            frame = data[start:start + FRAME_BYTES]
+            if self.detector.is_voiced(frame):
+                kept.extend(self.held if self.voiced else self.leading)
+                kept.append(frame)
+                self.held = []
+                self.leading.clear()
+                self.voiced = True
+            elif self.voiced:
+                self.held.append(frame)
+            else:
+                self.leading.append(frame)
+        return b''.join(kept)
+
+    def flush(self):
+        """Trailing padding after the last voiced frame."""
+        tail = b''.join(self.held[:self.padding_frames])
+        self.held = []
+        return tail
+
+
+def ingest(upload, max_seconds=None, trim=None):
+    """
+    Decode ``upload`` to 16 kHz mono PCM and return an Ingested tuple whose
+    ``audio`` is an ``sr.AudioData`` of the voiced part only (empty when
+    nothing was voiced). Raises AudioDecodeError for undecodable input or
+    audio longer than ``max_seconds``.
+    """
+    max_seconds = max_seconds or settings.AUDIO_MAX_SECONDS
+    trim = settings.AUDIO_VAD if trim is None else trim
+    trimmer = SilenceTrimmer(settings.AUDIO_VAD_PADDING_MS // FRAME_MS) if trim else None
+
+    voiced = bytearray()
+    decoded = 0
+    for pcm in pcm_chunks(upload):
+        decoded += len(pcm)
+        if pcm_seconds(decoded) > max_seconds:
+            raise AudioDecodeError(f"Audio is longer than {max_seconds} seconds")
+        voiced += trimmer.feed(pcm) if trimmer else pcm
+    if trimmer:
+        voiced += trimmer.flush()
+
+    logger.info(f"Decoded {pcm_seconds(decoded):.1f}s of audio, {pcm_seconds(len(voiced)):.1f}s voiced")
+    return Ingested(sr.AudioData(bytes(voiced), PCM_RATE, PCM_WIDTH), pcm_seconds(decoded), pcm_seconds(len(voiced)))
+
+
+def split_segments(pcm, max_seconds=None, min_pause_ms=None, detector=None):
+    """
+    Split 16 kHz mono PCM into ``(start, end)`` byte ranges of at most
+    ``max_seconds`` each. Cuts go in the middle of the latest pause of at
+    least ``min_pause_ms`` in the second half before the limit, so words
+    stay whole; only speech with no such pause is cut hard at the limit.
+    """
+    max_seconds = max_seconds or settings.SPEECH_SEGMENT_SECONDS
+    min_pause_ms = settings.SPEECH_SEGMENT_MIN_PAUSE_MS if min_pause_ms is None else min_pause_ms
+    detector = detector or VoiceDetector()
+    max_frames = max(1, int(max_seconds * 1000 // FRAME_MS))
+    min_pause = max(1, min_pause_ms // FRAME_MS)
+    total = len(pcm) // FRAME_BYTES
+
+    segments = []
+    start = 0
+    cut = None
+    pause = 0
+    for index in range(total):
+        if detector.is_voiced(pcm[index * FRAME_BYTES:(index + 1) * FRAME_BYTES]):
+            pause = 0
+        else:
+            pause += 1
+            # Pauses in the first half would leave a needlessly short segment
+            if pause >= min_pause and index + 1 - pause // 2 - start >= max_frames // 2:
+                cut = index + 1 - pause // 2
+        if index + 1 - start >= max_frames:
+            end = cut if cut is not None and cut > start else index + 1
+            segments.append((start * FRAME_BYTES, end * FRAME_BYTES))
+            start = end
+            cut = None
+    if start < total or not segments:
+        segments.append((start * FRAME_BYTES, len(pcm)))
+    return segments
@@ -0,0 +1,160 @@
+"""
+Batch classification of many queries with few LLM calls.
+
+Each query is first answered from the keyword router (page categories
+only) and the classification caches, as the single-query endpoints do.
+What is left is de-duplicated, cut into chunks of
+BATCH_CLASSIFY_CHUNK_SIZE and sent as one JSON-mode prompt per chunk; the
+chunks run on a shared pool of BATCH_CLASSIFY_WORKERS threads, which bounds
+the LLM calls in flight for the whole process.
+
+Every query gets its own result: a label, or an error when its chunk failed
+or the model left it out or answered outside the allowed labels. Failed
+queries can simply be sent again.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from ror_django_backend import metrics
+from . import llm
+from .cache import normalize_query, page_cache, specialization_cache
+from .router import page_router
+from .utils import PAGE_CATEGORIES, SPECIALIZATIONS
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=settings.BATCH_CLASSIFY_WORKERS, thread_name_prefix='batch')
+
+KINDS = ('page', 'specialization')
+
+# Marks the start of the queries, which always end the prompt
+QUERIES_MARKER = 'Queries (JSON):'
+
+# Language codes such as 'en', 'hi' or 'zh-cn'
+MAX_LANG_LENGTH = 10
+
+
+def valid_lang(lang):
+    return isinstance(lang, str) and 0 < len(lang) <= MAX_LANG_LENGTH
+
+
+def labels_for(kind):
+    return PAGE_CATEGORIES if kind == 'page' else SPECIALIZATIONS
+
+
+def batch_prompt(kind, texts):
+    if kind == 'page':
+        choices = 'these categories:\n' + ''.join(
+            f"- '{name}': {description}\n" for name, description in PAGE_CATEGORIES.items())
+    else:
+        choices = 'these medical specializations: ' + ', '.join(f"'{name}'" for name in SPECIALIZATIONS) + '\n'
+    queries = json.dumps([{'id': index, 'query': text} for index, text in enumerate(texts)], ensure_ascii=False)
+    return (
+        f"Classify each of the queries below into one of {choices}\n"
+        'Answer with a JSON object of the form {"results": [{"id": 0, "category": "..."}]} '
+        'holding one entry per query id and nothing else. Use only the names listed above.\n\n'
+        f"{QUERIES_MARKER}\n{queries}"
+    )
+
+
+def parse_reply(kind, reply, count):
+    """The label for each of ``count`` queries, or an error string starting with "Error"."""
+    allowed = labels_for(kind)
+    answers = {}
+    try:
+        for entry in json.loads(reply).get('results', []):
+            answers[int(entry['id'])] = str(entry['category'])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        logger.error(f"Unparseable batch classification reply: {reply[:200]}")
+        return ["Error parsing classification"] * count
+
+    labels = []
+    for index in range(count):
+        label = answers.get(index)
+        if label is None:
+            labels.append("Error: query was not classified")
+            continue
+        label = label.strip().strip("'\"").lower()
+        labels.append(label if label in allowed else f"Error: unknown category {label}")
+    return labels
+
+
+def classify_chunk(kind, texts):
+    try:
+        reply = llm.chat_completion(batch_prompt(kind, texts), response_format={'type': 'json_object'})
+    except Exception as e:
+        logger.error(f"Batch classification of {len(texts)} queries failed: {str(e)}")
+        return ["Error generating classification"] * len(texts)
+    return parse_reply(kind, reply, len(texts))
+
+
+def cached_label(kind, text, lang):
+    if kind == 'page':
+        category, confidence = page_router.route(text)
+        if category and confidence >= settings.NAVIGATION_KEYWORD_THRESHOLD:
+            return category, 'keywords'
+        return page_cache.get(text, lang), 'cache'
+    return specialization_cache.get(text), 'cache'
+
+
+def remember(kind, text, lang, label):
+    if kind == 'page':
+        page_cache.set(text, label, lang)
+    else:
+        specialization_cache.set(text, label)
+
+
+def classify_batch(queries, kind='page'):
+    """
+    Classify ``queries``, a list of ``(text, lang)``, and return one dict per
+    query in the same order: ``{'index', 'category', 'source'}`` or
+    ``{'index', 'error'}``.
+    """
+    results = [None] * len(queries)
+    # Identical queries (after normalization) share one slot in the prompts
+    pending = {}
+    for index, (text, lang) in enumerate(queries):
+        if not text:
+            results[index] = {'index': index, 'error': 'Query is required'}
+            continue
+        if not valid_lang(lang):
+            results[index] = {'index': index, 'error': 'lang must be a language code such as "en"'}
+            continue
+        label, source = cached_label(kind, text, lang)
+        if label is not None:
+            results[index] = {'index': index, 'category': label, 'source': source}
+            continue
+        key = (normalize_query(text), lang if kind == 'page' else 'any')
+        pending.setdefault(key, []).append(index)
+
+    if pending:
+        try:
+            llm.get_api_key()
+        except Exception:
+            logger.error("Error loading groq api key", exc_info=True)
+            for indexes in pending.values():
+                for index in indexes:
+                    results[index] = {'index': index, 'error': 'Error loading Groq API key'}
+            return results
+
+        groups = list(pending.values())
+        size = settings.BATCH_CLASSIFY_CHUNK_SIZE
+        chunks = [groups[start:start + size] for start in range(0, len(groups), size)]
+        futures = {
+            executor.submit(metrics.in_context(classify_chunk), kind, [queries[indexes[0]][0] for indexes in chunk]): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            for indexes, label in zip(futures[future], future.result()):
+                text, lang = queries[indexes[0]]
+                if label.startswith("Error"):
+                    outcome = {'error': label}
+                else:
+                    remember(kind, text, lang, label)
+                    outcome = {'category': label, 'source': 'llm'}
+                for index in indexes:
+                    results[index] = {'index': index, **outcome}
+        logger.info(f"Classified {len(queries)} queries ({len(groups)} distinct uncached) in {len(chunks)} LLM calls")
+
+    return results
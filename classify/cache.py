@@ -0,0 +1,243 @@
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+
+def normalize_query(text):
+    """Lowercase, replace punctuation/symbols with spaces and collapse whitespace."""
+    text = ''.join(' ' if unicodedata.category(ch)[0] in 'PS' else ch for ch in text.lower())
+    return ' '.join(text.split())
+
+
+def token_similarity(a, b):
+    """Jaccard similarity of two token sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class LocalBackend:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # In memory and never blocking, so the async views call straight through
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value, ttl):
+        self.set(key, value, ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    """
+    Stores entries in a Django cache so every worker process shares them.
+
+    Django caches cannot delete by prefix, so entries are written under a
+    generation number kept in the same cache, and ``clear`` moves every
+    worker to a new generation; the old entries expire on their own.
+    """
+
+    def __init__(self, alias='default', namespace='classify'):
+        self.alias = alias
+        self.generation_key = f'classify:{namespace}:generation'
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def generation(self):
+        generation = self.cache.get(self.generation_key)
+        if generation is None:
+            # add() so that racing workers agree on a single starting generation
+            self.cache.add(self.generation_key, 1, timeout=None)
+            generation = self.cache.get(self.generation_key, 1)
+        return generation
+
+    async def ageneration(self):
+        generation = await self.cache.aget(self.generation_key)
+        if generation is None:
+            await self.cache.aadd(self.generation_key, 1, timeout=None)
+            generation = await self.cache.aget(self.generation_key, 1)
+        return generation
+
+    def get(self, key):
+        return self.cache.get(key, version=self.generation())
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, timeout=ttl, version=self.generation())
+
+    async def aget(self, key):
+        return await self.cache.aget(key, version=await self.ageneration())
+
+    async def aset(self, key, value, ttl):
+        await self.cache.aset(key, value, timeout=ttl, version=await self.ageneration())
+
+    def clear(self):
+        try:
+            self.cache.incr(self.generation_key)
+        except ValueError:
+            self.cache.add(self.generation_key, 1, timeout=None)
+            self.cache.incr(self.generation_key)
+
+
+class ClassificationCache:
+    """
+    Cache of classifier answers keyed on the normalized query and language.
+
+    With ``similarity_threshold`` set, a miss falls back to the most similar
+    recently cached query (token-set Jaccard similarity) for the same
+    language, so rephrasings like "book an appointment" / "appointment
+    booking" share one LLM answer.
+    """
+
+    def __init__(self, namespace, backend, ttl=86400, similarity_threshold=None, max_recent=512):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.max_recent = max_recent
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def key(self, normalized, lang):
+        digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+        return f'classify:{self.namespace}:{lang}:{digest}'
+
+    def get(self, text, lang='any'):
+        normalized = normalize_query(text)
+        value = self.backend.get(self.key(normalized, lang))
+        if value is not None:
+            self._count('hits')
+            return value
+
+        if self.similarity_threshold:
+            near_key = self._nearest(normalized, lang)
+            if near_key:
+                value = self.backend.get(near_key)
+                if value is not None:
+                    self._count('near_hits')
+                    return value
+
+        self._count('misses')
+        return None
+
+    async def aget(self, text, lang='any'):
+        """``get`` for async views, using the backend's async API."""
+        normalized = normalize_query(text)
+        value = await self.backend.aget(self.key(normalized, lang))
+        if value is not None:
+            self._count('hits')
+            return value
+
+        if self.similarity_threshold:
+            near_key = self._nearest(normalized, lang)
+            if near_key:
+                value = await self.backend.aget(near_key)
+                if value is not None:
+                    self._count('near_hits')
+                    return value
+
+        self._count('misses')
+        return None
+
+    def set(self, text, value, lang='any'):
+        normalized = normalize_query(text)
+        key = self.key(normalized, lang)
+        self.backend.set(key, value, self.ttl)
+        self._remember(normalized, lang, key)
+
+    async def aset(self, text, value, lang='any'):
+        normalized = normalize_query(text)
+        key = self.key(normalized, lang)
+        await self.backend.aset(key, value, self.ttl)
+        self._remember(normalized, lang, key)
+
+    def _remember(self, normalized, lang, key):
+        if self.similarity_threshold:
+            with self._lock:
+                self._recent[(lang, normalized)] = (frozenset(normalized.split()), key)
+                self._recent.move_to_end((lang, normalized))
+                while len(self._recent) > self.max_recent:
+                    self._recent.popitem(last=False)
+
+    def _nearest(self, normalized, lang):
+        tokens = frozenset(normalized.split())
+        best_key, best_score = None, self.similarity_threshold
+        with self._lock:
+            candidates = [entry for (entry_lang, _), entry in self._recent.items() if entry_lang == lang]
+        for entry_tokens, key in candidates:
+            score = token_similarity(tokens, entry_tokens)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self._recent.clear()
+            self.hits = self.near_hits = self.misses = 0
+
+
+def build_cache(namespace):
+    config = settings.CLASSIFY_CACHE
+    if config['BACKEND'] == 'django':
+        backend = DjangoCacheBackend(config['CACHE_ALIAS'], namespace)
+    else:
+        backend = LocalBackend(config['MAX_ENTRIES'])
+    return ClassificationCache(
+        namespace,
+        backend,
+        ttl=config['TTL'],
+        similarity_threshold=config['SIMILARITY_THRESHOLD'],
+    )
+
+
+page_cache = build_cache('page')
+specialization_cache = build_cache('specialization')
@@ -0,0 +1,128 @@
+"""
+The medical_chatbot pipeline, for ``views`` and ``async_views`` alike.
+
+``STAGES`` is the one list of stages and of what each requires. Every stage
+is a method of ``ChatbotStages``, or of ``AsyncChatbotStages`` for the async
+views; the two differ only in how they wait on upstreams, while the checks
+and queries around those waits are shared, so the endpoints cannot drift.
+"""
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from user import profile_cache
+from user.models import Doctor
+from user.pagination import DOCTOR_FIELDS
+from user.utils import get_nearby_medical_centers, aget_nearby_medical_centers, find_hospital_distance
+from .pipeline import Pipeline, AsyncPipeline, StageError
+from .utils import classify_specialization, aclassify_specialization, generate_text_response, agenerate_text_response
+from . import tts
+
+logger = logging.getLogger(__name__)
+
+# (stage, the stages it needs, whether it queries the database). The remedy
+# and the profile lookup do not depend on the specialization, so they run
+# alongside the classification instead of after it.
+STAGES = (
+    ('specialization', (), False),
+    ('remedy', (), False),
+    ('voice', ('remedy',), False),
+    ('profile', (), True),
+    ('doctors', ('specialization',), True),
+    ('hospitals', ('specialization', 'profile'), False),
+)
+# Left out when the remedy is streamed instead (medical_chatbot_stream)
+REMEDY_STAGES = ('remedy', 'voice')
+
+
+def checked(value):
+    """``value``, unless it is one of the "Error ..." strings the utils return."""
+    if value.startswith("Error"):
+        raise StageError(value)
+    return value
+
+
+class ChatbotStages:
+    pipeline_class = Pipeline
+    user_role = 'patient'
+
+    def __init__(self, input_text, lang, phone_number):
+        self.input_text = input_text
+        self.lang = lang
+        self.phone_number = phone_number
+
+    def pipeline(self, remedy=True):
+        pipeline = self.pipeline_class(timeouts=settings.CHATBOT_STAGE_TIMEOUTS)
+        for name, requires, db in STAGES:
+            if name in REMEDY_STAGES and not remedy:
+                continue
+            if name == 'voice' and not settings.CHATBOT_VOICE_RESPONSE:
+                continue
+            pipeline.add(name, getattr(self, name), requires=requires, db=db)
+        return pipeline
+
+    def doctors_query(self, specialization):
+        return (
+            Doctor.objects.filter(specialization=specialization)
+            .order_by('pk')
+            .values(*DOCTOR_FIELDS)[:settings.CHATBOT_DOCTOR_LIMIT]
+        )
+
+    @staticmethod
+    def location(profile):
+        if not profile:
+            raise StageError("Patient not found")
+        return profile['latitude'], profile['longitude']
+
+    @staticmethod
+    def nearest_hospitals(hospitals, profile):
+        return find_hospital_distance(hospitals, profile['latitude'], profile['longitude'], k=5)
+
+    def specialization(self):
+        logger.debug(f"Classifying specialization for input: {self.input_text}")
+        specialization = checked(classify_specialization(self.input_text))
+        logger.info(f"Classified specialization: {specialization}")
+        return specialization
+
+    def remedy(self):
+        logger.debug(f"Generating medical remedy for input: {self.input_text}")
+        return checked(generate_text_response(self.input_text, self.lang))
+
+    def voice(self, remedy):
+        return tts.audio_url(tts.render_later(remedy, self.lang))
+
+    def profile(self):
+        return profile_cache.get_profile(self.user_role, phonenumber=self.phone_number)
+
+    def doctors(self, specialization):
+        doctors = list(self.doctors_query(specialization))
+        logger.info(f"Found {len(doctors)} doctors under specialization {specialization}")
+        return doctors
+
+    def hospitals(self, specialization, profile):
+        hospitals = get_nearby_medical_centers(*self.location(profile), specialization=specialization)
+        return self.nearest_hospitals(hospitals, profile)
+
+
+class AsyncChatbotStages(ChatbotStages):
+    """The same stages as coroutines, for ``AsyncPipeline``."""
+    pipeline_class = AsyncPipeline
+
+    async def specialization(self):
+        return checked(await aclassify_specialization(self.input_text))
+
+    async def remedy(self):
+        return checked(await agenerate_text_response(self.input_text, self.lang))
+
+    async def voice(self, remedy):
+        # Does not wait for gTTS; only the cache write may block
+        return tts.audio_url(await sync_to_async(tts.render_later, thread_sensitive=False)(remedy, self.lang))
+
+    async def profile(self):
+        return await profile_cache.aget_profile(self.user_role, phonenumber=self.phone_number)
+
+    async def doctors(self, specialization):
+        return [doctor async for doctor in self.doctors_query(specialization)]
+
+    async def hospitals(self, specialization, profile):
+        hospitals = await aget_nearby_medical_centers(*self.location(profile), specialization=specialization)
+        return self.nearest_hospitals(hospitals, profile)
@@ -0,0 +1,14 @@
+from django.core.checks import Warning, register
+from .audio import ffmpeg_path
+
+
+@register()
+def ffmpeg_available(app_configs, **kwargs):
+    if ffmpeg_path():
+        return []
+    return [Warning(
+        "ffmpeg was not found on the PATH, so voice uploads other than PCM WAV cannot be decoded.",
+        hint="Install the ffmpeg binary (the ffmpeg Python package does not include it), "
+             "e.g. apt-get install ffmpeg or ffdl install --add-path from ffmpeg-downloader.",
+        id='classify.W001',
+    )]
@@ -0,0 +1,144 @@
+import os
+import asyncio
+import threading
+import logging
+import weakref
+import httpx
+from django.conf import settings
+from groq import Groq, AsyncGroq
+from ror_django_backend import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "llama3-8b-8192"
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+# Async clients are bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_api_key():
+    api_key = os.getenv("GORQ_TEXT_GENERATION_KEY")
+    if not api_key:
+        raise ValueError("GORQ_TEXT_GENERATION_KEY environment variable not set")
+    return api_key
+
+
+def build_http_client(client_class=httpx.Client, pool_size=None, keepalive=None):
+    pool_size = pool_size or settings.GROQ_POOL_SIZE
+    return client_class(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=min(pool_size, keepalive or pool_size),
+            keepalive_expiry=settings.GROQ_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.GROQ_TIMEOUT, connect=settings.GROQ_CONNECT_TIMEOUT),
+    )
+
+
+def get_client():
+    """
+    Process-wide Groq client sharing one keep-alive connection pool.
+
+    The client is keyed on the process id so that gunicorn workers forked
+    from a preloaded master each open their own pool instead of sharing
+    sockets inherited from the parent.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            logger.info(f"Creating Groq client for worker {pid}")
+            _client = Groq(
+                api_key=get_api_key(),
+                base_url=settings.GROQ_BASE_URL,
+                max_retries=settings.GROQ_MAX_RETRIES,
+                http_client=build_http_client(),
+            )
+            _client_pid = pid
+    return _client
+
+
+def get_async_client():
+    """
+    AsyncGroq client for the running event loop. Requests waiting on the
+    model hold no thread, so its pool is sized by GROQ_ASYNC_POOL_SIZE
+    rather than by the worker's thread count.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        logger.info(f"Creating async Groq client for worker {os.getpid()}")
+        client = AsyncGroq(
+            api_key=get_api_key(),
+            base_url=settings.GROQ_BASE_URL,
+            max_retries=settings.GROQ_MAX_RETRIES,
+            http_client=build_http_client(httpx.AsyncClient, settings.GROQ_ASYNC_POOL_SIZE, settings.GROQ_ASYNC_KEEPALIVE),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def reset_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def chat_completion(prompt, model=DEFAULT_MODEL, **kwargs):
+    """Send a single user message and return the text of the first choice."""
+    with metrics.span('groq'):
+        completion = get_client().chat.completions.create(
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            model=model,
+            **kwargs,
+        )
+    return completion.choices[0].message.content
+
+
+def stream_chat_completion(prompt, model=DEFAULT_MODEL, **kwargs):
+    """Like ``chat_completion`` but yields the reply text piece by piece as it arrives."""
+    # Timed until the response starts; the tokens arrive after the view returned
+    with metrics.span('groq'):
+        stream = get_client().chat.completions.create(
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            model=model,
+            stream=True,
+            **kwargs,
+        )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def achat_completion(prompt, model=DEFAULT_MODEL, **kwargs):
+    """``chat_completion`` for async views; waits on the event loop instead of a thread."""
+    with metrics.span('groq'):
+        completion = await get_async_client().chat.completions.create(
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            model=model,
+            **kwargs,
+        )
+    return completion.choices[0].message.content
@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import subprocess
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from ror_django_backend.bench import summarize
+from ror_django_backend.scenarios import METRICS_TOKEN
+from ror_django_backend.stubs import StubServer, FakeGroqHandler, FakeOverpassHandler
+from user.models import Patient
+from user.seed import DEFAULT_CENTER
+
+PHONE_NUMBER = '910000000021'
+
+SCENARIOS = {
+    'navigation': ('/api/classify/v1/check-navigation/', 'POST'),
+    'nearby-hospital': ('/api/users/nearby-hospital/', 'GET'),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def tree_rss(pid):
+    """Resident memory in bytes of ``pid`` and its children (gunicorn forks its worker)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            with open(f'/proc/{pid}/task/{pid}/children') as children:
+                pending.extend(int(child) for child in children.read().split())
+        except FileNotFoundError:
+            continue
+    return total
+
+
+class Command(BaseCommand):
+    help = ('Concurrent requests held and memory per request of the sync views under gunicorn (WSGI) '
+            'vs the async views under uvicorn (ASGI), against slow local stub upstreams')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200, help='Requests fired at once')
+        parser.add_argument('--latency-ms', type=float, default=500, help='Latency of every upstream call')
+        parser.add_argument('--threads', type=int, default=32, help='Threads of the gunicorn gthread worker')
+        parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                            help='Endpoint to load; repeat for several (default: all)')
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/status'):
+            raise CommandError('Memory is read from /proc; run this on Linux')
+        latitude, longitude = DEFAULT_CENTER
+        # The servers are other processes, so the patient is committed for real
+        patient, _ = Patient.objects.update_or_create(
+            phonenumber=PHONE_NUMBER,
+            defaults={'name': 'Benchmark', 'role': 'patient', 'latitude': latitude, 'longitude': longitude},
+        )
+        latency = options['latency_ms'] / 1000
+        try:
+            with StubServer(FakeGroqHandler, latency=latency) as groq, \
+                    StubServer(FakeOverpassHandler, latency=latency) as overpass:
+                env = {
+                    **os.environ,
+                    'GROQ_BASE_URL': groq.url,
+                    'OVERPASS_URL': overpass.url,
+                    'GORQ_TEXT_GENERATION_KEY': os.getenv('GORQ_TEXT_GENERATION_KEY', 'stub-key'),
+                    # Every hospital search goes upstream instead of to the tile cache
+                    'HOSPITAL_TILE_CACHE': 'False',
+                    'METRICS_TOKEN': METRICS_TOKEN,
+                }
+                servers = (
+                    ('wsgi', '', [
+                        sys.executable, '-m', 'gunicorn', 'ror_django_backend.wsgi:application',
+                        '--worker-class', 'gthread', '--workers', '1', '--threads', str(options['threads']),
+                        '--backlog', '2048', '--log-level', 'warning',
+                    ]),
+                    ('asgi', 'async/', [
+                        sys.executable, '-m', 'uvicorn', 'ror_django_backend.asgi:application',
+                        '--backlog', '2048', '--log-level', 'warning', '--no-access-log',
+                    ]),
+                )
+                for scenario in options['scenario'] or sorted(SCENARIOS):
+                    for server, suffix, command in servers:
+                        port = free_port()
+                        bind = ['--bind', f'127.0.0.1:{port}'] if server == 'wsgi' else ['--host', '127.0.0.1', '--port', str(port)]
+                        # The sync views print; their output is not part of the result
+                        process = subprocess.Popen(command + bind, env=env, stdout=subprocess.DEVNULL)
+                        try:
+                            base_url = f'http://127.0.0.1:{port}'
+                            self.wait_until_up(base_url, process)
+                            line = asyncio.run(self.load(base_url, scenario, suffix, process.pid,
+                                                         options['concurrency'], (groq, overpass)))
+                            self.stdout.write(f'{scenario:>15} {server}: {line}')
+                        finally:
+                            process.terminate()
+                            process.wait(timeout=30)
+        finally:
+            patient.delete()
+
+    def wait_until_up(self, base_url, process, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'Server exited with status {process.returncode}')
+            try:
+                response = httpx.get(f'{base_url}/api/db-stats/', timeout=1,
+                                     headers={'Authorization': f'Bearer {METRICS_TOKEN}'})
+                response.raise_for_status()
+                return
+            except httpx.TransportError:
+                time.sleep(0.1)
+        raise CommandError(f'Server at {base_url} did not come up within {timeout}s')
+
+    async def load(self, base_url, scenario, suffix, pid, concurrency, stubs):
+        path, method = SCENARIOS[scenario]
+        path += suffix
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=300) as client:
+
+            async def call(i):
+                if method == 'POST':
+                    # Unique queries miss the keyword router and the page cache
+                    return await client.post(path, json={'query': f'zq{i} xv{i}', 'lang': 'en'})
+                return await client.get(path, params={'id': PHONE_NUMBER, 'user_role': 'patient'})
+
+            # One warm-up call loads the app, URLconf and upstream clients
+            await call(-1)
+            for stub in stubs:
+                stub.reset_counters()
+            baseline = peak = tree_rss(pid)
+            done = asyncio.Event()
+
+            async def sample_memory():
+                nonlocal peak
+                while not done.is_set():
+                    peak = max(peak, tree_rss(pid))
+                    await asyncio.sleep(0.01)
+
+            async def timed(i):
+                started = time.perf_counter()
+                response = await call(i)
+                return response.status_code, time.perf_counter() - started
+
+            sampler = asyncio.create_task(sample_memory())
+            started = time.perf_counter()
+            results = await asyncio.gather(*(timed(i) for i in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            done.set()
+            await sampler
+
+        ok = sum(1 for status, _ in results if status == 200)
+        stats = summarize([seconds for _, seconds in results])
+        held = max(stub.max_in_flight for stub in stubs)
+        growth = peak - baseline
+        per_request = f'{growth / held / 1024:.0f}KiB' if held else 'n/a'
+        return (f"ok={ok}/{concurrency} throughput={concurrency / elapsed:.1f} req/s "
+                f"p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms max_concurrent_upstream={held} "
+                f"rss={baseline / 2**20:.1f}->{peak / 2**20:.1f}MiB per_request={per_request}")
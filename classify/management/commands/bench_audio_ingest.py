@@ -0,0 +1,66 @@
+import io
+import math
+import wave
+import struct
+import tracemalloc
+import speech_recognition as sr
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from ror_django_backend.bench import Timer
+from classify import audio
+
+
+def synthetic_recording(rate, channels, silence_seconds, speech_seconds):
+    # Quiet room noise around a loud warbling tone standing in for speech
+    frames = bytearray()
+    total = int((2 * silence_seconds + speech_seconds) * rate)
+    for i in range(total):
+        t = i / rate
+        if silence_seconds <= t < silence_seconds + speech_seconds:
+            sample = int(9000 * math.sin(2 * math.pi * 220 * (1 + 0.3 * math.sin(3 * t)) * t))
+        else:
+            sample = (i * 7919) % 31 - 15
+        frames += struct.pack('<h', sample) * channels
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Peak memory and upstream audio bytes: whole-file sr.AudioFile vs streaming 16 kHz ingestion with VAD'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rate', type=int, default=44100)
+        parser.add_argument('--channels', type=int, default=2)
+        parser.add_argument('--silence-seconds', type=float, default=3)
+        parser.add_argument('--speech-seconds', type=float, default=6)
+
+    def handle(self, *args, **options):
+        data = synthetic_recording(options['rate'], options['channels'], options['silence_seconds'], options['speech_seconds'])
+        self.stdout.write(f"upload: {len(data)} bytes, {options['rate']} Hz, {options['channels']} channel(s)")
+        for name, load in (('whole file', self.whole_file), ('streaming', self.streaming)):
+            upload = SimpleUploadedFile('recording.wav', data, content_type='audio/wav')
+            tracemalloc.start()
+            with Timer() as timer:
+                audio_data = load(upload)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            # What recognize_google would upload
+            flac = audio_data.get_flac_data(convert_rate=None if audio_data.sample_rate >= 8000 else 8000, convert_width=2)
+            seconds = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+            self.stdout.write(
+                f'{name:>10}: {seconds:.1f}s sent, flac={len(flac)} bytes, '
+                f'peak python memory={peak / 1024:.0f} KiB, {timer.elapsed * 1000:.1f}ms'
+            )
+
+    def whole_file(self, upload):
+        # process_audio as it was
+        with sr.AudioFile(upload) as source:
+            return sr.Recognizer().record(source)
+
+    def streaming(self, upload):
+        return audio.ingest(upload).audio
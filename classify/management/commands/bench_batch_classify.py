@@ -0,0 +1,53 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from ror_django_backend.bench import Timer
+from ror_django_backend.scenarios import BenchGroqHandler, CHATBOT_QUERIES
+from ror_django_backend.stubs import StubServer
+from classify import batch, llm
+from classify.cache import page_cache, specialization_cache
+from classify.utils import classify_specialization
+
+
+class Command(BaseCommand):
+    help = ('Queries classified per second against a local fake LLM: one call per query '
+            '(classify_specialization) vs classify_batch at several chunk sizes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--chunk-size', type=int, action='append',
+                            help='Queries per LLM call; repeat for several (default: 10, 25, 50)')
+        parser.add_argument('--latency-ms', type=float, default=200, help='Time to first token of every LLM call')
+        parser.add_argument('--token-delay-ms', type=float, default=2, help='Generation time per word of the reply')
+
+    def handle(self, *args, **options):
+        os.environ.setdefault('GORQ_TEXT_GENERATION_KEY', 'stub-key')
+        handler = type('Handler', (BenchGroqHandler,), {'token_delay': options['token_delay_ms'] / 1000})
+        runs = [('single', None)] + [('batch', size) for size in options['chunk_size'] or [10, 25, 50]]
+        with StubServer(handler, latency=options['latency_ms'] / 1000) as stub, \
+                override_settings(GROQ_BASE_URL=stub.url):
+            llm.reset_client()
+            for round_, (mode, size) in enumerate(runs):
+                # Fresh queries and caches, so every query reaches the LLM
+                page_cache.clear()
+                specialization_cache.clear()
+                texts = [f'{CHATBOT_QUERIES[i % len(CHATBOT_QUERIES)]} run {round_} #{i}' for i in range(options['queries'])]
+                stub.reset_counters()
+                with Timer() as timer:
+                    if mode == 'single':
+                        # As many calls in flight as the batch pool allows
+                        with ThreadPoolExecutor(max_workers=settings.BATCH_CLASSIFY_WORKERS) as pool:
+                            labels = list(pool.map(classify_specialization, texts))
+                    else:
+                        with override_settings(BATCH_CLASSIFY_CHUNK_SIZE=size):
+                            results = batch.classify_batch([(text, 'en') for text in texts], 'specialization')
+                        labels = [result.get('category') or result['error'] for result in results]
+                errors = sum(1 for label in labels if label.startswith('Error'))
+                name = mode if size is None else f'batch of {size}'
+                self.stdout.write(
+                    f'{name:>12}: {len(texts) / timer.elapsed:>8.1f} queries/s llm_calls={stub.requests} '
+                    f'elapsed={timer.elapsed:.2f}s errors={errors}'
+                )
+        llm.reset_client()
@@ -0,0 +1,91 @@
+import os
+import time
+import asyncio
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, AsyncClient
+from django.test.utils import override_settings
+from ror_django_backend.bench import summarize
+from ror_django_backend.stubs import StubServer, FakeGroqHandler, FakeOverpassHandler
+from classify import llm
+from classify.cache import specialization_cache
+from user.models import Patient
+from user.seed import DEFAULT_CENTER
+
+PHONE_NUMBER = '910000000000'
+
+
+class Command(BaseCommand):
+    help = 'Time-to-first-byte of the buffered vs streaming medical chatbot against a fake streaming LLM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20)
+        parser.add_argument('--tokens', type=int, default=60, help='Words in the fake remedy')
+        parser.add_argument('--first-token-ms', type=float, default=200)
+        parser.add_argument('--token-ms', type=float, default=20, help='Delay between streamed words')
+        parser.add_argument('--asgi', action='store_true', help='Go through the ASGI handler instead of WSGI')
+
+    def handle(self, *args, **options):
+        os.environ.setdefault('GORQ_TEXT_GENERATION_KEY', 'stub-key')
+        reply = ' '.join(f'word{i}' for i in range(options['tokens']))
+        handler = type('RemedyHandler', (FakeGroqHandler,), {'reply': reply, 'token_delay': options['token_ms'] / 1000})
+
+        latitude, longitude = DEFAULT_CENTER
+        patient, _ = Patient.objects.update_or_create(
+            phonenumber=PHONE_NUMBER,
+            defaults={'name': 'Benchmark', 'role': 'patient', 'latitude': latitude, 'longitude': longitude},
+        )
+        try:
+            with StubServer(handler, latency=options['first_token_ms'] / 1000) as groq, \
+                    StubServer(FakeOverpassHandler) as overpass, \
+                    override_settings(GROQ_BASE_URL=groq.url, OVERPASS_URL=overpass.url, CHATBOT_VOICE_RESPONSE=False,
+                                      ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                llm.reset_client()
+                for name, path in (('buffered', '/api/classify/v1/medical-chatbot/'),
+                                   ('streaming', '/api/classify/v1/medical-chatbot/stream/')):
+                    ttfb, total = [], []
+                    for _ in range(options['requests']):
+                        # Every request pays for classification and the hospital lookup
+                        specialization_cache.clear()
+                        cache.clear()
+                        run = self.request_async if options['asgi'] else self.request
+                        first, last = run(f'{path}?id={PHONE_NUMBER}')
+                        ttfb.append(first)
+                        total.append(last)
+                    ttfb, total = summarize(ttfb), summarize(total)
+                    self.stdout.write(
+                        f"{name:>9}: ttfb p50={ttfb['p50_ms']}ms p95={ttfb['p95_ms']}ms "
+                        f"total p50={total['p50_ms']}ms p95={total['p95_ms']}ms"
+                    )
+            llm.reset_client()
+        finally:
+            patient.delete()
+
+    def request(self, path):
+        client = Client()
+        started = time.perf_counter()
+        response = client.post(path, {'text': 'I have a sore throat', 'lang': 'en'}, content_type='application/json')
+        first = None
+        if response.streaming:
+            for chunk in response.streaming_content:
+                if first is None:
+                    first = time.perf_counter() - started
+        else:
+            response.content
+        last = time.perf_counter() - started
+        return first if first is not None else last, last
+
+    def request_async(self, path):
+        async def run():
+            client = AsyncClient()
+            started = time.perf_counter()
+            response = await client.post(path, {'text': 'I have a sore throat', 'lang': 'en'}, content_type='application/json')
+            first = None
+            if response.streaming:
+                async for chunk in response.streaming_content:
+                    if first is None:
+                        first = time.perf_counter() - started
+            last = time.perf_counter() - started
+            return first if first is not None else last, last
+        return asyncio.run(run())
@@ -0,0 +1,53 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from groq import Groq
+from ror_django_backend.bench import summarize, Timer
+from ror_django_backend.stubs import StubServer, FakeGroqHandler
+from classify import llm
+
+
+class Command(BaseCommand):
+    help = 'Count connections opened per LLM call against a local stub Groq server, per-call client vs shared pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--latency-ms', type=float, default=5)
+
+    def handle(self, *args, **options):
+        os.environ.setdefault('GORQ_TEXT_GENERATION_KEY', 'stub-key')
+        with StubServer(FakeGroqHandler, latency=options['latency_ms'] / 1000) as stub:
+            with override_settings(GROQ_BASE_URL=stub.url):
+                for name, call in (('per-call client', self.per_call_client), ('shared client', self.shared_client)):
+                    llm.reset_client()
+                    stub.reset_counters()
+                    samples = self.run(call, stub.url, options['requests'], options['concurrency'])
+                    stats = summarize(samples)
+                    per_thousand = stub.connections * 1000 / max(stub.requests, 1)
+                    self.stdout.write(
+                        f'{name:>16}: requests={stub.requests} connections={stub.connections} '
+                        f"connections/1000={per_thousand:.1f} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms"
+                    )
+            llm.reset_client()
+
+    def run(self, call, url, requests, concurrency):
+        def timed(_):
+            with Timer() as timer:
+                call(url)
+            return timer.elapsed
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(timed, range(requests)))
+
+    def per_call_client(self, url):
+        # What classify.utils did before the shared client: a new Groq() per call
+        client = Groq(api_key=llm.get_api_key(), base_url=url)
+        client.chat.completions.create(
+            messages=[{"role": "user", "content": "ping"}],
+            model=llm.DEFAULT_MODEL,
+        )
+
+    def shared_client(self, url):
+        llm.chat_completion("ping")
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import logging
+import logging.config
+import tempfile
+from contextlib import redirect_stdout
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ror_django_backend import logs, scenarios
+
+DEFAULT_SCENARIOS = ['medical-chatbot', 'process-voice', 'check-navigation']
+MODES = ['off', 'sync', 'queue']
+
+
+def slow_down(handler, seconds):
+    """Make ``handler`` take ``seconds`` longer per record, like a slow or contended disk."""
+    emit = handler.emit
+
+    def slow_emit(record):
+        time.sleep(seconds)
+        emit(record)
+
+    handler.emit = slow_emit
+
+
+class Command(BaseCommand):
+    help = ('Request latency of the logging-heavy endpoints with logging off, written on the request '
+            'thread (sync) and handed to the queue listener (queue), against local stub upstreams')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=[scenario.name for scenario in scenarios.SCENARIOS],
+                            help=f"Scenario to run; repeat for several (default: {', '.join(DEFAULT_SCENARIOS)})")
+        parser.add_argument('--mode', action='append', choices=MODES, help='Logging mode; repeat for several (default: all)')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--level', default='DEBUG', help='Root log level, DEBUG as the old configuration')
+        parser.add_argument('--latency', type=float, default=20, help='Upstream latency in ms')
+        parser.add_argument('--disk-latency-ms', type=float, default=0,
+                            help='Extra time to write each record, to model a slow or shared disk')
+
+    def handle(self, *args, **options):
+        selected = [scenario for scenario in scenarios.SCENARIOS
+                    if scenario.name in (options['scenario'] or DEFAULT_SCENARIOS)]
+        directory = tempfile.mkdtemp(prefix='bench-logging-')
+        try:
+            with scenarios.Upstreams(options['latency'] / 1000) as upstreams, \
+                    scenarios.BenchData(200, 50) as data, \
+                    scenarios.EventLoop() as loop, \
+                    scenarios.counting_queries() as queries, \
+                    redirect_stdout(sys.stderr):
+                for mode in options['mode'] or MODES:
+                    path = os.path.join(directory, f'{mode}.log')
+                    logging.config.dictConfig(logs.config(mode=mode, level=options['level'], file=path))
+                    if options['disk_latency_ms'] and mode != 'off':
+                        handler = logging.getLogger().handlers[0]
+                        for target in handler.listener.handlers if mode == 'queue' else [handler]:
+                            slow_down(target, options['disk_latency_ms'] / 1000)
+                    for scenario in selected:
+                        result = scenarios.run(scenario, data, upstreams, queries, loop, options['requests'],
+                                               options['concurrency'], options['warmup'])
+                        self.stderr.write(
+                            f"{scenario.name:>18} {mode:>5}: {result['throughput_rps']:>7} req/s "
+                            f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+                            f"errors={result['errors']}"
+                        )
+                    dropped = logs.dropped_records()
+                    # Closing the handlers waits for the queue to drain
+                    logging.config.dictConfig(logs.config(mode='off'))
+                    size = os.path.getsize(path) if os.path.exists(path) else 0
+                    self.stderr.write(f"{'':>18} {mode:>5}: wrote {size / 1024:.0f}KiB, dropped {dropped} records")
+        finally:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+            logging.config.dictConfig(settings.LOGGING)
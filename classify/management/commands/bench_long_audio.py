@@ -0,0 +1,56 @@
+import math
+import array
+import speech_recognition as sr
+from django.core.management.base import BaseCommand
+from ror_django_backend.bench import summarize, Timer
+from ror_django_backend.stubs import StubServer, FakeGoogleSpeechHandler
+from classify import speech
+from classify.audio import PCM_RATE, PCM_WIDTH
+
+
+def synthetic_voice_note(seconds, phrase_seconds=3.5, pause_seconds=0.5):
+    # Phrases of a warbling tone separated by short near-silent pauses
+    samples = array.array('h')
+    period = phrase_seconds + pause_seconds
+    for i in range(int(seconds * PCM_RATE)):
+        t = i / PCM_RATE
+        if t % period < phrase_seconds:
+            samples.append(int(9000 * math.sin(2 * math.pi * 200 * (1 + 0.3 * math.sin(3 * t)) * t)))
+        else:
+            samples.append(i % 7 - 3)
+    return sr.AudioData(samples.tobytes(), PCM_RATE, PCM_WIDTH)
+
+
+class Command(BaseCommand):
+    help = 'Recognition latency vs clip length: one call per clip vs segments recognized in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lengths', type=float, nargs='+', default=[10, 30, 60, 90])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--latency-ms', type=float, default=300, help='Fixed round trip of the stub recognizer')
+        parser.add_argument('--realtime-factor', type=float, default=0.1,
+                            help='Stub recognition seconds per second of audio')
+
+    def handle(self, *args, **options):
+        handler = type('SpeechHandler', (FakeGoogleSpeechHandler,), {'realtime_factor': options['realtime_factor']})
+        with StubServer(handler, latency=options['latency_ms'] / 1000) as stub:
+            backend = speech.GoogleBackend(f'{stub.url}/speech-api/v2/recognize')
+            for length in options['lengths']:
+                clip = synthetic_voice_note(length)
+                single, segmented, per_segment = [], [], []
+                segments = 0
+                for _ in range(options['repeat']):
+                    with Timer() as timer:
+                        speech.recognize(clip, backend=backend)
+                    single.append(timer.elapsed)
+                    with Timer() as timer:
+                        transcription = speech.transcribe(clip, backend=backend)
+                    segmented.append(timer.elapsed)
+                    segments = len(transcription.segments)
+                    per_segment.extend(segment.elapsed for segment in transcription.segments)
+                single, segmented, per_segment = summarize(single), summarize(segmented), summarize(per_segment)
+                self.stdout.write(
+                    f"{length:>5.0f}s clip: single call p50={single['p50_ms']}ms | "
+                    f"{segments} segments p50={segmented['p50_ms']}ms "
+                    f"(per segment p50={per_segment['p50_ms']}ms p99={per_segment['p99_ms']}ms)"
+                )
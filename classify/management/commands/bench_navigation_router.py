@@ -0,0 +1,75 @@
+import os
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from ror_django_backend.bench import summarize, Timer
+from ror_django_backend.stubs import StubServer, FakeGroqHandler
+from classify import llm
+from classify.cache import page_cache
+from classify.router import route_page
+
+CORPUS = os.path.join(settings.BASE_DIR, 'classify', 'assets', 'navigation_corpus.json')
+
+
+class Command(BaseCommand):
+    help = 'Measure accuracy, latency and network share of the voice navigation router on the labelled corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=CORPUS)
+        parser.add_argument('--threshold', type=float, default=None)
+        parser.add_argument('--llm-latency-ms', type=float, default=300,
+                            help='Latency of the stub LLM used for fallbacks')
+        parser.add_argument('--live', action='store_true',
+                            help='Send fallbacks to the configured Groq endpoint instead of a stub')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        with open(options['corpus'], encoding='utf-8') as f:
+            corpus = json.load(f)
+        threshold = options['threshold']
+        if threshold is None:
+            threshold = settings.NAVIGATION_KEYWORD_THRESHOLD
+
+        if options['live']:
+            self.run(corpus, threshold, None)
+            return
+
+        os.environ.setdefault('GORQ_TEXT_GENERATION_KEY', 'stub-key')
+        with StubServer(FakeGroqHandler, latency=options['llm_latency_ms'] / 1000) as stub:
+            with override_settings(GROQ_BASE_URL=stub.url):
+                llm.reset_client()
+                self.run(corpus, threshold, stub)
+            llm.reset_client()
+
+    def run(self, corpus, threshold, stub):
+        page_cache.clear()
+        samples = []
+        # Per corpus set: the items the keyword table was tuned on, ones it
+        # was not, and ones written to trip it up
+        counts = {}
+        with override_settings(NAVIGATION_KEYWORD_THRESHOLD=threshold):
+            for item in corpus:
+                with Timer() as timer:
+                    category, source = route_page(item['text'], item['lang'])
+                samples.append(timer.elapsed)
+                hit = category == item['category']
+                total, local, local_correct, correct = counts.get(item.get('set', 'tuning'), (0, 0, 0, 0))
+                if source == 'keywords':
+                    local += 1
+                    local_correct += hit
+                    if not hit:
+                        self.stdout.write(f"keyword miss: {item['text']!r} -> {category} ({item['category']})")
+                elif self.verbosity > 1:
+                    self.stdout.write(f"llm fallback: {item['text']!r} ({item['category']})")
+                counts[item.get('set', 'tuning')] = (total + 1, local, local_correct, correct + hit)
+
+        stats = summarize(samples)
+        self.stdout.write(f'queries={len(corpus)} threshold={threshold}')
+        for name, (total, local, local_correct, correct) in counts.items():
+            line = (f'{name:>12}: no network {local / total:.1%} ({local}/{total}), '
+                    f'keyword accuracy {local_correct / max(local, 1):.1%} ({local_correct}/{local})')
+            if stub is None:
+                line += f', end-to-end accuracy {correct / total:.1%}'
+            self.stdout.write(line)
+        self.stdout.write(f"latency: p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
@@ -0,0 +1,135 @@
+import os
+import math
+import glob
+import struct
+import speech_recognition as sr
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ror_django_backend.bench import summarize, Timer
+from ror_django_backend.stubs import StubServer, FakeGoogleSpeechHandler
+from classify import speech
+
+SAMPLE_RATE = 16000
+
+FIXTURES_DIR = os.path.join(settings.BASE_DIR, 'classify', 'assets', 'audio')
+# Shipped recordings, by the language part of a SPEECH_LANGUAGES code
+DEFAULT_FIXTURES = {
+    'en': os.path.join(FIXTURES_DIR, 'harvard_audio.wav'),
+    'hi': os.path.join(FIXTURES_DIR, 'hindi_sample_audio.wav'),
+}
+
+
+def serial_recognize(backend, audio_data, languages):
+    # process_audio as it was: one language after another until one succeeds
+    for language in languages:
+        try:
+            text, confidence = backend.recognize(audio_data, language)
+        except sr.UnknownValueError:
+            continue
+        return speech.Transcript(text, language, confidence)
+    return None
+
+
+def synthetic_utterance(seconds, pitch):
+    # A stand-in for a recording when benchmarking against the stub, which
+    # does not listen to the audio
+    frames = b''.join(
+        struct.pack('<h', int(8000 * math.sin(2 * math.pi * pitch * (1 + 0.2 * math.sin(i / 800)) * i / SAMPLE_RATE)))
+        for i in range(int(seconds * SAMPLE_RATE))
+    )
+    return sr.AudioData(frames, SAMPLE_RATE, 2)
+
+
+class Command(BaseCommand):
+    help = 'Speech recognition latency per language: serial en-IN then hi-IN vs concurrent best-confidence'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixture', action='append', default=[], metavar='LANGUAGE=PATH',
+                            help='WAV recording, or directory of them, for a language such as hi-IN; '
+                                 'repeat for several (default: the recordings in classify/assets/audio)')
+        parser.add_argument('--synthetic', action='store_true',
+                            help='Use generated tones for languages without a recording (stub backend only)')
+        parser.add_argument('--backend', default='stub', choices=['stub'] + list(speech.BACKENDS))
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--latency-ms', type=float, default=400, help='Round trip of the stub recognizer')
+        parser.add_argument('--mismatch-confidence', type=float, default=0.0,
+                            help='Confidence of the stub guess in the wrong language; 0 returns nothing')
+
+    def handle(self, *args, **options):
+        languages = list(settings.SPEECH_LANGUAGES)
+        if options['synthetic'] and options['backend'] != 'stub':
+            raise CommandError('--synthetic only makes sense against the stub, which does not listen to the audio')
+        paths = self.fixture_paths(options['fixture'], languages)
+        fixtures = self.load_fixtures(paths)
+        missing = [language for language in languages if not any(item[0] == language for item in fixtures)]
+        if missing and not options['synthetic']:
+            raise CommandError(f"No WAV recordings for {', '.join(missing)}; pass --fixture LANGUAGE=PATH, "
+                               f"or --synthetic to use generated tones against the stub")
+        for i, language in enumerate(missing):
+            self.stdout.write(f'No recording for {language}; using synthetic audio')
+            fixtures.append((language, f'synthetic-{language}', synthetic_utterance(2.5, 180 + 40 * i)))
+
+        if options['backend'] == 'stub':
+            handler = type('SpeechHandler', (FakeGoogleSpeechHandler,), {'mismatch_confidence': options['mismatch_confidence']})
+            with StubServer(handler, latency=options['latency_ms'] / 1000) as stub:
+                backend = speech.GoogleBackend(f'{stub.url}/speech-api/v2/recognize')
+                self.run(backend, fixtures, languages, options['repeat'], handler, stub)
+        else:
+            self.run(speech.get_backend(options['backend']), fixtures, languages, options['repeat'])
+
+    def fixture_paths(self, items, languages):
+        """``{language: path}`` from ``--fixture`` items, falling back to DEFAULT_FIXTURES."""
+        paths = {}
+        for item in items:
+            language, _, path = item.partition('=')
+            if language not in languages or not path:
+                raise CommandError(f"--fixture takes LANGUAGE=PATH with LANGUAGE one of {', '.join(languages)}")
+            paths[language] = path
+        for language in languages:
+            default = DEFAULT_FIXTURES.get(language.split('-')[0])
+            if language not in paths and default:
+                paths[language] = default
+        return paths
+
+    def load_fixtures(self, paths):
+        fixtures = []
+        for language, path in paths.items():
+            files = sorted(glob.glob(os.path.join(path, '*.wav'))) if os.path.isdir(path) else [path]
+            for file in files:
+                try:
+                    with sr.AudioFile(file) as source:
+                        fixtures.append((language, os.path.basename(file), sr.Recognizer().record(source)))
+                except (OSError, ValueError) as e:
+                    raise CommandError(f'Cannot read {file} as a WAV recording: {e}')
+        return fixtures
+
+    def run(self, backend, fixtures, languages, repeat, handler=None, stub=None):
+        strategies = (
+            ('serial', lambda audio: serial_recognize(backend, audio, languages)),
+            ('concurrent', lambda audio: speech.recognize(audio, languages, backend)),
+        )
+        for name, recognize in strategies:
+            for language in languages:
+                samples, correct, total = [], 0, 0
+                if stub:
+                    handler.spoken = language
+                    stub.reset_counters()
+                for fixture_language, _, audio in fixtures:
+                    if fixture_language != language:
+                        continue
+                    for _ in range(repeat):
+                        with Timer() as timer:
+                            transcript = recognize(audio)
+                        samples.append(timer.elapsed)
+                        total += 1
+                        correct += bool(transcript and transcript.language == language)
+                if not samples:
+                    continue
+                stats = summarize(samples)
+                line = (
+                    f"{name:>10} {language}: p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms "
+                    f"right language={correct}/{total}"
+                )
+                if stub:
+                    line += f' round trips/utterance={stub.requests / total:.1f}'
+                self.stdout.write(line)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from classify import tts
+from classify.utils import responses
+
+
+class Command(BaseCommand):
+    help = 'Synthesize the fixed voice responses into the pinned part of the TTS cache'
+
+    def handle(self, *args, **options):
+        rendered = failed = 0
+        for category, texts in responses.items():
+            for lang, text in texts.items():
+                try:
+                    key = tts.prerender(text, lang)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{category}/{lang}: {str(e)}')
+                    continue
+                rendered += 1
+                self.stdout.write(f'{category}/{lang}: {tts.audio_url(key)}')
+        self.stdout.write(f'Pre-rendered {rendered} responses, {failed} failed')
@@ -0,0 +1,212 @@
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+from django.db import close_old_connections
+from ror_django_backend import metrics
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def stage_executor(name, db=False):
+    """
+    The thread pool for stage ``name``. Every stage has its own, so threads
+    left running by a timed-out stage (say, a hung Overpass query) only hold
+    up that stage and never the ones other requests need. Each thread of a
+    ``db`` stage keeps a database connection open for up to CONN_MAX_AGE, so
+    those pools get only CHATBOT_DB_STAGE_WORKERS threads.
+    """
+    with _executors_lock:
+        if name not in _executors:
+            workers = settings.CHATBOT_DB_STAGE_WORKERS if db else settings.CHATBOT_STAGE_WORKERS
+            _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'stage-{name}')
+        return _executors[name]
+
+
+class StageError(Exception):
+    pass
+
+
+class PipelineResult:
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.timings = {}
+
+    def ok(self, name):
+        return name in self.results
+
+    def server_timing(self):
+        """Format stage timings for the ``Server-Timing`` response header."""
+        return ', '.join(
+            f'{name};dur={duration * 1000:.1f}' + (';desc="failed"' if name in self.errors else '')
+            for name, duration in self.timings.items()
+        )
+
+
+class StageRun:
+    """A stage that was started; its timeout counts from when it actually begins running."""
+
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+        self.queued = time.perf_counter()
+        self.started = None
+
+    def begin(self):
+        self.started = time.perf_counter()
+
+    @property
+    def deadline(self):
+        # A stage still queued for a thread may wait as long as it could run
+        return (self.queued if self.started is None else self.started) + self.timeout
+
+
+def _run_stage(func, kwargs, run):
+    run.begin()
+    # Stages run on pool threads, which hold their own DB connections;
+    # release them the same way Django does at the end of a request.
+    close_old_connections()
+    try:
+        return func(**kwargs)
+    finally:
+        close_old_connections()
+
+
+class Pipeline:
+    """
+    Runs named stages on the shared thread pool, starting each one as soon
+    as every stage it requires has succeeded.
+
+    A stage that raises, or runs past its timeout, is recorded in
+    ``errors`` and the stages depending on it are skipped; everything else
+    still completes, so callers get partial results instead of a failure.
+    """
+
+    def __init__(self, timeouts=None, default_timeout=30):
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.stages = {}
+        self.db_stages = set()
+
+    def add(self, name, func, requires=(), db=False):
+        """Add stage ``name``; ``db`` marks stages that query the database."""
+        missing = [dep for dep in requires if dep not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {name} requires unknown stages: {', '.join(missing)}")
+        self.stages[name] = (func, tuple(requires))
+        if db:
+            self.db_stages.add(name)
+        return self
+
+    def _start(self, func, kwargs, run):
+        executor = stage_executor(run.name, db=run.name in self.db_stages)
+        return executor.submit(metrics.in_context(_run_stage), func, kwargs, run)
+
+    def _start_ready(self, waiting, running, result):
+        """Start every waiting stage whose requirements are met."""
+        for name, (func, requires) in list(waiting.items()):
+            failed = [dep for dep in requires if dep in result.errors]
+            if failed:
+                del waiting[name]
+                result.errors[name] = f"skipped: {', '.join(failed)} failed"
+            elif all(result.ok(dep) for dep in requires):
+                del waiting[name]
+                kwargs = {dep: result.results[dep] for dep in requires}
+                run = StageRun(name, self.timeouts.get(name, self.default_timeout))
+                running[self._start(func, kwargs, run)] = run
+
+    def _finish(self, done, running, result):
+        now = time.perf_counter()
+        for future in done:
+            run = running.pop(future)
+            result.timings[run.name] = now - run.queued
+            try:
+                result.results[run.name] = future.result()
+                metrics.STAGES.observe(now - run.queued, run.name, 'ok')
+            except Exception as e:
+                logger.error(f"Stage {run.name} failed: {str(e)}")
+                result.errors[run.name] = str(e) or e.__class__.__name__
+                metrics.STAGES.observe(now - run.queued, run.name, 'failed')
+
+        for future, run in list(running.items()):
+            if now >= run.deadline:
+                running.pop(future)
+                # Only drops the stage from the queue if it never started
+                future.cancel()
+                result.timings[run.name] = now - run.queued
+                result.errors[run.name] = 'timed out'
+                metrics.STAGES.observe(now - run.queued, run.name, 'timed out')
+                if run.started is None:
+                    logger.warning(f"Stage {run.name} timed out waiting {now - run.queued:.2f}s for a thread")
+                else:
+                    logger.warning(f"Stage {run.name} timed out after {now - run.started:.2f}s")
+
+    @staticmethod
+    def _next_deadline(running):
+        # Recomputed on every wake-up, since queued stages move their deadline when they start
+        return max(0, min(run.deadline for run in running.values()) - time.perf_counter())
+
+    def run(self):
+        result = PipelineResult()
+        waiting = dict(self.stages)
+        running = {}
+
+        while waiting or running:
+            self._start_ready(waiting, running, result)
+            if not running:
+                continue
+            done, _ = wait(running, timeout=self._next_deadline(running), return_when=FIRST_COMPLETED)
+            # A timed-out thread cannot be interrupted; it finishes in the
+            # background and its result is discarded.
+            self._finish(done, running, result)
+
+        return result
+
+    def run_in_background(self):
+        """
+        Start ``run`` on a thread of its own and return a Future for the
+        PipelineResult. It gets its own thread rather than a pool slot so it
+        can never wait on stages queued behind itself.
+        """
+        future = Future()
+
+        def target():
+            try:
+                future.set_result(self.run())
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=metrics.in_context(target), name='pipeline', daemon=True).start()
+        return future
+
+
+class AsyncPipeline(Pipeline):
+    """
+    ``Pipeline`` for async views. Stages are coroutine functions run as
+    tasks on the event loop, so waiting on upstreams holds no thread, and a
+    stage that overruns its timeout is cancelled instead of left running.
+    """
+
+    def _start(self, func, kwargs, run):
+        run.begin()
+        return asyncio.ensure_future(func(**kwargs))
+
+    async def run(self):
+        result = PipelineResult()
+        waiting = dict(self.stages)
+        running = {}
+
+        while waiting or running:
+            self._start_ready(waiting, running, result)
+            if not running:
+                continue
+            done, _ = await asyncio.wait(running, timeout=self._next_deadline(running), return_when=asyncio.FIRST_COMPLETED)
+            self._finish(done, running, result)
+
+        return result
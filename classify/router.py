@@ -0,0 +1,196 @@
+import logging
+from collections import deque
+from django.conf import settings
+from .cache import normalize_query
+from .utils import classify_page, aclassify_page
+
+logger = logging.getLogger(__name__)
+
+# Keyword weights per page category. Words that on their own settle the
+# intent weigh more than ones that only hint at it. Keywords are matched
+# in every language regardless of the ``lang`` sent by the client, so
+# mixed-language queries still hit. A keyword only matches whole words;
+# its inflections are listed with it, separated by '|', and count as the
+# same keyword.
+page_keywords = {
+    "medibot": {
+        "en": {"symptom|symptoms": 2, "fever|fevers": 2, "headache|headaches": 2, "cough|coughing": 2,
+               "cold": 1, "flu": 2, "pain|pains": 1, "ache|aches": 1, "sick": 1, "ill": 1,
+               "disease|diseases": 2, "medicine|medicines": 1, "remedy|remedies": 2, "cure|cures": 2,
+               "treatment|treatments": 1, "vomit|vomits|vomited|vomiting": 2, "nausea|nauseous": 2,
+               "diarrhea": 2, "diabetes": 2, "infection|infections": 1, "sore throat": 3, "what is": 1,
+               "why do": 1, "how to treat": 3},
+        "hi": {"लक्षण": 2, "बुखार": 2, "सिरदर्द": 2, "खांसी": 2, "सर्दी": 1, "जुकाम": 2, "दर्द": 1,
+               "बीमार": 1, "बीमारी": 2, "दवा|दवाई|दवाइयां": 1, "इलाज": 2, "उल्टी": 2, "दस्त": 2, "मधुमेह": 2},
+    },
+    "mediscanner": {
+        "en": {"wound|wounds": 3, "injury|injuries": 3, "injured": 3, "bleeding": 3,
+               "burn|burns|burnt|burned": 2, "fracture|fractures|fractured": 3, "bruise|bruises|bruised": 3,
+               "scan|scanning": 2, "scanner": 3, "bite|bites|bitten": 2, "swelling|swollen": 2,
+               "cut myself": 3, "got hurt": 3},
+        "hi": {"घाव": 3, "चोट": 3, "खून": 2, "जल गया": 3, "जलना": 2, "हड्डी टूट|हड्डी टूटी": 3, "सूजन": 2,
+               "स्कैन": 2, "काट|काटा": 1},
+    },
+    "user_profile": {
+        "en": {"profile|profiles": 1, "my account": 2, "my details": 2, "my information": 2, "show my": 2,
+               "view my": 2, "who am i": 3},
+        "hi": {"प्रोफाइल": 1, "मेरी जानकारी": 2, "मेरा खाता": 2, "मेरा विवरण": 2, "दिखाओ": 1},
+    },
+    "upload_prescription": {
+        "en": {"prescription|prescriptions": 3, "upload|uploading": 2, "medical record|medical records": 3,
+               "lab report|lab reports": 3, "report|reports": 1},
+        "hi": {"पर्चा": 3, "पर्ची": 3, "नुस्खा": 3, "अपलोड": 2, "रिपोर्ट": 1, "रिकॉर्ड": 1},
+    },
+    "book_appointment": {
+        "en": {"appointment|appointments": 3, "book|booking": 1, "consult|consulting": 2, "consultation": 2,
+               "schedule|scheduling": 2, "slot|slots": 2, "talk to a doctor": 3, "see a doctor": 3},
+        "hi": {"अपॉइंटमेंट": 3, "मिलने का समय": 3, "परामर्श": 2, "बुक": 1, "डॉक्टर से बात": 3, "डॉक्टर को दिखाना": 3},
+    },
+    "community": {
+        "en": {"community": 3, "awareness": 3, "public health": 3, "forum|forums": 3, "campaign|campaigns": 2,
+               "health tips": 2, "camp|camps": 2, "vaccination drive": 3},
+        "hi": {"समुदाय": 3, "जागरूकता": 3, "सार्वजनिक स्वास्थ्य": 3, "शिविर": 2, "अभियान": 2},
+    },
+    "edit_profile": {
+        "en": {"edit|editing": 3, "update|updating": 3, "change my": 2, "modify": 3, "change": 2},
+        "hi": {"बदलना": 3, "बदलो": 3, "अपडेट": 3, "संपादित": 3, "सुधार": 2},
+    },
+    "search_doctor": {
+        "en": {"find a doctor": 3, "search doctor": 3, "doctor near|doctors near": 3,
+               "specialist|specialists": 2, "doctor|doctors": 1, "cardiologist|cardiologists": 3,
+               "dermatologist|dermatologists": 3, "dentist|dentists": 3, "pediatrician|pediatricians": 3,
+               "neurologist|neurologists": 3, "gynecologist|gynecologists": 3, "near me": 1},
+        "hi": {"डॉक्टर खोज": 3, "विशेषज्ञ": 2, "डॉक्टर": 1, "पास में": 1, "नजदीक": 1},
+    },
+}
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over every keyword of every category, so a query
+    is scanned once no matter how large the table gets.
+
+    A match has to start and end at a word boundary, so "camp" does not
+    fire on "campus" nor "burn" on "burning"; inflections that should match
+    are listed in the table instead.
+    """
+
+    def __init__(self, table):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for category, languages in table.items():
+            for keywords in languages.values():
+                for variants, weight in keywords.items():
+                    canonical = normalize_query(variants.split('|')[0])
+                    for variant in variants.split('|'):
+                        self._add(normalize_query(variant), canonical, category, weight)
+        self._link()
+
+    def _add(self, keyword, canonical, category, weight):
+        state = 0
+        for ch in keyword:
+            if ch not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][ch] = len(self.goto) - 1
+            state = self.goto[state][ch]
+        self.output[state].append((len(keyword), canonical, category, weight))
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def matches(self, text):
+        """Yield ``(start, end, keyword, category, weight)`` for every keyword found in ``text``."""
+        state = 0
+        for end, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            if end + 1 < len(text) and text[end + 1] != ' ':
+                continue
+            for length, keyword, category, weight in self.output[state]:
+                start = end - length + 1
+                if start > 0 and text[start - 1] != ' ':
+                    continue
+                yield start, end + 1, keyword, category, weight
+
+
+class KeywordRouter:
+    def __init__(self, table):
+        self.matcher = KeywordMatcher(table)
+
+    def evidence(self, text):
+        """
+        ``{category: (score, distinct keywords)}``. A match inside a longer
+        one ("change" in "change my", "doctor" in "see a doctor") is the same
+        evidence and is not counted again.
+        """
+        found = list(self.matcher.matches(normalize_query(text)))
+        evidence = {}
+        seen = set()
+        for start, end, keyword, category, weight in found:
+            if any(other[0] <= start and end <= other[1] and (other[1] - other[0]) > (end - start) for other in found):
+                continue
+            if (keyword, category) not in seen:
+                seen.add((keyword, category))
+                score, keywords = evidence.get(category, (0, 0))
+                evidence[category] = (score + weight, keywords + 1)
+        return evidence
+
+    def scores(self, text):
+        return {category: score for category, (score, _) in self.evidence(text).items()}
+
+    def route(self, text):
+        """
+        Return ``(category, confidence)``. Confidence is how far the best
+        category is ahead of the runner-up when its evidence is conclusive
+        (a weight of 3 or more, or more than one distinct keyword), and half
+        of that otherwise, so a single weak keyword never clears the default
+        threshold and the LLM decides.
+        """
+        evidence = self.evidence(text)
+        if not evidence:
+            return None, 0.0
+        ranked = sorted(evidence.items(), key=lambda item: item[1][0], reverse=True)
+        category, (top, keywords) = ranked[0]
+        runner_up = ranked[1][1][0] if len(ranked) > 1 else 0
+        margin = (top - runner_up) / top
+        conclusive = top >= 3 or keywords > 1
+        return category, round(margin if conclusive else margin / 2, 3)
+
+
+page_router = KeywordRouter(page_keywords)
+
+
+def route_page(input_text, lang):
+    """
+    Classify a navigation query, answering from the keyword matcher when it
+    is confident enough and falling back to the LLM otherwise.
+
+    Returns ``(category, source)`` where source is ``'keywords'`` or ``'llm'``.
+    """
+    category, confidence = page_router.route(input_text)
+    if category and confidence >= settings.NAVIGATION_KEYWORD_THRESHOLD:
+        logger.info(f"Keyword router matched {category} (confidence {confidence})")
+        return category, 'keywords'
+    return classify_page(input_text, lang), 'llm'
+
+
+async def aroute_page(input_text, lang):
+    """``route_page`` for async views: only the LLM fallback is awaited."""
+    category, confidence = page_router.route(input_text)
+    if category and confidence >= settings.NAVIGATION_KEYWORD_THRESHOLD:
+        logger.info(f"Keyword router matched {category} (confidence {confidence})")
+        return category, 'keywords'
+    return await aclassify_page(input_text, lang), 'llm'
@@ -0,0 +1,305 @@
+"""
+Speech recognition for voice input.
+
+Every configured language is tried at once on a shared thread pool and the
+most confident transcript wins, so a Hindi utterance costs one round trip
+instead of a failed English attempt followed by a Hindi one. The engine is
+pluggable: 'google' uses the Google Web Speech API, 'vosk' runs offline
+against local Vosk models (one directory per language under
+VOSK_MODEL_DIR, e.g. ``en-IN/`` and ``hi-IN/``).
+"""
+import os
+import time
+import json
+import asyncio
+import logging
+import threading
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+from functools import lru_cache
+import httpx
+import speech_recognition as sr
+from speech_recognition.recognizers import google as google_recognizer
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from ror_django_backend import metrics
+from . import audio
+
+try:
+    import vosk
+except ImportError:
+    vosk = None
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=settings.SPEECH_WORKERS, thread_name_prefix='speech')
+# Segments get a pool of their own: each one waits on language attempts
+# queued on ``executor`` and must not take the threads those need
+segment_executor = ThreadPoolExecutor(max_workers=settings.SPEECH_SEGMENT_WORKERS, thread_name_prefix='speech-segment')
+
+Transcript = namedtuple('Transcript', ['text', 'language', 'confidence'])
+Segment = namedtuple('Segment', ['index', 'start', 'end', 'text', 'language', 'confidence', 'elapsed'])
+Transcription = namedtuple('Transcription', ['text', 'language', 'confidence', 'segments'])
+
+
+class GoogleBackend:
+    def __init__(self, endpoint=None):
+        self.endpoint = endpoint
+        self.recognizer = sr.Recognizer()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def recognize(self, audio_data, language):
+        """Return ``(text, confidence)``; raises ``sr.UnknownValueError`` when nothing was understood."""
+        with metrics.span('speech'):
+            return self.recognizer.recognize_google(
+                audio_data, language=language, with_confidence=True, endpoint=self.endpoint or settings.GOOGLE_SPEECH_URL,
+            )
+
+    def request_builder(self, language):
+        return google_recognizer.create_request_builder(endpoint=self.endpoint or settings.GOOGLE_SPEECH_URL, language=language)
+
+    def encode(self, audio_data):
+        """The FLAC request body; the same for every language, so async callers encode it once."""
+        return self.request_builder('en-US').build_data(audio_data)
+
+    async def arecognize(self, audio_data, language, flac_data):
+        builder = self.request_builder(language)
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = httpx.AsyncClient(timeout=settings.SPEECH_TIMEOUT)
+        try:
+            with metrics.span('speech'):
+                response = await client.post(builder.build_url(), content=flac_data, headers=builder.build_headers(audio_data))
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise sr.RequestError(f"recognition request failed: {str(e)}")
+        return google_recognizer.OutputParser(show_all=False, with_confidence=True).parse(response.text)
+
+
+class VoskBackend:
+    sample_rate = 16000
+
+    def __init__(self, model_dir):
+        if vosk is None:
+            raise ImproperlyConfigured("SPEECH_BACKEND 'vosk' requires the vosk package")
+        vosk.SetLogLevel(-1)
+        self.model_dir = model_dir
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, language):
+        # Models take seconds to load, so each is loaded once and shared
+        with self._lock:
+            if language not in self._models:
+                path = os.path.join(self.model_dir, language)
+                if not os.path.isdir(path):
+                    raise sr.RequestError(f"No Vosk model for {language} in {self.model_dir}")
+                logger.info(f"Loading Vosk model {path}")
+                self._models[language] = vosk.Model(path)
+            return self._models[language]
+
+    def recognize(self, audio_data, language):
+        recognizer = vosk.KaldiRecognizer(self.model(language), self.sample_rate)
+        recognizer.SetWords(True)
+        recognizer.AcceptWaveform(audio_data.get_raw_data(convert_rate=self.sample_rate, convert_width=2))
+        result = json.loads(recognizer.FinalResult())
+        text = result.get('text', '').strip()
+        if not text:
+            raise sr.UnknownValueError()
+        words = result.get('result') or []
+        confidence = sum(word['conf'] for word in words) / len(words) if words else 0.5
+        return text, confidence
+
+
+BACKENDS = {
+    'google': GoogleBackend,
+    'vosk': lambda: VoskBackend(settings.VOSK_MODEL_DIR),
+}
+
+
+@lru_cache(maxsize=4)
+def _backend(name):
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown SPEECH_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}")
+
+
+def get_backend(name=None):
+    return _backend(name or settings.SPEECH_BACKEND)
+
+
+def recognize(audio_data, languages=None, backend=None):
+    """
+    Transcribe ``audio_data`` in every language at once and return the most
+    confident Transcript, or None if no language produced any text.
+
+    A transcript at or above SPEECH_ACCEPT_CONFIDENCE is returned as soon
+    as it arrives without waiting for the other languages; equal confidences
+    go to the language listed first. Raises ``sr.RequestError`` only when
+    every attempt failed to reach the engine.
+    """
+    languages = list(languages or settings.SPEECH_LANGUAGES)
+    backend = backend or get_backend()
+    futures = {executor.submit(metrics.in_context(backend.recognize), audio_data, language): language for language in languages}
+
+    best = None
+    failures = []
+    try:
+        for future in as_completed(futures, timeout=settings.SPEECH_TIMEOUT):
+            language = futures[future]
+            try:
+                text, confidence = future.result()
+            except sr.UnknownValueError:
+                logger.info(f"No speech recognized in {language}")
+                continue
+            except sr.RequestError as e:
+                logger.error(f"Speech recognition in {language} failed: {str(e)}")
+                failures.append(f"{language}: {str(e)}")
+                continue
+
+            candidate = Transcript(text, language, confidence)
+            if best is None or (confidence, -languages.index(language)) > (best.confidence, -languages.index(best.language)):
+                best = candidate
+            if confidence >= settings.SPEECH_ACCEPT_CONFIDENCE:
+                break
+    except TimeoutError:
+        logger.warning(f"Speech recognition timed out after {settings.SPEECH_TIMEOUT}s")
+    finally:
+        for future in futures:
+            future.cancel()
+
+    if best is None and len(failures) == len(languages):
+        raise sr.RequestError('; '.join(failures))
+    return best
+
+
+def recognize_segment(index, audio_data, start, end, languages, backend):
+    started = time.perf_counter()
+    segment_audio = sr.AudioData(audio_data.frame_data[start:end], audio_data.sample_rate, audio_data.sample_width)
+    try:
+        transcript = recognize(segment_audio, languages, backend)
+    except sr.RequestError as e:
+        logger.error(f"Segment {index} could not be recognized: {str(e)}")
+        transcript = None
+    return segment_result(index, audio_data, start, end, transcript, time.perf_counter() - started)
+
+
+def segment_result(index, audio_data, start, end, transcript, elapsed):
+    bytes_per_second = audio_data.sample_rate * audio_data.sample_width
+    return Segment(
+        index,
+        start / bytes_per_second,
+        end / bytes_per_second,
+        transcript.text if transcript else '',
+        transcript.language if transcript else None,
+        transcript.confidence if transcript else 0.0,
+        elapsed,
+    )
+
+
+def transcribe(audio_data, languages=None, backend=None):
+    """
+    Recognize long 16 kHz mono audio as segments split at pauses (see
+    ``audio.split_segments``), all in parallel, and stitch the text back in
+    order. Returns a Transcription whose ``segments`` carry each segment's
+    position and recognition time, or None if nothing was recognized. The
+    language and confidence are those of the majority of recognized speech.
+    """
+    backend = backend or get_backend()
+    ranges = audio.split_segments(audio_data.frame_data)
+    futures = [
+        segment_executor.submit(metrics.in_context(recognize_segment), index, audio_data, start, end, languages, backend)
+        for index, (start, end) in enumerate(ranges)
+    ]
+    return combine_segments([future.result() for future in futures])
+
+
+def combine_segments(segments):
+    recognized = [segment for segment in segments if segment.text]
+    if not recognized:
+        return None
+
+    seconds = {}
+    for segment in recognized:
+        seconds[segment.language] = seconds.get(segment.language, 0) + segment.end - segment.start
+    language = max(seconds, key=seconds.get)
+    confidence = sum(segment.confidence * (segment.end - segment.start) for segment in recognized) / sum(seconds.values())
+    text = ' '.join(segment.text for segment in recognized)
+    logger.info(f"Transcribed {len(segments)} segment(s), {len(recognized)} with speech")
+    return Transcription(text, language, confidence, segments)
+
+
+# Async recognition, for the ASGI voice endpoint. With the Google backend
+# every segment x language request is awaited on the event loop; only FLAC
+# encoding goes to a thread. Other backends are CPU-bound and run the
+# threaded ``transcribe`` off the loop instead.
+
+async def arecognize(audio_data, languages=None, backend=None, flac_data=None):
+    """``recognize`` on the event loop, with the same early-accept and failure rules."""
+    languages = list(languages or settings.SPEECH_LANGUAGES)
+    backend = backend or get_backend()
+    if flac_data is None:
+        flac_data = await sync_to_async(backend.encode, thread_sensitive=False)(audio_data)
+
+    async def attempt(language):
+        try:
+            text, confidence = await backend.arecognize(audio_data, language, flac_data)
+        except sr.UnknownValueError:
+            logger.info(f"No speech recognized in {language}")
+            return language, None, None
+        except sr.RequestError as e:
+            logger.error(f"Speech recognition in {language} failed: {str(e)}")
+            return language, None, f"{language}: {str(e)}"
+        return language, Transcript(text, language, confidence), None
+
+    tasks = [asyncio.ensure_future(attempt(language)) for language in languages]
+    best = None
+    failures = []
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=settings.SPEECH_TIMEOUT):
+            language, candidate, failure = await next_done
+            if failure:
+                failures.append(failure)
+            if candidate is None:
+                continue
+            if best is None or (candidate.confidence, -languages.index(language)) > (best.confidence, -languages.index(best.language)):
+                best = candidate
+            if candidate.confidence >= settings.SPEECH_ACCEPT_CONFIDENCE:
+                break
+    except asyncio.TimeoutError:
+        logger.warning(f"Speech recognition timed out after {settings.SPEECH_TIMEOUT}s")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if best is None and len(failures) == len(languages):
+        raise sr.RequestError('; '.join(failures))
+    return best
+
+
+async def arecognize_segment(index, audio_data, start, end, languages, backend):
+    started = time.perf_counter()
+    segment_audio = sr.AudioData(audio_data.frame_data[start:end], audio_data.sample_rate, audio_data.sample_width)
+    try:
+        transcript = await arecognize(segment_audio, languages, backend)
+    except sr.RequestError as e:
+        logger.error(f"Segment {index} could not be recognized: {str(e)}")
+        transcript = None
+    return segment_result(index, audio_data, start, end, transcript, time.perf_counter() - started)
+
+
+async def atranscribe(audio_data, languages=None, backend=None):
+    """``transcribe`` for async views."""
+    backend = backend or get_backend()
+    if not hasattr(backend, 'arecognize'):
+        return await sync_to_async(transcribe, thread_sensitive=False)(audio_data, languages, backend)
+    ranges = audio.split_segments(audio_data.frame_data)
+    segments = await asyncio.gather(*(
+        arecognize_segment(index, audio_data, start, end, languages, backend)
+        for index, (start, end) in enumerate(ranges)
+    ))
+    return combine_segments(list(segments))
@@ -1,3 +1,561 @@
-from django.test import TestCase
+import io
+import os
+import asyncio
+import inspect
+import re
+import json
+import math
+import wave
+import time
+import struct
+import tempfile
+import threading
+from unittest import mock
+import numpy as np
+import speech_recognition as sr
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from ror_django_backend.scenarios import BenchGroqHandler
+from ror_django_backend.stubs import StubServer, FakeGroqHandler
+from . import async_views, audio, batch, chatbot, llm, speech, tts, views
+from .views import served_over_asgi
+from .pipeline import Pipeline, stage_executor
+from .cache import ClassificationCache, DjangoCacheBackend, LocalBackend, build_cache, page_cache, specialization_cache
+from .router import page_router, route_page
+from . import utils
+from .utils import aclassify_page, classify_specialization, page_prompt, specialization_prompt
+from user.authentication import generate_token
+from user.models import Patient
 
-# Create your tests here.
+
+class StubGroqMixin:
+    """Points the shared Groq client at a local stub for the duration of each test."""
+    groq_handler = FakeGroqHandler
+    groq_latency = 0.0
+
+    def setUp(self):
+        super().setUp()
+        os.environ.setdefault('GORQ_TEXT_GENERATION_KEY', 'stub-key')
+        self.groq = StubServer(self.groq_handler, latency=self.groq_latency)
+        self.groq.__enter__()
+        self.addCleanup(self.groq.__exit__, None, None, None)
+        settings_override = override_settings(GROQ_BASE_URL=self.groq.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        llm.reset_client()
+        self.addCleanup(llm.reset_client)
+
+
+class SharedClientTests(StubGroqMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        specialization_cache.clear()
+
+    def test_sequential_calls_reuse_one_connection(self):
+        for i in range(10):
+            self.assertEqual(classify_specialization(f'pain in my knee #{i}'), 'medibot')
+        self.assertEqual(self.groq.requests, 10)
+        self.assertEqual(self.groq.connections, 1)
+
+    @override_settings(GROQ_POOL_SIZE=4)
+    def test_concurrent_calls_stay_within_the_pool(self):
+        llm.reset_client()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(llm.chat_completion, [f'query {i}' for i in range(40)]))
+        self.assertEqual(self.groq.requests, 40)
+        self.assertLessEqual(self.groq.connections, 4)
+
+    def test_threads_share_the_client(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            clients = set(pool.map(lambda _: id(llm.get_client()), range(8)))
+        self.assertEqual(len(clients), 1)
+
+
+class ClassificationCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_entries_expire_after_the_ttl(self):
+        answers = ClassificationCache('test', LocalBackend(), ttl=10)
+        answers.set('knee pain', 'orthopedic_surgery')
+        self.assertEqual(answers.get('knee pain'), 'orthopedic_surgery')
+        later = time.monotonic() + 11
+        with mock.patch('classify.cache.time.monotonic', return_value=later):
+            self.assertIsNone(answers.get('knee pain'))
+        self.assertEqual(len(answers.backend._entries), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        answers = ClassificationCache('test', LocalBackend(max_entries=2))
+        answers.set('knee pain', 'orthopedic_surgery')
+        answers.set('rash', 'dermatology')
+        answers.get('knee pain')
+        answers.set('chest pain', 'cardiology')
+        self.assertIsNone(answers.get('rash'))
+        self.assertEqual(answers.get('knee pain'), 'orthopedic_surgery')
+        self.assertEqual(answers.get('chest pain'), 'cardiology')
+
+    def test_rephrasings_share_an_answer(self):
+        answers = ClassificationCache('test', LocalBackend(), similarity_threshold=0.5)
+        answers.set('Book an appointment', 'book_appointment', 'en')
+        # Same tokens once normalized: an exact hit
+        self.assertEqual(answers.get('book an appointment!', 'en'), 'book_appointment')
+        # Three of four tokens shared: a near hit
+        self.assertEqual(answers.get('please book an appointment', 'en'), 'book_appointment')
+        self.assertIsNone(answers.get('please book an appointment', 'hi'))
+        self.assertIsNone(answers.get('open my profile', 'en'))
+        self.assertEqual(answers.stats(), {'hits': 1, 'near_hits': 1, 'misses': 2, 'hit_ratio': 0.5})
+
+    def test_counters_restart_on_clear(self):
+        answers = ClassificationCache('test', LocalBackend())
+        self.assertEqual(answers.stats()['hit_ratio'], 0.0)
+        answers.get('rash')
+        answers.set('rash', 'dermatology')
+        answers.get('rash')
+        answers.get('Rash?')
+        self.assertEqual(answers.stats(), {'hits': 2, 'near_hits': 0, 'misses': 1, 'hit_ratio': 0.6667})
+        answers.clear()
+        self.assertIsNone(answers.get('rash'))
+        self.assertEqual(answers.stats(), {'hits': 0, 'near_hits': 0, 'misses': 1, 'hit_ratio': 0.0})
+
+    def test_django_backend_clears_only_its_namespace(self):
+        pages = ClassificationCache('page', DjangoCacheBackend('default', 'page'))
+        specializations = ClassificationCache('specialization', DjangoCacheBackend('default', 'specialization'))
+        pages.set('open my profile', 'user_profile')
+        async_to_sync(specializations.aset)('rash', 'dermatology')
+        pages.clear()
+        self.assertIsNone(pages.get('open my profile'))
+        self.assertIsNone(async_to_sync(pages.aget)('open my profile'))
+        self.assertEqual(specializations.get('rash'), 'dermatology')
+        pages.set('open my profile', 'user_profile')
+        self.assertEqual(async_to_sync(pages.aget)('open my profile'), 'user_profile')
+
+
+class OffListAnswerTests(StubGroqMixin, SimpleTestCase):
+    # The stub answers 'medibot', a page but not a specialization
+    def setUp(self):
+        super().setUp()
+        page_cache.clear()
+        specialization_cache.clear()
+
+    def test_only_known_labels_are_cached(self):
+        for _ in range(2):
+            self.assertEqual(utils.classify_page('what causes a fever', 'en'), 'medibot')
+            self.assertEqual(classify_specialization('what causes a fever'), 'medibot')
+        self.assertEqual(self.groq.requests, 3)
+        self.assertIsNone(specialization_cache.get('what causes a fever'))
+
+    def test_async_classifiers_cache_alike(self):
+        for _ in range(2):
+            self.assertEqual(async_to_sync(aclassify_page)('what causes a fever', 'en'), 'medibot')
+            self.assertEqual(async_to_sync(utils.aclassify_specialization)('what causes a fever'), 'medibot')
+        self.assertEqual(self.groq.requests, 3)
+
+
+class AsyncClassificationCacheTests(StubGroqMixin, SimpleTestCase):
+    @override_settings(CLASSIFY_CACHE={**settings.CLASSIFY_CACHE, 'BACKEND': 'django', 'CACHE_ALIAS': 'default'})
+    def test_async_views_use_the_async_cache_api(self):
+        cache = build_cache('page')
+        self.assertIsInstance(cache.backend, DjangoCacheBackend)
+        cache.backend.cache.clear()
+        with mock.patch.object(utils, 'page_cache', cache), \
+                mock.patch.object(DjangoCacheBackend, 'get', side_effect=AssertionError('sync get')), \
+                mock.patch.object(DjangoCacheBackend, 'set', side_effect=AssertionError('sync set')):
+            first = async_to_sync(aclassify_page)('a page-classification question', 'en')
+            again = async_to_sync(aclassify_page)('A page classification question?', 'en')
+        self.assertEqual(again, first)
+        self.assertEqual(self.groq.requests, 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+
+class ScriptedSpeechBackend:
+    """Answers each language with a fixed ``(text, confidence)`` or exception, after an optional wait."""
+
+    def __init__(self, answers, hold=()):
+        self.answers = answers
+        self.hold = hold
+        self.released = threading.Event()
+
+    def answer(self, language):
+        answer = self.answers[language]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def recognize(self, audio_data, language):
+        if language in self.hold:
+            self.released.wait(10)
+        return self.answer(language)
+
+    async def arecognize(self, audio_data, language, flac_data):
+        if language in self.hold:
+            await asyncio.get_running_loop().run_in_executor(None, self.released.wait, 10)
+        return self.answer(language)
+
+
+@override_settings(SPEECH_ACCEPT_CONFIDENCE=0.9)
+class SpeechRecognitionTests(SimpleTestCase):
+    languages = ['en-IN', 'hi-IN', 'ta-IN']
+    clip = sr.AudioData(b'\0' * 3200, 16000, 2)
+
+    def recognize(self, backend):
+        self.addCleanup(backend.released.set)
+        return (
+            speech.recognize(self.clip, self.languages, backend),
+            async_to_sync(speech.arecognize)(self.clip, self.languages, backend, flac_data=b''),
+        )
+
+    def test_most_confident_language_wins(self):
+        backend = ScriptedSpeechBackend({
+            'en-IN': ('mera sir dard', 0.5), 'hi-IN': ('मेरा सिर दर्द', 0.8), 'ta-IN': sr.UnknownValueError(),
+        })
+        for transcript in self.recognize(backend):
+            self.assertEqual(transcript, speech.Transcript('मेरा सिर दर्द', 'hi-IN', 0.8))
+
+    def test_ties_go_to_the_language_listed_first(self):
+        backend = ScriptedSpeechBackend({'en-IN': ('fever', 0.7), 'hi-IN': ('fever', 0.7), 'ta-IN': ('fever', 0.7)})
+        for transcript in self.recognize(backend):
+            self.assertEqual(transcript.language, 'en-IN')
+
+    def test_confident_transcript_is_accepted_without_waiting(self):
+        # hi-IN would be more confident, but does not answer until released
+        backend = ScriptedSpeechBackend(
+            {'en-IN': ('headache', 0.95), 'hi-IN': ('सिर दर्द', 0.99), 'ta-IN': sr.UnknownValueError()},
+            hold=('hi-IN',),
+        )
+        started = time.perf_counter()
+        for transcript in self.recognize(backend):
+            self.assertEqual(transcript.language, 'en-IN')
+        self.assertLess(time.perf_counter() - started, 5)
+
+    def test_failure_is_raised_only_when_every_language_failed(self):
+        unreachable = ScriptedSpeechBackend({language: sr.RequestError('unreachable') for language in self.languages})
+        with self.assertRaises(sr.RequestError):
+            speech.recognize(self.clip, self.languages, unreachable)
+        with self.assertRaises(sr.RequestError):
+            async_to_sync(speech.arecognize)(self.clip, self.languages, unreachable, flac_data=b'')
+        silent = ScriptedSpeechBackend({**unreachable.answers, 'ta-IN': sr.UnknownValueError()})
+        self.assertEqual(self.recognize(silent), (None, None))
+
+
+class LazyVoiceResponseTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = mock.patch.object(tts, 'store', tts.AudioStore(directory.name, 10 * 1024 * 1024))
+        store.start()
+        self.addCleanup(store.stop)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def slow_synthesize(self, text, lang):
+        self.release.wait(10)
+        return b'ID3' + text.encode()
+
+    def test_url_is_handed_out_before_the_audio_exists(self):
+        with mock.patch.object(tts, 'synthesize', self.slow_synthesize):
+            started = time.perf_counter()
+            key = tts.render_later('drink water', 'en')
+            self.assertLess(time.perf_counter() - started, 1)
+            self.assertIsNone(tts.store.get(key))
+            # A fetch during the render waits for it instead of failing
+            threading.Timer(0.2, self.release.set).start()
+            response = self.client.get(tts.audio_url(key))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response), b'ID3drink water')
+
+    def test_pending_audio_is_rendered_on_demand(self):
+        # As in a worker that did not start the render
+        key = tts.audio_key('drink water', 'en')
+        cache.set(f'tts-pending:{key}', ('drink water', 'en'))
+        with mock.patch.object(tts, 'synthesize', lambda text, lang: b'ID3' + text.encode()):
+            response = self.client.get(tts.audio_url(key))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(tts.store.get(key), b'ID3drink water')
+
+    def test_unknown_audio_is_not_found(self):
+        self.assertEqual(self.client.get(tts.audio_url(tts.audio_key('drink water', 'en'))).status_code, 404)
+
+
+@mock.patch.object(tts, 'synthesize', lambda text, lang: b'ID3' + text.encode())
+@mock.patch.object(tts.AudioStore, 'put', side_effect=PermissionError('Read-only file system'))
+class ReadOnlyAudioStoreTests(SimpleTestCase):
+    def test_text_to_voice_still_answers(self, put):
+        response = self.client.post(reverse('text-to-voice'), {'text': 'drink water', 'lang': 'en'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'ID3drink water')
+
+    def test_render_fails_without_the_store(self, put):
+        with self.assertRaises(PermissionError):
+            tts.render('drink water', 'en')
+
+
+class WavResamplingTests(SimpleTestCase):
+    def wav(self, rate, seconds=2):
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            samples = (int(8000 * math.sin(2 * math.pi * 440 * i / rate)) for i in range(rate * seconds))
+            wav.writeframes(b''.join(struct.pack('<hh', sample, sample) for sample in samples))
+        buffer.seek(0)
+        return buffer
+
+    def resampled_seconds(self):
+        return audio.pcm_seconds(sum(len(pcm) for pcm in audio.wav_chunks(self.wav(44100))))
+
+    def test_resamples_to_16khz_mono(self):
+        self.assertAlmostEqual(self.resampled_seconds(), 2, places=2)
+
+    def test_chunk_edges_are_seamless(self):
+        pcm = b''.join(struct.pack('<h', int(8000 * math.sin(i / 7))) for i in range(44100))
+        whole, _ = audio.resample(pcm, 44100)
+        chunked, state = b'', None
+        for start in range(0, len(pcm), 1234):
+            part, state = audio.resample(pcm[start:start + 1234], 44100, state)
+            chunked += part
+        # Equal up to float rounding of the carried phase
+        whole, chunked = (np.frombuffer(pcm, dtype='<i2').astype(int) for pcm in (whole, chunked))
+        self.assertEqual(len(chunked), len(whole))
+        self.assertLessEqual(np.abs(chunked - whole).max(), 1)
+
+
+class SplitSegmentsTests(SimpleTestCase):
+    # Segments of 3 s are 100 frames of 30 ms; pauses of 240 ms are 8 frames
+    class Detector:
+        def is_voiced(self, frame):
+            return frame[:1] != b'\0'
+
+    def split(self, *runs):
+        """Segments, in frames, of audio made of ``(voiced, frames)`` runs."""
+        pcm = b''.join((b'\1' if voiced else b'\0') * frames * audio.FRAME_BYTES for voiced, frames in runs)
+        segments = audio.split_segments(pcm, max_seconds=3, min_pause_ms=240, detector=self.Detector())
+        self.assertEqual(segments[-1][1], len(pcm))
+        return [(start // audio.FRAME_BYTES, end // audio.FRAME_BYTES) for start, end in segments]
+
+    def test_cut_goes_in_the_middle_of_a_pause(self):
+        self.assertEqual(self.split((True, 70), (False, 10), (True, 70)), [(0, 75), (75, 150)])
+
+    def test_latest_pause_before_the_limit_is_used(self):
+        self.assertEqual(self.split((True, 55), (False, 10), (True, 20), (False, 10), (True, 55)), [(0, 90), (90, 150)])
+
+    def test_speech_without_a_pause_is_cut_at_the_limit(self):
+        self.assertEqual(self.split((True, 250)), [(0, 100), (100, 200), (200, 250)])
+        # Too short a pause, and one too early to leave a useful segment
+        self.assertEqual(self.split((True, 70), (False, 5), (True, 75)), [(0, 100), (100, 150)])
+        self.assertEqual(self.split((True, 20), (False, 10), (True, 120)), [(0, 100), (100, 150)])
+
+    def test_short_audio_is_one_segment(self):
+        self.assertEqual(self.split((True, 30), (False, 20)), [(0, 50)])
+        self.assertEqual(audio.split_segments(b'', detector=self.Detector()), [(0, 0)])
+
+
+@override_settings(CHATBOT_STAGE_WORKERS=1)
+class PipelineTimeoutTests(SimpleTestCase):
+    def setUp(self):
+        # Pools are per stage name and created on first use, so each test uses its own names
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def occupy(self, stage):
+        """Take the only thread of ``stage``'s pool until the test ends."""
+        started = threading.Event()
+        stage_executor(stage).submit(lambda: (started.set(), self.release.wait()))
+        started.wait()
+
+    def test_timeout_counts_from_when_the_stage_starts(self):
+        stage_executor('queued').submit(time.sleep, 0.3)
+        pipeline = Pipeline(timeouts={'queued': 0.5}).add('queued', lambda: time.sleep(0.3) or 'done')
+        result = pipeline.run()
+        self.assertEqual(result.results, {'queued': 'done'})
+        self.assertGreater(result.timings['queued'], 0.5)
+
+    @override_settings(CHATBOT_STAGE_WORKERS=8, CHATBOT_DB_STAGE_WORKERS=2)
+    def test_database_stages_get_a_small_pool(self):
+        Pipeline().add('db-stage', lambda: 'done', db=True).run()
+        # The pipeline created the stage's pool; it never grows past two threads
+        def thread():
+            time.sleep(0.01)
+            return threading.get_ident()
+        futures = [stage_executor('db-stage').submit(thread) for _ in range(10)]
+        self.assertEqual(len({future.result() for future in futures}), 2)
+
+    def test_stuck_stage_does_not_hold_up_the_others(self):
+        self.occupy('stuck')
+        started = time.perf_counter()
+        pipeline = Pipeline(timeouts={'stuck': 0.2, 'other': 0.2})
+        pipeline.add('stuck', lambda: 'never').add('other', lambda: 'done')
+        result = pipeline.run()
+        self.assertEqual(result.results, {'other': 'done'})
+        self.assertEqual(result.errors, {'stuck': 'timed out'})
+        self.assertLess(time.perf_counter() - started, 1)
+
+
+class ChatbotStagesTests(SimpleTestCase):
+    def shape(self, pipeline):
+        return {name: requires for name, (_, requires) in pipeline.stages.items()}, pipeline.db_stages
+
+    def test_sync_and_async_pipelines_run_the_same_stages(self):
+        pipeline = views.chatbot_pipeline('knee pain', 'en', '+919800000001')
+        apipeline = async_views.chatbot_pipeline('knee pain', 'en', '+919800000001')
+        self.assertEqual(list(pipeline.stages), [name for name, _, _ in chatbot.STAGES])
+        self.assertEqual(self.shape(apipeline), self.shape(pipeline))
+        # A stage added to STAGES without an async version would run blocking on the event loop
+        for name, (func, _) in apipeline.stages.items():
+            self.assertTrue(inspect.iscoroutinefunction(func), name)
+        for name, (func, _) in pipeline.stages.items():
+            self.assertFalse(inspect.iscoroutinefunction(func), name)
+
+    def test_optional_stages_are_left_out(self):
+        streamed = views.chatbot_pipeline('knee pain', 'en', '+919800000001', remedy=False)
+        self.assertEqual(list(streamed.stages), ['specialization', 'profile', 'doctors', 'hospitals'])
+        with override_settings(CHATBOT_VOICE_RESPONSE=False):
+            for pipeline in (views.chatbot_pipeline('knee pain', 'en', None), async_views.chatbot_pipeline('knee pain', 'en', None)):
+                self.assertNotIn('voice', pipeline.stages)
+                self.assertIn('remedy', pipeline.stages)
+
+
+class NavigationStreamTests(StubGroqMixin, SimpleTestCase):
+    groq_handler = type('RemedyHandler', (FakeGroqHandler,), {'reply': 'Rest and drink plenty of fluids'})
+
+    def events(self, content):
+        events = []
+        for block in content.decode().strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def stream(self, query):
+        response = self.client.post(reverse('check-navigation-stream'), {'query': query}, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return self.events(b''.join(response.streaming_content))
+
+    def test_medibot_answer_is_streamed(self):
+        events = self.stream('feeling nauseous and I vomited twice')
+        self.assertEqual(events[0], ('category', {'category': 'medibot'}))
+        self.assertEqual(''.join(data['text'] for event, data in events if event == 'token'), 'Rest and drink plenty of fluids')
+        self.assertGreater(len(events), 3)
+        self.assertEqual(events[-1], ('done', {}))
+
+    def test_other_pages_send_only_the_category(self):
+        self.assertEqual(self.stream('I want to book an appointment'), [('category', {'category': 'book_appointment'}), ('done', {})])
+        self.assertEqual(self.groq.requests, 0)
+
+    def test_asgi_requests_are_told_apart(self):
+        self.assertTrue(served_over_asgi(AsyncRequestFactory().post('/')))
+        self.assertFalse(served_over_asgi(RequestFactory().post('/')))
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_streams_under_asgi(self):
+        async def stream():
+            response = await AsyncClient().post(
+                reverse('check-navigation-stream'), {'query': 'feeling nauseous and I vomited twice'}, content_type='application/json',
+            )
+            return b''.join([chunk async for chunk in response.streaming_content])
+        events = self.events(async_to_sync(stream)())
+        self.assertEqual([event for event, _ in events][:2], ['category', 'token'])
+        self.assertEqual(events[-1], ('done', {}))
+
+
+class KeywordRouterTests(SimpleTestCase):
+    def confident(self, text):
+        category, confidence = page_router.route(text)
+        return category if confidence >= settings.NAVIGATION_KEYWORD_THRESHOLD else None
+
+    def test_conclusive_evidence_is_routed_locally(self):
+        self.assertEqual(self.confident('I want to book an appointment'), 'book_appointment')
+        self.assertEqual(self.confident('find a cardiologist near me'), 'search_doctor')
+        self.assertEqual(self.confident('feeling nauseous and I vomited twice'), 'medibot')
+        self.assertEqual(self.confident('scan my wound'), 'mediscanner')
+
+    def test_single_weak_keyword_is_left_to_the_llm(self):
+        self.assertIsNone(self.confident('change in my skin color with itching'))
+        self.assertIsNone(self.confident('there is a camp near my campus'))
+        self.assertIsNone(self.confident('मुझे बुखार है'))
+
+    def test_keywords_match_whole_words_only(self):
+        self.assertEqual(page_router.scores('I have a burning sensation while urinating'), {})
+        self.assertEqual(page_router.scores('my campus'), {})
+        self.assertEqual(page_router.scores('the camps'), {'community': 2})
+
+    def test_listed_inflections_count_once(self):
+        self.assertEqual(page_router.evidence('symptom or symptoms'), {'medibot': (2, 1)})
+
+    def test_match_inside_longer_match_is_not_counted_again(self):
+        self.assertEqual(page_router.evidence('change my number'), {'edit_profile': (2, 1)})
+        self.assertEqual(page_router.evidence('I want to see a doctor'), {'book_appointment': (3, 1)})
+
+    def test_tied_categories_are_left_to_the_llm(self):
+        self.assertIsNone(self.confident('update on the vaccination drive'))
+
+
+class RoutePageTests(StubGroqMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        page_cache.clear()
+
+    def test_misleading_keywords_fall_back_to_the_llm(self):
+        for text in ('change in my skin color with itching', 'I have a burning sensation while urinating',
+                     'there is a camp near my campus'):
+            with self.subTest(text=text):
+                self.assertEqual(route_page(text, 'en'), ('medibot', 'llm'))
+        self.assertEqual(self.groq.requests, 3)
+
+    def test_confident_match_makes_no_llm_call(self):
+        self.assertEqual(route_page('I want to book an appointment', 'en'), ('book_appointment', 'keywords'))
+        self.assertEqual(self.groq.requests, 0)
+
+
+class BatchClassifyTests(StubGroqMixin, SimpleTestCase):
+    groq_handler = BenchGroqHandler
+
+    def setUp(self):
+        super().setUp()
+        page_cache.clear()
+        specialization_cache.clear()
+        cache.clear()
+
+    def post(self, body, pk=1):
+        # Tokens are checked without a lookup, so the patient need not be saved
+        token = generate_token(Patient(pk=pk, phonenumber=f'90000000{pk:02d}'))
+        return self.client.post(reverse('classify-batch'), json.dumps(body), content_type='application/json',
+                                headers={'Authorization': f'Bearer {token}'})
+
+    def test_anonymous_requests_are_refused(self):
+        response = self.client.post(reverse('classify-batch'), json.dumps({'queries': ['what causes a fever']}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.groq.requests, 0)
+
+    @override_settings(BATCH_CLASSIFY_RATE='2/hour')
+    def test_each_user_is_throttled(self):
+        body = {'queries': ['what causes a fever']}
+        self.assertEqual([self.post(body).status_code for _ in range(3)], [200, 200, 429])
+        self.assertEqual(self.post(body, pk=2).status_code, 200)
+
+    def offered(self, prompt):
+        """The quoted labels on the first line of a single-query prompt."""
+        return re.findall(r"'(\w+)'", prompt.split('\n')[0])
+
+    def test_labels_are_the_ones_the_single_query_prompts_offer(self):
+        # Both classifiers share the answer caches, so they must answer alike
+        self.assertEqual(self.offered(specialization_prompt('knee pain')), list(batch.labels_for('specialization')))
+        self.assertEqual(self.offered(page_prompt('open my profile')), list(batch.labels_for('page')))
+
+    def test_invalid_item_lang_fails_only_that_item(self):
+        response = self.post({'queries': ['what causes a fever', {'text': 'what is asthma', 'lang': ['en']},
+                                          {'text': 'what is a cold', 'lang': {'code': 'en'}}]})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(results[0]['category'], 'medibot')
+        self.assertEqual([result.get('error', '')[:4] for result in results[1:]], ['lang', 'lang'])
+
+    def test_invalid_lang_is_rejected(self):
+        for lang in (['en'], 5, '', 'x' * 50):
+            with self.subTest(lang=lang):
+                self.assertEqual(self.post({'lang': lang, 'queries': ['what causes a fever']}).status_code, 400)
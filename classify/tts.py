@@ -0,0 +1,202 @@
+"""
+Text-to-speech with a content-addressed audio cache.
+
+Audio is synthesized by gTTS straight into memory and stored on disk under
+the SHA-256 of (lang, text), so the same sentence is only ever synthesized
+once and its key doubles as a stable URL. The store is bounded by
+TTS_CACHE_MAX_BYTES and evicts least recently used files; pinned entries
+(the pre-rendered ``responses``) are kept apart and never evicted.
+
+``render_later`` hands out the URL before the audio exists: it renders in
+the background while the text waits in the default cache, from which
+``voice_audio`` renders it itself if asked first.
+"""
+import io
+import os
+import hashlib
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from gtts import gTTS
+from ror_django_backend import metrics
+from .pipeline import stage_executor
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'audio/mpeg'
+
+
+def audio_key(text, lang):
+    return hashlib.sha256(f'{lang}\0{text}'.encode()).hexdigest()
+
+
+def synthesize(text, lang):
+    buffer = io.BytesIO()
+    with metrics.span('tts'):
+        gTTS(text=text, lang=lang, slow=False).write_to_fp(buffer)
+    return buffer.getvalue()
+
+
+class AudioStore:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, key, pinned=False):
+        if pinned:
+            return os.path.join(self.directory, 'pinned', f'{key}.mp3')
+        return os.path.join(self.directory, key[:2], f'{key}.mp3')
+
+    def get(self, key):
+        for pinned in (True, False):
+            path = self.path(key, pinned)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            if not pinned:
+                # The modification time is the recency used for eviction
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+            return data
+        return None
+
+    def pinned(self, key):
+        return os.path.exists(self.path(key, pinned=True))
+
+    def put(self, key, data, pinned=False):
+        path = self.path(key, pinned)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write aside and rename so readers never see a partial file
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        if pinned:
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self.entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def entries(self):
+        """``(path, mtime, size)`` of every evictable file."""
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            shard = os.path.join(self.directory, name)
+            if name == 'pinned' or not os.path.isdir(shard):
+                continue
+            for filename in os.listdir(shard):
+                if not filename.endswith('.mp3'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(shard, filename))
+                except FileNotFoundError:
+                    continue
+                yield os.path.join(shard, filename), stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        # Rescan rather than trust the running total, which other worker
+        # processes sharing the directory do not update; evict down to 90%
+        # so a full cache does not rescan on every write.
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        size = sum(entry[2] for entry in entries)
+        target = self.max_bytes * 0.9
+        for path, _, entry_size in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                size -= entry_size
+            except FileNotFoundError:
+                pass
+        logger.info(f"Evicted TTS audio down to {size} bytes")
+        self._size = size
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in list(self.entries()):
+                os.remove(path)
+            self._size = 0
+
+
+store = AudioStore(settings.TTS_CACHE_DIR, settings.TTS_CACHE_MAX_BYTES)
+# One lock per stripe of keys, so concurrent requests for the same new
+# sentence synthesize it once without serializing unrelated ones
+_locks = [threading.Lock() for _ in range(64)]
+
+
+def get_audio(text, lang, must_store=False):
+    """
+    Audio bytes for ``text``, synthesized only on a cache miss. Failing to
+    store new audio is only logged unless ``must_store``.
+    """
+    key = audio_key(text, lang)
+    data = store.get(key)
+    if data is None:
+        with _locks[int(key[:4], 16) % len(_locks)]:
+            data = store.get(key)
+            if data is None:
+                logger.info(f"Synthesizing {lang} speech for {len(text)} characters")
+                data = synthesize(text, lang)
+                try:
+                    store.put(key, data)
+                except OSError as e:
+                    # A read-only or full cache directory costs a re-render, not the response
+                    if must_store:
+                        raise
+                    logger.warning(f"Could not cache TTS audio in {store.directory}: {str(e)}")
+    return data
+
+
+def render(text, lang):
+    """Make sure the audio for ``text`` is in the store and return its key."""
+    # The key is served from the store, so audio that was not stored is no use
+    get_audio(text, lang, must_store=True)
+    return audio_key(text, lang)
+
+
+def render_later(text, lang):
+    """Start rendering ``text`` in the background and return its key at once."""
+    key = audio_key(text, lang)
+    cache.set(f'tts-pending:{key}', (text, lang), timeout=settings.TTS_PENDING_TTL)
+    # Not the voice stage's pool, which would queue chatbot requests behind renders
+    future = stage_executor('tts').submit(render, text, lang)
+    future.add_done_callback(_log_failure)
+    return key
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error(f"Error generating voice response: {str(future.exception())}")
+
+
+def pending(key):
+    """``(text, lang)`` of audio handed out by ``render_later`` but maybe not yet stored."""
+    return cache.get(f'tts-pending:{key}')
+
+
+def prerender(text, lang):
+    """Synthesize ``text`` into the pinned part of the store, which is never evicted."""
+    key = audio_key(text, lang)
+    store.put(key, synthesize(text, lang), pinned=True)
+    return key
+
+
+def audio_url(key):
+    return reverse('voice-audio', args=[key])
+
+
+def prerendered_url(text, lang):
+    """URL of pre-rendered audio for ``text``, or None if it was not pre-rendered."""
+    key = audio_key(text, lang)
+    return audio_url(key) if store.pinned(key) else None
@@ -1,11 +1,20 @@
 # voice_processor/urls.py
-from django.urls import path # type: ignore
-from . import views
+from django.urls import path, re_path # type: ignore
+from . import views, async_views
 
 urlpatterns = [
     path('v1/process-voice/', views.process_voice_input, name='process_voice'),
     path('v1/medical-chatbot/', views.medical_chatbot, name='medical-chatbot'),
+    path('v1/medical-chatbot/stream/', views.medical_chatbot_stream, name='medical-chatbot-stream'),
     path('v1/check-navigation/',views.voice_navigation,name='check-navigation'),
+    path('v1/check-navigation/stream/', views.voice_navigation_stream, name='check-navigation-stream'),
+    path('v1/process-voice/async/', async_views.process_voice_input, name='process-voice-async'),
+    path('v1/medical-chatbot/async/', async_views.medical_chatbot, name='medical-chatbot-async'),
+    path('v1/check-navigation/async/', async_views.voice_navigation, name='check-navigation-async'),
+    path('v1/classification-cache/', views.classification_cache_stats, name='classification-cache'),
+    path('v1/classify-batch/', views.classify_queries, name='classify-batch'),
+    path('v1/text-to-voice/', views.text_to_voice, name='text-to-voice'),
+    re_path(r'^v1/voice/(?P<key>[0-9a-f]{64})\.mp3$', views.voice_audio, name='voice-audio'),
 ]
 
 
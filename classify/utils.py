@@ -1,14 +1,15 @@
 import speech_recognition as sr
 from pydub import AudioSegment
-import io, os, base64, tempfile
+import io, os, base64
 import logging
 from django.conf import settings
+from asgiref.sync import sync_to_async
 from langdetect import detect
 from googletrans import Translator
 from dotenv import load_dotenv
-from groq import Groq
-from gtts import gTTS
 from pydub import AudioSegment
+from . import llm, speech, audio, tts
+from .cache import page_cache, specialization_cache
 # Load environment variables from .env file
 load_dotenv()
 
@@ -72,187 +73,262 @@ def get_response(category, lang):
 
 def process_audio(audio_file):
     try:
-        with sr.AudioFile(audio_file) as source:
-            audio_data = recognizer.record(source)
+        ingested = audio.ingest(audio_file)
         logger.info("Audio file processed successfully")
-        # Try recognition in English (Indian) first, then Hindi if no result
-        try:
-            text = recognizer.recognize_google(audio_data, language="en-IN")
-        except sr.UnknownValueError:
-            try:
-                text = recognizer.recognize_google(audio_data, language="hi-IN")
-            except sr.UnknownValueError:
-                return "Speech could not be recognized"
-         # Step 2: Language Detection
-        lang = detect_language(text)
-        logger.info(f"Detected language: {lang}")
-        # Step 3: Classification
-        category = classify_input(text, lang)
-
-        # Step 4: Generate Response
-        response = get_response(category, lang)
-
-        return {"category": category, "text": text, "lang": lang}
+        if not ingested.audio.frame_data:
+            return {"category": None, "text": "Speech could not be recognized", "lang": None}
+        # Long clips are split at pauses and the segments recognized in parallel;
+        # within each, English (Indian) and Hindi run concurrently and the most confident wins
+        return transcript_result(speech.transcribe(ingested.audio))
     except Exception as e:
         logger.error(f"Error processing audio: {str(e)}", exc_info=True)
-        return f"Error processing audio: {str(e)}"
+        return {"category": None, "text": f"Error processing audio: {str(e)}", "lang": None}
 
 
+async def aprocess_audio(audio_file):
+    """``process_audio`` for async views: decoding runs on a thread, recognition on the event loop."""
+    try:
+        ingested = await sync_to_async(audio.ingest, thread_sensitive=False)(audio_file)
+        logger.info("Audio file processed successfully")
+        if not ingested.audio.frame_data:
+            return {"category": None, "text": "Speech could not be recognized", "lang": None}
+        return transcript_result(await speech.atranscribe(ingested.audio))
+    except Exception as e:
+        logger.error(f"Error processing audio: {str(e)}", exc_info=True)
+        return {"category": None, "text": f"Error processing audio: {str(e)}", "lang": None}
+
+
+def transcript_result(transcript):
+    """The process-voice payload for a Transcription (None if nothing was recognized)."""
+    if transcript is None:
+        return {"category": None, "text": "Speech could not be recognized", "lang": None}
+    text = transcript.text
+    logger.info(f"Recognized {transcript.language} speech with confidence {transcript.confidence:.2f}")
+    segments = [
+        {
+            "start": round(segment.start, 2),
+            "end": round(segment.end, 2),
+            "text": segment.text,
+            "elapsed_ms": round(segment.elapsed * 1000, 1),
+        }
+        for segment in transcript.segments
+    ]
+    # Step 2: Language Detection
+    lang = detect_language(text)
+    logger.info(f"Detected language: {lang}")
+    # Step 3: Classification
+    category = classify_input(text, lang)
+
+    # Step 4: Generate Response
+    response = get_response(category, lang)
+
+    return {
+        "category": category,
+        "text": text,
+        "lang": lang,
+        "segments": segments,
+        "response": response,
+        "voice_response": tts.prerendered_url(response, lang),
+    }
+
 
 # Generating response as both voice and text for the input voice
 
 
 def generate_text_response(input_text, lang):
-    logging.info(f"Loading groq api key")
+    logger.info(f"Loading groq api key")
     try:
-        groq_text_generation_key = os.getenv("GORQ_TEXT_GENERATION_KEY")
+        llm.get_api_key()
     except:
-        logging.error("Error loading groq api key", exc_info=True)
+        logger.error("Error loading groq api key", exc_info=True)
         return "Error loading groq api key"
-    logging.info(f"Generating text response for input: {input_text}")
+    logger.debug(f"Generating text response for input: {input_text}")
     try:
-        client = Groq(
-            api_key=os.getenv("GORQ_TEXT_GENERATION_KEY"),
-        )
-
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"Give in short only the remedy for the given query - {input_text} ",
-                }
-            ],
-            model="llama3-8b-8192",
-        )
-        logging.info(f"Text Generated Successfully")
-        return chat_completion.choices[0].message.content
+        text_response = llm.chat_completion(remedy_prompt(input_text))
+        logger.info(f"Text Generated Successfully")
+        return text_response
     except:
-        logging.error("Error generating text response", exc_info=True)
+        logger.error("Error generating text response", exc_info=True)
         return "Error generating text response"
 
+
+def remedy_prompt(input_text):
+    return f"Give in short only the remedy for the given query - {input_text} "
+
+
+def stream_text_response(input_text, lang):
+    """
+    Streaming counterpart of ``generate_text_response``: yields the remedy as
+    it is generated. Errors are raised rather than returned, since part of
+    the text may already have been sent.
+    """
+    llm.get_api_key()
+    logger.debug(f"Streaming text response for input: {input_text}")
+    yield from llm.stream_chat_completion(remedy_prompt(input_text))
+
+
+# Pages voice navigation can open, in page_prompt's order, with the queries
+# that belong to each as the batch prompt (see batch.py) describes them
+PAGE_CATEGORIES = {
+    'medibot': 'basic clarifications, symptoms of diseases, or general medical information',
+    'mediscanner': 'physical injuries, scanning wounds, or urgent medical issues that need immediate attention',
+    'user_profile': 'viewing personal data or profile information',
+    'upload_prescription': 'adding or viewing prescriptions',
+    'book_appointment': 'consulting a doctor, booking appointments, or questions about doctor consultations',
+    'community': 'community health, public health, or general health awareness',
+    'edit_profile': 'updating or changing personal data or profile information',
+    'search_doctor': 'finding or searching for a doctor or a specialist',
+}
+
+# The specializations specialization_prompt offers, in its order.
+# Doctor.specialization also accepts 'orthopedics' and 'ent', which no
+# prompt offers yet; adding them changes what the single-query classifier
+# answers, so it needs its own change.
+SPECIALIZATIONS = (
+    'allergy_immunology', 'anesthesiology', 'cardiology', 'dermatology', 'endocrinology', 'gastroenterology',
+    'geriatrics', 'hematology', 'infectious_disease', 'internal_medicine', 'nephrology', 'neurology',
+    'obstetrics_gynecology', 'oncology', 'ophthalmology', 'orthopedic_surgery', 'otolaryngology',
+    'pediatrics', 'physical_medicine_rehabilitation', 'psychiatry', 'pulmonology', 'rheumatology', 'surgery',
+    'urology', 'emergency_medicine', 'addiction_medicine', 'critical_care_medicine',
+)
+
+
+def page_prompt(input_text):
+    return (
+        "Classify the following query into one of these categories: "
+        "'medibot', 'mediscanner', 'user_profile', 'upload_prescription', 'book_appointment','community','edit_profile','search_doctor'.\n\n"
+        "Here is how you should classify:\n"
+        "- 'medibot': Use this category for queries related to basic clarifications, symptoms of diseases, or general medical information.\n"
+        "- 'mediscanner': Use this category for queries about physical injuries, scanning wounds, or any urgent medical issues that require immediate attention.\n"
+        "- 'user_profile': Use this category for queries related to updating or changing personal data or profile information.\n"
+        "- 'upload_prescription': Use this category for queries about adding or viewing prescriptions.\n"
+        "- 'book_appointment': Use this category for queries about consulting a doctor, booking appointments, or asking questions related to doctor consultations.\n\n"
+        "- 'community': Use this category for queries related to community health, public health, or general health awareness.\n\n"
+        "- 'edit_profile': Use this category for queries related to updating or changing personal data or profile information.\n\n"
+        "- 'search_doctor': Use this category for queries related to finding a doctor, searching for a doctor, or looking for a specialist.\n\n"
+
+        "Query: {input_text}\n\n"
+        "Category:\n"
+        "Just give me a single one-word answer based on the category that best fits the query provided."
+    ).format(input_text=input_text)
+
+
 def classify_page(input_text, lang):
+    cached = page_cache.get(input_text, lang)
+    if cached is not None:
+        return cached
+
     try:
-        groq_text_generation_key = os.getenv("GORQ_TEXT_GENERATION_KEY")
-        if not groq_text_generation_key:
-            raise ValueError("GORQ_TEXT_GENERATION_KEY environment variable not set")
+        llm.get_api_key()
     except Exception as e:
         return "Error loading Groq API key"
 
 
     try:
-        client = Groq(
-            api_key=groq_text_generation_key,
-        )
-
-        prompt = (
-            "Classify the following query into one of these categories: "
-            "'medibot', 'mediscanner', 'user_profile', 'upload_prescription', 'book_appointment','community','edit_profile','search_doctor'.\n\n"
-            "Here is how you should classify:\n"
-            "- 'medibot': Use this category for queries related to basic clarifications, symptoms of diseases, or general medical information.\n"
-            "- 'mediscanner': Use this category for queries about physical injuries, scanning wounds, or any urgent medical issues that require immediate attention.\n"
-            "- 'user_profile': Use this category for queries related to updating or changing personal data or profile information.\n"
-            "- 'upload_prescription': Use this category for queries about adding or viewing prescriptions.\n"
-            "- 'book_appointment': Use this category for queries about consulting a doctor, booking appointments, or asking questions related to doctor consultations.\n\n"
-            "- 'community': Use this category for queries related to community health, public health, or general health awareness.\n\n"
-            "- 'edit_profile': Use this category for queries related to updating or changing personal data or profile information.\n\n"
-            "- 'search_doctor': Use this category for queries related to finding a doctor, searching for a doctor, or looking for a specialist.\n\n"
-
-            "Query: {input_text}\n\n"
-            "Category:\n"
-            "Just give me a single one-word answer based on the category that best fits the query provided."
-        ).format(input_text=input_text)
-
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            model="llama3-8b-8192",
-        )
-
-        return chat_completion.choices[0].message.content.strip()
+        category = llm.chat_completion(page_prompt(input_text)).strip()
+        # Anything off the list is still returned, but never cached
+        if category in PAGE_CATEGORIES:
+            page_cache.set(input_text, category, lang)
+        return category
     
     except Exception as e:
         return "Error generating text response"
 
 
 def convert_text_to_voice(text_response, lang):
-    logging.info(f"converting text to voice for input")
+    logger.info(f"Converting text to voice for input")
     try:
-        logging.info(f"Converting text to voice for input")
-
-        temp_file_name = None
-         # Create gTTS object
-        tts = gTTS(text=text_response, lang=lang, slow=False)
-        
-        # Use a temporary file to save the audio
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            # Save the audio to the temporary file
-            tts.save(temp_file.name)  # Save to the temporary file
-            temp_file.seek(0)  # Move to the beginning of the file
-
-         # Check if the temporary file was created successfully
-        if temp_file_name:
-            # Read audio data and encode it to base64
-            with open(temp_file_name, 'rb') as f:
-                audio_base64 = base64.b64encode(f.read()).decode('utf-8')
-            
-            # Remove the temporary file after reading
-            os.remove(temp_file_name)
-
-            logging.info("Voice response generated successfully")
-            return audio_base64
-        else:
-            logging.error("Failed to create temporary file")
-            return "Error generating voice response"
-
+        audio_base64 = base64.b64encode(tts.get_audio(text_response, lang)).decode('utf-8')
+        logger.info("Voice response generated successfully")
+        return audio_base64
     except Exception as e:
-        logging.error(f"Error generating voice response:{str(e)}", exc_info=True) 
+        logger.error(f"Error generating voice response:{str(e)}", exc_info=True) 
         return "Error generating voice response"
     
     
+def specialization_prompt(input_text):
+    return (
+        "Classify the following query into one of these medical specializations: "
+        "'allergy_immunology', 'anesthesiology', 'cardiology', 'dermatology', 'endocrinology', 'gastroenterology', "
+        "'geriatrics', 'hematology', 'infectious_disease', 'internal_medicine', 'nephrology', 'neurology', "
+        "'obstetrics_gynecology', 'oncology', 'ophthalmology', 'orthopedic_surgery', 'otolaryngology', "
+        "'pediatrics', 'physical_medicine_rehabilitation', 'psychiatry', 'pulmonology', 'rheumatology', 'surgery', "
+        "'urology', 'emergency_medicine', 'addiction_medicine', 'critical_care_medicine'.\n\n"
+        "Here is how you should classify:\n"
+        "- 'allergy_immunology': For queries related to allergies or the immune system.\n"
+        "- 'cardiology': For heart or cardiovascular-related queries.\n"
+        "- 'dermatology': For skin, hair, and nail-related issues.\n"
+        "- And so on for the rest of the specializations...\n\n"
+        "Query: {input_text}\n\n"
+        "Category:\n"
+        "Just give a single one-word answer based on the category that best fits the query provided."
+    ).format(input_text=input_text)
+
+
 def classify_specialization(input_text):
+    cached = specialization_cache.get(input_text)
+    if cached is not None:
+        return cached
+
     try:
-        groq_text_generation_key = os.getenv("GORQ_TEXT_GENERATION_KEY")
-        if not groq_text_generation_key:
-            raise ValueError("GORQ_TEXT_GENERATION_KEY environment variable not set")
+        llm.get_api_key()
     except Exception as e:
         return "Error loading Groq API key"
     try:
-        client = Groq(
-            api_key=groq_text_generation_key,
-        )
-
-        prompt = (
-            "Classify the following query into one of these medical specializations: "
-            "'allergy_immunology', 'anesthesiology', 'cardiology', 'dermatology', 'endocrinology', 'gastroenterology', "
-            "'geriatrics', 'hematology', 'infectious_disease', 'internal_medicine', 'nephrology', 'neurology', "
-            "'obstetrics_gynecology', 'oncology', 'ophthalmology', 'orthopedic_surgery', 'otolaryngology', "
-            "'pediatrics', 'physical_medicine_rehabilitation', 'psychiatry', 'pulmonology', 'rheumatology', 'surgery', "
-            "'urology', 'emergency_medicine', 'addiction_medicine', 'critical_care_medicine'.\n\n"
-            "Here is how you should classify:\n"
-            "- 'allergy_immunology': For queries related to allergies or the immune system.\n"
-            "- 'cardiology': For heart or cardiovascular-related queries.\n"
-            "- 'dermatology': For skin, hair, and nail-related issues.\n"
-            "- And so on for the rest of the specializations...\n\n"
-            "Query: {input_text}\n\n"
-            "Category:\n"
-            "Just give a single one-word answer based on the category that best fits the query provided."
-        ).format(input_text=input_text)
-
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            model="llama3-8b-8192",
-        )
-
-        return chat_completion.choices[0].message.content.strip()
+        specialization = llm.chat_completion(specialization_prompt(input_text)).strip()
+        if specialization in SPECIALIZATIONS:
+            specialization_cache.set(input_text, specialization)
+        return specialization
     
     except Exception as e:
-        return "Error generating specialization classification"
\ No newline at end of file
+        return "Error generating specialization classification"
+
+
+# Async counterparts for the ASGI views. They share the prompts and the
+# classification caches above, but wait on the LLM without holding a thread.
+
+async def agenerate_text_response(input_text, lang):
+    try:
+        llm.get_api_key()
+    except:
+        logger.error("Error loading groq api key", exc_info=True)
+        return "Error loading groq api key"
+    try:
+        return await llm.achat_completion(remedy_prompt(input_text))
+    except:
+        logger.error("Error generating text response", exc_info=True)
+        return "Error generating text response"
+
+
+async def aclassify_page(input_text, lang):
+    cached = await page_cache.aget(input_text, lang)
+    if cached is not None:
+        return cached
+    try:
+        llm.get_api_key()
+    except Exception as e:
+        return "Error loading Groq API key"
+    try:
+        category = (await llm.achat_completion(page_prompt(input_text))).strip()
+        if category in PAGE_CATEGORIES:
+            await page_cache.aset(input_text, category, lang)
+        return category
+    except Exception as e:
+        return "Error generating text response"
+
+
+async def aclassify_specialization(input_text):
+    cached = await specialization_cache.aget(input_text)
+    if cached is not None:
+        return cached
+    try:
+        llm.get_api_key()
+    except Exception as e:
+        return "Error loading Groq API key"
+    try:
+        specialization = (await llm.achat_completion(specialization_prompt(input_text))).strip()
+        if specialization in SPECIALIZATIONS:
+            await specialization_cache.aset(input_text, specialization)
+        return specialization
+    except Exception as e:
+        return "Error generating specialization classification"
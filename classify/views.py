@@ -1,20 +1,30 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, parser_classes, throttle_classes
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.throttling import UserRateThrottle
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework import status
-from django.http import JsonResponse
-from .utils import process_audio, generate_text_response, classify_page,classify_specialization
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from ror_django_backend.views import HasMetricsToken
+from asgiref.sync import sync_to_async
+from .utils import process_audio, generate_text_response, stream_text_response
 import logging 
 import os
-from user.models import Doctor
-from user.utils import get_nearby_medical_centers, find_hospital_distance, get_user_profile
+import json
+import time
+from .chatbot import ChatbotStages
+from . import batch, tts
+from .cache import page_cache, specialization_cache
+from .router import route_page
 
 
 logger = logging.getLogger(__name__)
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@parser_classes([MultiPartParser, FormParser, JSONParser])
 def process_voice_input(request):
     """
     API View to process voice input and handle the file.
@@ -27,6 +37,10 @@ def process_voice_input(request):
             logger.warning("No audio file provided in the request")
             return Response({'error': 'No audio file provided'}, status=status.HTTP_400_BAD_REQUEST)
         
+        if audio_file.size > settings.AUDIO_MAX_UPLOAD_SIZE:
+            logger.warning(f"Audio file {audio_file.name} is too large: {audio_file.size} bytes")
+            return Response({'error': 'Audio file is too large'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
         logger.info(f"Processing voice input from file: {audio_file.name}")
         
         # Process the voice input
@@ -36,12 +50,15 @@ def process_voice_input(request):
             logger.error(f"Error processing audio: {result['text']}")
             return Response({'error': result['text']}, status=status.HTTP_400_BAD_REQUEST)
         
-        logger.info(f"Recognized text: {result['text']}")
+        logger.debug(f"Recognized text: {result['text']}")
         
         return Response({
             'category': result['category'],
             'text': result['text'],
             'lang': result['lang'],
+            'segments': result['segments'],
+            'response': result['response'],
+            'voice_response': result['voice_response'],
         }, status=status.HTTP_200_OK)
     
     elif 'application/json' in request.content_type:
@@ -84,6 +101,59 @@ def process_voice_input(request):
 #         logger.error("Error generating text and voice response", exc_info=True)
 #         return Response({'error': 'Error generating text and voice response'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# Operational, like /api/metrics/: METRICS_TOKEN rather than a user JWT
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([HasMetricsToken])
+def classification_cache_stats(request):
+    return Response({
+        'page': page_cache.stats(),
+        'specialization': specialization_cache.stats(),
+    })
+
+
+class BatchClassifyThrottle(UserRateThrottle):
+    """BATCH_CLASSIFY_RATE requests per user; one request can be many LLM calls."""
+    scope = 'classify-batch'
+
+    def get_rate(self):
+        return settings.BATCH_CLASSIFY_RATE
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([BatchClassifyThrottle])
+def classify_queries(request):
+    """
+    Classify up to BATCH_CLASSIFY_MAX_QUERIES queries at once:
+    ``{"kind": "page" | "specialization", "lang": "en", "queries": ["...", {"text": "...", "lang": "hi"}]}``.
+    Results come back in order, each with its category or its own error.
+    Needs a bearer token, and is throttled per user.
+    """
+    kind = request.data.get('kind', 'page')
+    lang = request.data.get('lang', 'en')
+    queries = request.data.get('queries')
+    if kind not in batch.KINDS:
+        return Response({'error': f"kind must be one of: {', '.join(batch.KINDS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    if not batch.valid_lang(lang):
+        return Response({'error': 'lang must be a language code such as "en"'}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(queries, list) or not queries:
+        return Response({'error': 'queries must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(queries) > settings.BATCH_CLASSIFY_MAX_QUERIES:
+        return Response({'error': f'At most {settings.BATCH_CLASSIFY_MAX_QUERIES} queries per request'},
+                        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    items = []
+    for query in queries:
+        if isinstance(query, dict):
+            query_text, query_lang = query.get('text'), query.get('lang', lang)
+        else:
+            query_text, query_lang = query, lang
+        items.append((query_text.strip() if isinstance(query_text, str) else '', query_lang))
+
+    return Response({'kind': kind, 'results': batch.classify_batch(items, kind)})
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def voice_navigation(request):
@@ -93,14 +163,14 @@ def voice_navigation(request):
     if not input_text:
         return Response({'error': 'No query provided'}, status=status.HTTP_400_BAD_REQUEST)
 
-    logger.info(f"Received voice navigation query: {input_text}")
+    logger.debug(f"Received voice navigation query: {input_text}")
 
-    category = classify_page(input_text, lang)
+    category, source = route_page(input_text, lang)
 
     if "Error" in category:
         return Response({'error': category}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    logger.info(f"Query categorized under: {category}")
+    logger.info(f"Query categorized under: {category} (via {source})")
 
     response_data = {'category': category}
 
@@ -117,62 +187,221 @@ def voice_navigation(request):
     return Response(response_data)
 
 
+def chatbot_pipeline(input_text, lang, phone_number, remedy=True):
+    return ChatbotStages(input_text, lang, phone_number).pipeline(remedy)
+
+
+def patient_missing(result):
+    return result.ok('profile') and not result.results['profile']
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def medical_chatbot(request):
     input_text = request.data.get('text')
     lang = request.data.get('lang', 'en')
-    user_role = 'patient'
     phone_number = request.query_params.get('id')
 
     if not input_text:
         return JsonResponse({"error": "Query is required"}, status=400)
 
-    try:
-        logging.info(f"Classifying specialization for input: {input_text}")
-        specialization = classify_specialization(input_text)
-        logging.info(f"Classified specialization: {specialization}")
+    result = chatbot_pipeline(input_text, lang, phone_number).run()
+    return chatbot_response(result)
 
-    except Exception as e:
-        logging.error(f"Error classifying specialization: {str(e)}")
-        return JsonResponse({"error": "Error classifying specialization"}, status=500)
 
-    try:
-        logging.info(f"Generating medical remedy for input: {input_text}")
-        remedy = generate_text_response(input_text,lang)
-        logging.info(f"Medical remedy generated: {remedy}")
+def chatbot_response(result):
+    if patient_missing(result):
+        response = JsonResponse({"error": "Patient not found"}, status=404)
+    elif not result.ok('specialization') and not result.ok('remedy'):
+        response = JsonResponse({"error": "Error generating medical response", "errors": result.errors}, status=500)
+    else:
+        response_data = {
+            "text_response": result.results.get('remedy'),
+            "voice_response": result.results.get('voice'),
+            "specialization": result.results.get('specialization'),
+            "doctors": result.results.get('doctors', []),
+            "hospitals": result.results.get('hospitals', [])
+        }
+        if result.errors:
+            response_data["errors"] = result.errors
+        response = JsonResponse(response_data, status=200)
+
+    response['Server-Timing'] = result.server_timing()
+    return response
+
 
-    except Exception as e:
-        logging.error(f"Error generating medical remedy: {str(e)}")
-        return JsonResponse({"error": "Error generating medical remedy"}, status=500)
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
 
+
+def chatbot_events(input_text, lang, pending):
+    """
+    Server-sent events for ``medical_chatbot_stream``: one ``token`` event per
+    piece of the remedy as the LLM produces it, then a ``result`` event with
+    the doctors and hospitals found meanwhile, then ``done``.
+    """
+    started = time.perf_counter()
+    remedy_error = None
+    tokens = []
     try:
-        logging.info(f"Fetching doctors for specialization: {specialization}")
-        doctors = Doctor.objects.filter(specialization=specialization).values()
-        doctor_list = list(doctors)
-        logging.info(f"Found {len(doctor_list)} doctors under specialization {specialization}")
+        for token in stream_text_response(input_text, lang):
+            tokens.append(token)
+            yield sse_event('token', {'text': token})
+    except Exception:
+        logger.error("Error streaming text response", exc_info=True)
+        remedy_error = "Error generating text response"
+        yield sse_event('error', {'stage': 'remedy', 'error': remedy_error})
+    remedy_duration = time.perf_counter() - started
+
+    # Only the URL is sent; the audio renders in the background
+    voice = None
+    if settings.CHATBOT_VOICE_RESPONSE and tokens and not remedy_error:
+        voice = tts.audio_url(tts.render_later(''.join(tokens), lang))
+
+    result = pending.result()
+    result.timings['remedy'] = remedy_duration
+    if remedy_error:
+        result.errors['remedy'] = remedy_error
+    if voice:
+        result.results['voice'] = voice
+
+    if patient_missing(result):
+        yield sse_event('error', {'error': "Patient not found", 'status': 404})
+    else:
+        response_data = {
+            "voice_response": result.results.get('voice'),
+            "specialization": result.results.get('specialization'),
+            "doctors": result.results.get('doctors', []),
+            "hospitals": result.results.get('hospitals', [])
+        }
+        if result.errors:
+            response_data["errors"] = result.errors
+        yield sse_event('result', response_data)
+    yield sse_event('done', {'server_timing': result.server_timing()})
 
-    except Exception as e:
-        logging.error(f"Error fetching doctors: {str(e)}")
-        return JsonResponse({"error": "Error fetching doctors"}, status=500)
 
-    # nearby local hospitals
+def navigation_events(input_text, lang, category):
+    """
+    Server-sent events for ``voice_navigation_stream``: the ``category``
+    first, then for medibot one ``token`` event per piece of the answer as
+    the LLM produces it, then ``done``.
+    """
+    yield sse_event('category', {'category': category})
+    if category == 'medibot':
+        try:
+            for token in stream_text_response(input_text, lang):
+                yield sse_event('token', {'text': token})
+        except Exception:
+            logger.error("Error streaming detailed response", exc_info=True)
+            yield sse_event('error', {'error': 'Error generating detailed response'})
+    yield sse_event('done', {})
+
 
+def served_over_asgi(request):
+    # PEP 3333 requires wsgi.input in every WSGI environ; ASGI requests have none
+    return 'wsgi.input' not in request.META
+
+
+async def iterate_in_thread(iterator):
+    # Under ASGI Django buffers a synchronous iterator whole before sending
+    # it; pulling each event on a worker thread lets them go out one by one.
+    next_event = sync_to_async(next, thread_sensitive=False)
+    sentinel = object()
+    while True:
+        event = await next_event(iterator, sentinel)
+        if event is sentinel:
+            return
+        yield event
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def medical_chatbot_stream(request):
+    """
+    Streaming variant of ``medical_chatbot``. The remedy is forwarded token
+    by token while specialization, doctors and hospitals are resolved in the
+    background and sent as a final event.
+    """
+    input_text = request.data.get('text')
+    lang = request.data.get('lang', 'en')
+    phone_number = request.query_params.get('id')
+
+    if not input_text:
+        return JsonResponse({"error": "Query is required"}, status=400)
+
+    pending = chatbot_pipeline(input_text, lang, phone_number, remedy=False).run_in_background()
+    return event_stream(request, chatbot_events(input_text, lang, pending))
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def voice_navigation_stream(request):
+    """
+    Streaming variant of ``voice_navigation``: the category is sent as soon
+    as it is known and a medibot answer follows token by token.
+    """
+    input_text = request.data.get('query', '')
+    lang = request.data.get('lang', 'en')
+
+    if not input_text:
+        return Response({'error': 'No query provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+    category, source = route_page(input_text, lang)
+    if "Error" in category:
+        return Response({'error': category}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    logger.info(f"Query categorized under: {category} (via {source})")
+
+    return event_stream(request, navigation_events(input_text, lang, category))
+
+
+def event_stream(request, events):
+    if served_over_asgi(request):
+        events = iterate_in_thread(events)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def audio_response(data, key):
+    response = HttpResponse(data, content_type=tts.CONTENT_TYPE)
+    response['ETag'] = f'"{key}"'
+    # The key is a hash of the text, so the audio behind a URL never changes
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def voice_audio(request, key):
+    if request.headers.get('If-None-Match') == f'"{key}"':
+        return HttpResponse(status=304)
+    data = tts.store.get(key)
+    if data is None:
+        # A chatbot answer's audio that is still rendering, or was evicted
+        pending = tts.pending(key)
+        if pending is None:
+            return JsonResponse({"error": "Voice response not found"}, status=404)
+        try:
+            data = tts.get_audio(*pending)
+        except Exception:
+            logger.error("Error generating voice response", exc_info=True)
+            return JsonResponse({"error": "Error generating voice response"}, status=500)
+    return audio_response(data, key)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def text_to_voice(request):
+    """Synthesize ``text`` (or serve it from the cache) as raw MP3 bytes."""
+    text = request.data.get('text')
+    lang = request.data.get('lang', 'en')
+    if not text:
+        return JsonResponse({"error": "No text provided"}, status=400)
     try:
-        profile = get_user_profile(phone_number)
-        if not profile:
-            return JsonResponse({"error": "Patient not found"}, status=404)
-        latitude = profile.latitude
-        longitude = profile.longitude
-        hospitals = get_nearby_medical_centers(latitude, longitude, specialization=specialization)
-        hospital_distances = find_hospital_distance(hospitals,latitude, longitude )
-    except Exception as e:
-        return JsonResponse({"error": "Error fetching nearby hospitals"}, status=500)
-    
-    response_data = {
-        "text_response": remedy,
-        "specialization": specialization,
-        "doctors": doctor_list,
-        "hospitals": hospital_distances[:5]
-    }
-    return JsonResponse(response_data, status=200)
\ No newline at end of file
+        data = tts.get_audio(text, lang)
+    except Exception:
+        logger.error("Error generating voice response", exc_info=True)
+        return JsonResponse({"error": "Error generating voice response"}, status=500)
+    return audio_response(data, tts.audio_key(text, lang))
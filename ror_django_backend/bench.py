@@ -0,0 +1,49 @@
+import math
+import time
+import threading
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (``pct`` in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples):
+    """Summarize latency samples given in seconds, reported in milliseconds."""
+    return {
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+class QueryCounter:
+    """``execute_wrapper`` counting the queries run through it, from any thread."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
@@ -0,0 +1,55 @@
+"""
+Database connection reuse metrics.
+
+Counts the connections this process opened against the requests it served;
+with persistent connections or the pool working, connections per request
+should stay close to zero. Pool statistics come from psycopg_pool.
+"""
+import threading
+from django.core.signals import request_finished
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_lock = threading.Lock()
+_counters = {'connections_opened': 0, 'requests': 0}
+
+
+@receiver(connection_created, dispatch_uid='db_stats_connection_created')
+def count_connection(sender, connection, **kwargs):
+    with _lock:
+        _counters['connections_opened'] += 1
+
+
+@receiver(request_finished, dispatch_uid='db_stats_request_finished')
+def count_request(sender, **kwargs):
+    with _lock:
+        _counters['requests'] += 1
+
+
+def reset():
+    with _lock:
+        for name in _counters:
+            _counters[name] = 0
+
+
+def connection_mode(alias='default'):
+    settings_dict = connections[alias].settings_dict
+    if settings_dict.get('OPTIONS', {}).get('pool'):
+        return 'pool'
+    return 'persistent' if settings_dict['CONN_MAX_AGE'] != 0 else 'per-request'
+
+
+def connection_stats(alias='default'):
+    """Connection counters of this process, plus pool statistics when pooling."""
+    with _lock:
+        stats = dict(_counters)
+    stats['mode'] = connection_mode(alias)
+    stats['conn_max_age'] = connections[alias].settings_dict['CONN_MAX_AGE']
+    stats['connections_per_request'] = (
+        round(stats['connections_opened'] / stats['requests'], 4) if stats['requests'] else None
+    )
+    if stats['mode'] == 'pool':
+        # connections_ms in here is the time spent establishing connections
+        stats['pool'] = connections[alias].pool.get_stats()
+    return stats
@@ -0,0 +1,220 @@
+"""
+Logging off the request path.
+
+``config`` builds the ``LOGGING`` dict. In 'queue' mode (the default) the
+root logger's only handler is a ``BufferedHandler``: emitting a record just
+puts it on a bounded queue, and a ``QueueListener`` thread formats it and
+does the file I/O. When the queue is full (the disk stalls), records are
+dropped and counted instead of blocking requests. 'sync' writes on the
+calling thread as Django normally does; 'off' discards everything.
+
+Records are written as one JSON object per line by ``JsonFormatter``.
+Records below WARNING can be sampled per logger with ``SamplingFilter``,
+before they are queued.
+
+This module is imported by settings, so it must not touch Django.
+"""
+import os
+import json
+import queue
+import random
+import logging
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord attributes; anything else on a record came from ``extra=``
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'process': record.process,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps every record at WARNING and above, and ``rate`` (0-1) of the ones
+    below. ``rates`` overrides the rate for loggers by name; the longest
+    matching prefix wins, so 'classify' covers 'classify.views'.
+    """
+
+    def __init__(self, rate=1.0, rates=None):
+        super().__init__()
+        self.rate = rate
+        self.rates = dict(rates or {})
+        self._cache = {}
+
+    def rate_for(self, name):
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = self.rate
+            parts = name.split('.')
+            for i in range(len(parts), 0, -1):
+                prefix = '.'.join(parts[:i])
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class DrainingListener(QueueListener):
+    def enqueue_sentinel(self):
+        # The stock put_nowait raises on a full queue; waiting lets the
+        # listener drain what was queued before it stops
+        self.queue.put(self._sentinel)
+
+
+class BufferedHandler(QueueHandler):
+    """
+    Hands records to ``handlers`` on a listener thread. ``handlers`` are
+    other handlers of the same LOGGING config, given as
+    ``cfg://handlers.<name>``.
+    """
+
+    def __init__(self, handlers, queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        # Indexing (not iterating) the list is what resolves the references
+        targets = [handlers[i] for i in range(len(handlers))]
+        if not all(isinstance(handler, logging.Handler) for handler in targets):
+            # dictConfig retries handlers whose targets it has not built yet
+            raise ValueError('target not configured yet')
+        self.dropped = 0
+        self.listener = DrainingListener(self.queue, *targets, respect_handler_level=True)
+        self.listener.start()
+        _buffered.add(self)
+
+    def prepare(self, record):
+        # Everything that depends on the request thread's state is resolved
+        # here; formatting into JSON is left to the listener.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip('\n')
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Drains the queue into the targets before dictConfig or
+        # logging.shutdown closes them
+        if self.listener._thread is not None:
+            self.listener.stop()
+        _buffered.discard(self)
+        super().close()
+
+
+_buffered = set()
+
+
+def _restart_listeners():
+    # A forked worker inherits the handlers but not the listener threads.
+    # It gets a fresh queue: the inherited one holds the parent's records,
+    # and its lock may have been taken by the parent's listener mid-fork.
+    for handler in list(_buffered):
+        handler.queue = handler.listener.queue = queue.Queue(maxsize=handler.queue.maxsize)
+        handler.listener._thread = None
+        handler.listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listeners)
+
+
+def dropped_records():
+    return sum(handler.dropped for handler in _buffered)
+
+
+def parse_pairs(value):
+    """'classify=WARNING,user=DEBUG' -> {'classify': 'WARNING', 'user': 'DEBUG'}"""
+    pairs = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, setting = item.partition('=')
+        pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+def config(mode='queue', level='INFO', levels=None, file=None, json_format=True, rotation='size',
+           max_bytes=10 * 2**20, backup_count=5, when='midnight', sample_rate=1.0, sample_rates=None,
+           queue_size=10000):
+    """
+    The ``LOGGING`` dict for ``mode`` ('queue', 'sync' or 'off'). Records go
+    to ``file``, rotated by size or time, or to stderr when ``file`` is
+    empty. ``levels`` maps logger names to their own levels.
+    """
+    if mode not in ('queue', 'sync', 'off'):
+        raise ValueError(f'Unknown logging mode: {mode}')
+    if file:
+        if rotation == 'time':
+            output = {'class': 'logging.handlers.TimedRotatingFileHandler', 'filename': file, 'when': when,
+                      'backupCount': backup_count, 'encoding': 'utf-8', 'delay': True}
+        elif rotation == 'size':
+            output = {'class': 'logging.handlers.RotatingFileHandler', 'filename': file, 'maxBytes': max_bytes,
+                      'backupCount': backup_count, 'encoding': 'utf-8', 'delay': True}
+        else:
+            raise ValueError(f'Unknown log rotation: {rotation}')
+    else:
+        output = {'class': 'logging.StreamHandler', 'stream': 'ext://sys.stderr'}
+    output['formatter'] = 'json' if json_format else 'text'
+
+    handlers = {'output': output}
+    if mode == 'queue':
+        handlers['queue'] = {
+            '()': BufferedHandler,
+            'handlers': ['cfg://handlers.output'],
+            'queue_size': queue_size,
+            'filters': ['sampling'],
+        }
+        root_handlers = ['queue']
+    elif mode == 'sync':
+        output['filters'] = ['sampling']
+        root_handlers = ['output']
+    else:
+        handlers = {'null': {'class': 'logging.NullHandler'}}
+        root_handlers = ['null']
+        level, levels = 'CRITICAL', {}
+
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'json': {'()': JsonFormatter},
+            'text': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+        },
+        'filters': {
+            'sampling': {'()': SamplingFilter, 'rate': sample_rate, 'rates': sample_rates or {}},
+        },
+        'handlers': handlers,
+        'root': {'handlers': root_handlers, 'level': level},
+        'loggers': {name: {'level': logger_level.upper()} for name, logger_level in (levels or {}).items()},
+    }
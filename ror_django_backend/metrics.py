@@ -0,0 +1,219 @@
+"""
+In-process latency metrics.
+
+``span(name)`` times a block (an upstream call, an ORM query) into the
+``span_duration_seconds`` histogram and, while a request is being served,
+into that request's spans, which ``MetricsMiddleware`` sends back in the
+``Server-Timing`` header. The middleware also records each request's total
+duration per route. ``render`` writes every histogram in the Prometheus text
+format for ``/api/metrics/``.
+
+Numbers are per process; scrape every worker, or sum them in Prometheus.
+"""
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from functools import partial
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from . import logs
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values; safe to observe from any thread."""
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, seconds, *label_values):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf) and the sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total) in sorted(self.snapshot().items()):
+            labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {total:.6f}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return '\n'.join(lines)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUESTS = Histogram('http_request_duration_seconds', 'Time to produce the response, by route.',
+                     ('method', 'route', 'status'))
+SPANS = Histogram('span_duration_seconds', 'Time spent in upstream calls and ORM queries.', ('span',))
+STAGES = Histogram('chatbot_stage_duration_seconds', 'Duration of each medical_chatbot pipeline stage.',
+                   ('stage', 'outcome'))
+REGISTRY = [REQUESTS, SPANS, STAGES]
+
+
+def render():
+    lines = [histogram.render() for histogram in REGISTRY]
+    lines += [
+        '# HELP log_records_dropped_total Log records dropped because the logging queue was full.',
+        '# TYPE log_records_dropped_total counter',
+        f'log_records_dropped_total {logs.dropped_records()}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for histogram in REGISTRY:
+        histogram.reset()
+
+
+class RequestSpans:
+    """Count and total duration of each span name within one request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+
+    def add(self, name, seconds):
+        with self._lock:
+            count, total = self.totals.get(name, (0, 0.0))
+            self.totals[name] = (count + 1, total + seconds)
+
+    def server_timing(self):
+        with self._lock:
+            totals = list(self.totals.items())
+        return ', '.join(f'{name};desc="{count}x";dur={total * 1000:.1f}' for name, (count, total) in totals)
+
+
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+def record(name, seconds):
+    SPANS.observe(seconds, name)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.add(name, seconds)
+
+
+class span:
+    """
+    ``with span('groq'):`` times the block. A class rather than a
+    generator-based context manager: it wraps every ORM query, so entering
+    and leaving it has to stay in the low microseconds.
+    """
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        if settings.METRICS_ENABLED:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.started is not None:
+            record(self.name, time.perf_counter() - self.started)
+
+
+def in_context(func):
+    """
+    ``func`` bound to a copy of the caller's context, for handing to a thread
+    pool: spans recorded on the worker thread then count towards the request
+    that submitted the work.
+    """
+    return partial(contextvars.copy_context().run, func)
+
+
+def time_query(execute, sql, params, many, context):
+    with span('db'):
+        return execute(sql, params, many, context)
+
+
+@receiver(connection_created, dispatch_uid='metrics_connection_created')
+def instrument_connection(sender, connection, **kwargs):
+    # Reconnects on the same wrapper fire this again
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class MetricsMiddleware:
+    """
+    Times every request into ``http_request_duration_seconds`` and adds its
+    spans to the ``Server-Timing`` header, after any timings the view set.
+    Streaming responses are timed until their first byte is ready.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        spans = RequestSpans()
+        token = _request_spans.set(spans)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        return self.finish(request, response, spans, started)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        spans = RequestSpans()
+        token = _request_spans.set(spans)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        return self.finish(request, response, spans, started)
+
+    def finish(self, request, response, spans, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        # The route pattern, not the path, so ids in URLs don't explode the series
+        route = match.route if match else 'unmatched'
+        REQUESTS.observe(elapsed, request.method, route, str(response.status_code))
+        if settings.METRICS_SERVER_TIMING:
+            timings = [response.get('Server-Timing'), spans.server_timing(), f'total;dur={elapsed * 1000:.1f}']
+            response['Server-Timing'] = ', '.join(timing for timing in timings if timing)
+        return response
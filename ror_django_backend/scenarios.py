@@ -0,0 +1,443 @@
+"""
+Scripted requests against every endpoint, run by the ``bench_endpoints`` command.
+
+A Scenario names a route and builds its n-th request from the seeded
+BenchData. Upstreams runs a stub for each external service (Groq, Overpass,
+Nominatim, Google speech) and points the settings at them, so a run measures
+this service alone; queries are counted on every database connection the
+requests use, including the chatbot's stage threads. Async routes are sent
+through an AsyncClient on one long-lived event loop, as under uvicorn.
+"""
+import io
+import os
+import json
+import asyncio
+import math
+import wave
+import struct
+import tempfile
+import threading
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client, AsyncClient
+from django.test.utils import override_settings
+from django.urls import reverse
+from classify import batch, llm, tts
+from classify.audio import PCM_RATE, PCM_WIDTH
+from classify.cache import page_cache, specialization_cache
+from classify import urls as classify_urls
+from user import authentication, geocode_queue, geocoding, profile_cache
+from user import urls as user_urls
+from user.models import Doctor, Patient, GeocodeJob, SPECIALIZATION_CHOICES
+from user.seed import seed_doctors, seed_patients, DEFAULT_CENTER
+from .bench import summarize, Timer, QueryCounter
+from .stubs import StubServer, FakeGroqHandler, FakeOverpassHandler, FakeNominatimHandler, FakeGoogleSpeechHandler
+
+# No real number starts with +000, so cleanup cannot touch real users
+BENCH_PREFIX = '+000'
+DOCTOR_PREFIX = BENCH_PREFIX + '1'
+PATIENT_PREFIX = BENCH_PREFIX + '2'
+# Users created by the registration scenarios
+REGISTER_PREFIX = BENCH_PREFIX + '3'
+
+# Set for the run, so the scenarios can read the operational endpoints
+METRICS_TOKEN = 'bench-metrics-token'
+
+REMEDY = 'Rest, drink warm fluids and see a doctor if the fever lasts more than three days.'
+
+# Half of these match the keyword router, the rest go to the LLM
+NAVIGATION_QUERIES = [
+    'I want to book an appointment', 'show my profile', 'upload my prescription',
+    'find a cardiologist near me', 'scan this wound', 'open the community page',
+    'what is the best way to stay healthy', 'help me with something', 'where do I go next',
+    'i need assistance please',
+]
+CHATBOT_QUERIES = [
+    'I have chest pain when climbing stairs', 'my heart beats very fast at night',
+    'I have a sore throat and fever', 'shortness of breath after walking',
+    'high blood pressure readings this week',
+]
+VOICE_TEXTS = ['Please consult a doctor', 'Your appointment is booked', 'Take rest and drink water']
+
+
+class BenchGroqHandler(FakeGroqHandler):
+    """Answers each of the app's prompts with something it can use."""
+
+    def reply_for(self, request):
+        prompt = request['messages'][-1]['content']
+        if batch.QUERIES_MARKER in prompt:
+            queries = json.loads(prompt.rpartition(batch.QUERIES_MARKER)[2])
+            category = 'cardiology' if 'medical specializations' in prompt else 'medibot'
+            return json.dumps({'results': [{'id': query['id'], 'category': category} for query in queries]})
+        if 'medical specializations' in prompt:
+            return 'cardiology'
+        if 'Category:' in prompt:
+            return 'medibot'
+        return REMEDY
+
+
+def synthetic_wav(seconds=3.0, pitch=220):
+    """A 16 kHz mono WAV of a warbling tone; the speech stub does not listen to it."""
+    frames = b''.join(
+        struct.pack('<h', int(8000 * math.sin(2 * math.pi * pitch * (1 + 0.2 * math.sin(i / 800)) * i / PCM_RATE)))
+        for i in range(int(seconds * PCM_RATE))
+    )
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(PCM_WIDTH)
+        wav.setframerate(PCM_RATE)
+        wav.writeframes(frames)
+    return buffer.getvalue()
+
+
+class Upstreams:
+    """
+    Stubs of every external service, with the settings pointed at them.
+    ``latency`` is the default for all of them and ``latencies`` overrides it
+    per stub name; see ``stubs.parse_latency``.
+    """
+    names = ('groq', 'overpass', 'nominatim', 'speech')
+
+    def __init__(self, latency=0.0, latencies=None, error_rate=0.0, seed=0):
+        latencies = latencies or {}
+        handlers = {
+            'groq': BenchGroqHandler,
+            'overpass': FakeOverpassHandler,
+            'nominatim': FakeNominatimHandler,
+            'speech': FakeGoogleSpeechHandler,
+        }
+        self.servers = {
+            name: StubServer(handlers[name], latency=latencies.get(name, latency), error_rate=error_rate, seed=seed)
+            for name in self.names
+        }
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for server in self.servers.values():
+            self._stack.enter_context(server)
+        host, port = self.servers['nominatim'].server_address[:2]
+        self._stack.enter_context(override_settings(
+            GROQ_BASE_URL=self.servers['groq'].url,
+            OVERPASS_URL=self.servers['overpass'].url,
+            NOMINATIM_DOMAIN=f'{host}:{port}',
+            NOMINATIM_SCHEME='http',
+            GOOGLE_SPEECH_URL=f"{self.servers['speech'].url}/speech-api/v2/recognize",
+            # gTTS has no endpoint to stub; the TTS routes are measured on cached audio
+            CHATBOT_VOICE_RESPONSE=False,
+            # Geocode jobs are drained between scenarios instead, see ``run``
+            GEOCODE_WORKER_ENABLED=False,
+            # The test clients send Host: testserver (AsyncClient cannot be
+            # told otherwise), which the real ALLOWED_HOSTS rejects with a 400
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            METRICS_TOKEN=METRICS_TOKEN,
+            # The bench measures throughput, not the per-user budget
+            BATCH_CLASSIFY_RATE=None,
+        ))
+        # The stub has no usage policy to respect
+        limiter = geocoding.rate_limiter
+        geocoding.rate_limiter = geocoding.TokenBucket(rate=1e6, capacity=1e6)
+        self._stack.callback(setattr, geocoding, 'rate_limiter', limiter)
+        os.environ.setdefault('GORQ_TEXT_GENERATION_KEY', 'stub-key')
+        llm.reset_client()
+        self._stack.callback(llm.reset_client)
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+
+    def reset_counters(self):
+        for server in self.servers.values():
+            server.reset_counters()
+
+    def counters(self):
+        return {name: {'requests': server.requests, 'errors': server.errors} for name, server in self.servers.items()}
+
+
+class BenchData:
+    """
+    Seeded doctors and patients, with a token each. They are committed so
+    every thread and connection sees them, and deleted on exit along with
+    any user the registration scenarios created.
+    """
+
+    def __init__(self, doctors=2000, patients=200, seed=0):
+        self.doctor_count = doctors
+        self.patient_count = patients
+        self.seed = seed
+        self.audio = synthetic_wav()
+        self._audio_dir = None
+        self._store = None
+
+    def __enter__(self):
+        self.cleanup()
+        seed_doctors(self.doctor_count, seed=self.seed, phone_prefix=DOCTOR_PREFIX)
+        seed_patients(self.patient_count, seed=self.seed, phone_prefix=PATIENT_PREFIX)
+        self.doctors = list(Doctor.objects.filter(phonenumber__startswith=DOCTOR_PREFIX).order_by('pk')[:self.patient_count])
+        self.patients = list(Patient.objects.filter(phonenumber__startswith=PATIENT_PREFIX).order_by('pk'))
+        self.doctor_tokens = [authentication.generate_token(doctor) for doctor in self.doctors]
+        self.patient_tokens = [authentication.generate_token(patient) for patient in self.patients]
+
+        # Audio for the TTS routes goes into a scratch store instead of the real one
+        self._audio_dir = tempfile.TemporaryDirectory(prefix='bench-tts-')
+        self._store = tts.store
+        tts.store = tts.AudioStore(self._audio_dir.name, self._store.max_bytes)
+        self.voice_keys = []
+        for text in VOICE_TEXTS:
+            key = tts.audio_key(text, 'en')
+            tts.store.put(key, b'ID3' + key.encode() * 64)
+            self.voice_keys.append(key)
+        return self
+
+    def __exit__(self, *exc):
+        tts.store = self._store
+        self._audio_dir.cleanup()
+        self.cleanup()
+
+    def cleanup(self):
+        for model, role in ((Doctor, 'doctor'), (Patient, 'patient')):
+            users = model.objects.filter(phonenumber__startswith=BENCH_PREFIX)
+            GeocodeJob.objects.filter(role=role, user_id__in=list(users.values_list('pk', flat=True))).delete()
+            users.delete()
+
+    def patient(self, i):
+        return self.patients[i % len(self.patients)]
+
+    def patient_auth(self, i):
+        return {'Authorization': f'Bearer {self.patient_tokens[i % len(self.patient_tokens)]}'}
+
+    def doctor(self, i):
+        return self.doctors[i % len(self.doctors)]
+
+    def doctor_auth(self, i):
+        return {'Authorization': f'Bearer {self.doctor_tokens[i % len(self.doctor_tokens)]}'}
+
+
+def json_body(payload, **kwargs):
+    return {'data': payload, 'content_type': 'application/json', **kwargs}
+
+
+def register(role_digit):
+    def build(data, i):
+        latitude, longitude = DEFAULT_CENTER
+        return json_body({
+            'phonenumber': f'{REGISTER_PREFIX}{role_digit}{i:07d}',
+            'latitude': round(latitude + (i % 100) * 0.001, 4),
+            'longitude': round(longitude + (i // 100) * 0.001, 4),
+        })
+    return build
+
+
+def voice_upload(data, i):
+    return {'data': {'voice_input': SimpleUploadedFile('note.wav', data.audio, content_type='audio/wav')}}
+
+
+def chatbot_request(data, i):
+    return json_body({'text': CHATBOT_QUERIES[i % len(CHATBOT_QUERIES)], 'lang': 'en'},
+                     query={'id': data.patient(i).phonenumber})
+
+
+def navigation_request(data, i):
+    return json_body({'query': NAVIGATION_QUERIES[i % len(NAVIGATION_QUERIES)], 'lang': 'en'})
+
+
+def batch_request(data, i, size=50):
+    # Unique per request so every query reaches the LLM stub
+    return json_body({'kind': 'specialization', 'queries': [f'{CHATBOT_QUERIES[j % len(CHATBOT_QUERIES)]} case {i} {j}' for j in range(size)]},
+                     headers=data.patient_auth(i))
+
+
+def nearby_hospital_request(data, i):
+    return {'headers': data.patient_auth(i)}
+
+
+class EventLoop:
+    """A loop on its own thread that the async routes' requests run on."""
+
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='bench-loop', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+class Scenario:
+    """
+    Requests to one route: ``build(data, i)`` returns the keyword arguments
+    of the i-th client call, plus optional ``query`` (added to the URL) and
+    ``url_args`` (to reverse it with). ``asgi`` routes are async views.
+    """
+
+    def __init__(self, name, url_name, method='get', build=None, asgi=False):
+        self.name = name
+        self.url_name = url_name
+        self.method = method
+        self.build = build or (lambda data, i: {})
+        self.asgi = asgi
+
+    def prepare(self, data, i):
+        kwargs = self.build(data, i)
+        path = reverse(self.url_name, args=kwargs.pop('url_args', ()))
+        if 'query' in kwargs:
+            path += '?' + urlencode(kwargs.pop('query'))
+        return path, kwargs
+
+    def send(self, client, data, i):
+        path, kwargs = self.prepare(data, i)
+        response = getattr(client, self.method)(path, **kwargs)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response.status_code
+
+    async def asend(self, client, data, i):
+        path, kwargs = self.prepare(data, i)
+        response = await getattr(client, self.method)(path, **kwargs)
+        return response.status_code
+
+
+SCENARIOS = [
+    # user
+    Scenario('register-patient', 'register_patient', 'post', register(0)),
+    Scenario('register-doctor', 'register_doctor', 'post', register(1)),
+    Scenario('login-patient', 'login_patient', 'post', lambda data, i: json_body({'phonenumber': data.patient(i).phonenumber})),
+    Scenario('login-doctor', 'login_doctor', 'post', lambda data, i: json_body({'phonenumber': data.doctor(i).phonenumber})),
+    Scenario('update-profile', 'update_profile', 'patch',
+             lambda data, i: json_body({'bio': f'bench update {i}'}, headers=data.patient_auth(i))),
+    Scenario('view-profile', 'view_profile', 'get', lambda data, i: {'headers': data.patient_auth(i)}),
+    Scenario('doctors', 'get_available_doctors', 'get', lambda data, i: {
+        'data': {'specialization': SPECIALIZATION_CHOICES[i % len(SPECIALIZATION_CHOICES)][0], 'limit': 20},
+    }),
+    Scenario('nearest-doctors', 'find_nearest_doctors', 'get', lambda data, i: {
+        'data': {'phonenumber': data.patient(i).phonenumber, 'role': 'patient'},
+    }),
+    Scenario('nearby-hospital', 'nearby_hospital', 'get', nearby_hospital_request),
+    Scenario('nearby-hospital-async', 'nearby_hospital_async', 'get', nearby_hospital_request, asgi=True),
+    # classify
+    Scenario('process-voice', 'process_voice', 'post', voice_upload),
+    Scenario('process-voice-async', 'process-voice-async', 'post', voice_upload, asgi=True),
+    Scenario('medical-chatbot', 'medical-chatbot', 'post', chatbot_request),
+    Scenario('medical-chatbot-async', 'medical-chatbot-async', 'post', chatbot_request, asgi=True),
+    Scenario('medical-chatbot-stream', 'medical-chatbot-stream', 'post', chatbot_request),
+    Scenario('check-navigation', 'check-navigation', 'post', navigation_request),
+    Scenario('check-navigation-async', 'check-navigation-async', 'post', navigation_request, asgi=True),
+    Scenario('classification-cache', 'classification-cache', 'get',
+             lambda data, i: {'headers': {'Authorization': f'Bearer {METRICS_TOKEN}'}}),
+    Scenario('classify-batch', 'classify-batch', 'post', batch_request),
+    Scenario('text-to-voice', 'text-to-voice', 'post',
+             lambda data, i: json_body({'text': VOICE_TEXTS[i % len(VOICE_TEXTS)], 'lang': 'en'})),
+    Scenario('voice-audio', 'voice-audio', 'get',
+             lambda data, i: {'url_args': [data.voice_keys[i % len(data.voice_keys)]]}),
+    Scenario('db-stats', 'db-stats', 'get', lambda data, i: {'headers': {'Authorization': f'Bearer {METRICS_TOKEN}'}}),
+    Scenario('metrics', 'metrics', 'get', lambda data, i: {'headers': {'Authorization': f'Bearer {METRICS_TOKEN}'}}),
+]
+
+
+def uncovered_routes():
+    """Names of routes in the classify and user URLconfs that no scenario requests."""
+    covered = {scenario.url_name for scenario in SCENARIOS}
+    names = [pattern.name for pattern in classify_urls.urlpatterns + user_urls.urlpatterns]
+    return [name for name in names if name not in covered]
+
+
+def reset_caches():
+    cache.clear()
+    page_cache.clear()
+    specialization_cache.clear()
+    profile_cache.clear()
+    authentication.clear_cache()
+
+
+@contextmanager
+def counting_queries():
+    """
+    A QueryCounter on this thread's connection and on every connection
+    opened meanwhile, e.g. by request threads or the chatbot's stage pool.
+    """
+    counter = QueryCounter()
+
+    def install(sender, connection, **kwargs):
+        # The wrapper list outlives reconnects of the same connection object
+        if counter not in connection.execute_wrappers:
+            connection.execute_wrappers.append(counter)
+
+    install(None, connection)
+    connection_created.connect(install, weak=False)
+    try:
+        yield counter
+    finally:
+        connection_created.disconnect(install)
+        if counter in connection.execute_wrappers:
+            connection.execute_wrappers.remove(counter)
+
+
+def run(scenario, data, upstreams, queries, loop, requests=200, concurrency=1, warmup=5):
+    """
+    Time ``requests`` requests of ``scenario`` after ``warmup`` untimed ones,
+    from ``concurrency`` threads; async routes are awaited on ``loop``.
+    """
+    reset_caches()
+    local = threading.local()
+
+    def send(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = AsyncClient() if scenario.asgi else Client()
+        with Timer() as timer:
+            if scenario.asgi:
+                status = loop.run(scenario.asend(client, data, i))
+            else:
+                status = scenario.send(client, data, i)
+        return status, timer.elapsed
+
+    for i in range(warmup):
+        send(i)
+    upstreams.reset_counters()
+    queries.reset()
+    with Timer() as wall:
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(send, range(warmup, warmup + requests)))
+        else:
+            results = [send(i) for i in range(warmup, warmup + requests)]
+
+    queries_per_request = round(queries.count / requests, 3)
+    upstream = upstreams.counters()
+    # Registrations leave geocode jobs behind; run them now so their queries
+    # and upstream calls are not counted against the next scenario
+    while geocode_queue.process_batch(wait=0):
+        pass
+
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'route': reverse(scenario.url_name, args=scenario.build(data, 0).get('url_args', ())),
+        'method': scenario.method.upper(),
+        'asgi': scenario.asgi,
+        'concurrency': concurrency,
+        'throughput_rps': round(requests / wall.elapsed, 2),
+        **summarize([elapsed for _, elapsed in results]),
+        'status': statuses,
+        'errors': sum(count for status, count in statuses.items() if int(status) >= 400),
+        'non_2xx': sum(count for status, count in statuses.items() if not 200 <= int(status) < 300),
+        'db_queries_per_request': queries_per_request,
+        'upstream_requests_per_request': {
+            name: round(counts['requests'] / requests, 3) for name, counts in upstream.items() if counts['requests']
+        },
+    }
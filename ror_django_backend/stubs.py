@@ -0,0 +1,333 @@
+"""
+Local stand-ins for the upstream services, used by the benchmark commands.
+
+Each stub is a threaded HTTP/1.1 server that keeps connections alive and
+counts both the TCP connections it accepted (every one of which would be a
+TLS handshake against the real service) and the requests it served. Latency
+is either fixed or drawn from a distribution (see ``parse_latency``), and a
+share of requests can be failed with a 503 to exercise the error paths.
+"""
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_latency(spec):
+    """
+    Latency from a command-line spec in milliseconds: ``200`` (fixed),
+    ``uniform:100:300``, ``normal:200:50``, ``lognormal:200:0.5`` (median and
+    sigma) or ``exp:200`` (mean). Returns seconds, or a function of a
+    ``random.Random`` drawing seconds.
+    """
+    name, _, args = str(spec).partition(':')
+    if not args:
+        return float(name) / 1000
+    values = [float(value) for value in args.split(':')]
+    if name == 'uniform':
+        low, high = values
+        return lambda rng: rng.uniform(low, high) / 1000
+    if name == 'normal':
+        mean, stdev = values
+        return lambda rng: max(0.0, rng.gauss(mean, stdev)) / 1000
+    if name == 'lognormal':
+        median, sigma = values
+        return lambda rng: rng.lognormvariate(math.log(median), sigma) / 1000
+    if name == 'exp':
+        mean, = values
+        return lambda rng: rng.expovariate(1 / mean) / 1000
+    raise ValueError(f'Unknown latency distribution: {name}')
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+    def __init__(self, handler_class, latency=0.0, error_rate=0.0, seed=None, host='127.0.0.1', port=0):
+        super().__init__((host, port), handler_class)
+        # Seconds, or a function drawing them from the server's random source
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        # Requests inside their simulated latency right now, and the most seen at once
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._counter_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def process_request(self, request, client_address):
+        with self._counter_lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on calls they cancelled or gave up on; that is expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def count_request(self):
+        """Count a request and draw its latency and whether it fails."""
+        with self._counter_lock:
+            self.requests += 1
+            delay = self.latency(self.rng) if callable(self.latency) else self.latency
+            failed = self.error_rate > 0 and self.rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return delay, failed
+
+    def enter(self):
+        with self._counter_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self._counter_lock:
+            self.in_flight -= 1
+
+    def reset_counters(self):
+        with self._counter_lock:
+            self.connections = 0
+            self.requests = 0
+            self.errors = 0
+            self.max_in_flight = self.in_flight
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def read_json(self):
+        body = self.read_body()
+        return json.loads(body) if body else {}
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate_latency(self):
+        """
+        Wait out this request's latency. Returns False, having answered with
+        a 503, when the request was picked to fail.
+        """
+        delay, failed = self.server.count_request()
+        if delay:
+            self.server.enter()
+            try:
+                time.sleep(delay)
+            finally:
+                self.server.leave()
+        if failed:
+            self.send_json({'error': {'message': 'stub upstream failure'}}, status=503)
+            return False
+        return True
+
+
+class FakeGroqHandler(StubHandler):
+    """
+    Answers OpenAI-style ``/chat/completions`` calls with a fixed reply.
+
+    Generation takes ``token_delay`` seconds per word after the server's
+    usual latency; streaming requests get each word as a server-sent event
+    as soon as it is "generated", others wait for the whole reply.
+    Subclasses can answer per prompt by overriding ``reply_for``.
+    """
+
+    reply = 'medibot'
+    token_delay = 0.0
+
+    def reply_for(self, request):
+        return self.reply
+
+    def do_POST(self):
+        request = self.read_json()
+        if not self.simulate_latency():
+            return
+        reply = self.reply_for(request)
+        if request.get('stream'):
+            self.stream_reply(request, reply)
+            return
+        if self.token_delay:
+            time.sleep(self.token_delay * (len(reply.split(' ')) - 1))
+        self.send_json({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': reply},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        })
+
+    def stream_reply(self, request, reply):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        words = reply.split(' ')
+        for index, word in enumerate(words):
+            if index and self.token_delay:
+                time.sleep(self.token_delay)
+            self.write_event({'content': word if index == 0 else ' ' + word}, None, request)
+        self.write_event({}, 'stop', request)
+        self.write_chunk(b'data: [DONE]\n\n')
+        self.write_chunk(b'')
+
+    def write_event(self, delta, finish_reason, request):
+        chunk = {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+        self.write_chunk(f'data: {json.dumps(chunk)}\n\n'.encode())
+
+    def write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+class FakeOverpassHandler(StubHandler):
+    """
+    Answers Overpass ``around:`` and bounding-box queries with hospitals laid
+    out on a fixed lattice, so overlapping queries return consistent results.
+    """
+
+    spacing = 0.02
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query).get('data', [''])[0]
+        if not self.simulate_latency():
+            return
+        boxes = set()
+        for radius, lat, lon in re.findall(r'around:([\d.]+),([-\d.]+),([-\d.]+)', query):
+            dlat = float(radius) / 111320
+            dlon = dlat / max(math.cos(math.radians(float(lat))), 0.01)
+            boxes.add((float(lat) - dlat, float(lon) - dlon, float(lat) + dlat, float(lon) + dlon))
+        for box in re.findall(r'\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)', query):
+            boxes.add(tuple(float(value) for value in box))
+
+        elements = {}
+        for south, west, north, east in boxes:
+            for i in range(math.ceil(south / self.spacing), math.floor(north / self.spacing) + 1):
+                for j in range(math.ceil(west / self.spacing), math.floor(east / self.spacing) + 1):
+                    node_id = (i + 10000) * 100000 + (j + 20000)
+                    elements[node_id] = {
+                        'type': 'node',
+                        'id': node_id,
+                        'lat': i * self.spacing,
+                        'lon': j * self.spacing,
+                        'tags': {'amenity': 'hospital', 'name': f'Hospital {node_id}'},
+                    }
+        self.send_json({'elements': list(elements.values())})
+
+
+class FakeNominatimHandler(StubHandler):
+    """Answers Nominatim ``/reverse`` lookups with an address built from the coordinates."""
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        if not self.simulate_latency():
+            return
+        lat = params.get('lat', ['0'])[0]
+        lon = params.get('lon', ['0'])[0]
+        self.send_json({
+            'place_id': 1,
+            'lat': lat,
+            'lon': lon,
+            'display_name': f'Stub Street, near {lat},{lon}, Bengaluru, Karnataka, India',
+            'address': {'city': 'Bengaluru', 'state': 'Karnataka', 'country': 'India'},
+        })
+
+
+class FakeGoogleSpeechHandler(StubHandler):
+    """
+    Answers Google Web Speech ``recognize`` calls. Audio "in" the language
+    set as ``spoken`` is transcribed confidently; other languages get
+    nothing back, or a ``mismatch_confidence`` guess when that is set.
+    Recognition takes ``realtime_factor`` seconds per second of audio on top
+    of the server's latency.
+    """
+
+    spoken = 'en-IN'
+    transcript = 'i have a headache since morning'
+    mismatch_confidence = 0.0
+    realtime_factor = 0.0
+
+    def do_POST(self):
+        language = parse_qs(urlparse(self.path).query).get('lang', [''])[0]
+        body = self.read_body()
+        if not self.simulate_latency():
+            return
+        if self.realtime_factor:
+            time.sleep(self.realtime_factor * self.flac_seconds(body))
+        if language == self.spoken:
+            alternative = {'transcript': self.transcript, 'confidence': 0.92}
+        elif self.mismatch_confidence:
+            alternative = {'transcript': 'mera sar dard', 'confidence': self.mismatch_confidence}
+        else:
+            alternative = None
+
+        lines = [json.dumps({'result': []})]
+        if alternative:
+            lines.append(json.dumps({'result': [{'alternative': [alternative], 'final': True}], 'result_index': 0}))
+        body = ('\n'.join(lines) + '\n').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def flac_seconds(body):
+        # STREAMINFO follows the 'fLaC' marker and a 4-byte block header;
+        # bytes 10-17 pack the sample rate (20 bits) and total samples (36 bits)
+        if body[:4] != b'fLaC' or len(body) < 26:
+            return 0.0
+        packed = int.from_bytes(body[18:26], 'big')
+        rate = packed >> 44
+        samples = packed & ((1 << 36) - 1)
+        return samples / rate if rate else 0.0
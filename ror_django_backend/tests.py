@@ -0,0 +1,202 @@
+import logging
+import threading
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import async_to_sync
+from django.core.signals import request_finished, request_started
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from user.models import Doctor
+from . import db, logs, metrics
+
+
+class OperationalEndpointTests(SimpleTestCase):
+    def test_hidden_without_a_configured_token(self):
+        with override_settings(METRICS_TOKEN=''):
+            for name in ('metrics', 'db-stats', 'classification-cache'):
+                self.assertEqual(self.client.get(reverse(name)).status_code, 404)
+                self.assertEqual(self.client.get(reverse(name), headers={'Authorization': 'Bearer '}).status_code, 404)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_requires_the_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds', response.content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_database_stats_require_the_token(self):
+        self.assertEqual(self.client.get(reverse('db-stats')).status_code, 403)
+        response = self.client.get(reverse('db-stats'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('connections_opened', response.json())
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_classification_cache_stats_require_the_token(self):
+        self.assertEqual(self.client.get(reverse('classification-cache')).status_code, 403)
+        response = self.client.get(reverse('classification-cache'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'page', 'specialization'})
+
+
+class HistogramTests(SimpleTestCase):
+    def test_prometheus_text_format(self):
+        histogram = metrics.Histogram('upstream_seconds', 'Upstream time.', ('span',), buckets=(0.1, 1))
+        for seconds in (0.05, 0.1, 0.5, 5):
+            histogram.observe(seconds, 'groq')
+        histogram.observe(0.2, 'say "hi"\n')
+        self.assertEqual(histogram.render().split('\n'), [
+            '# HELP upstream_seconds Upstream time.',
+            '# TYPE upstream_seconds histogram',
+            'upstream_seconds_bucket{span="groq",le="0.1"} 2',
+            'upstream_seconds_bucket{span="groq",le="1"} 3',
+            'upstream_seconds_bucket{span="groq",le="+Inf"} 4',
+            'upstream_seconds_sum{span="groq"} 5.650000',
+            'upstream_seconds_count{span="groq"} 4',
+            'upstream_seconds_bucket{span="say \\"hi\\"\\n",le="0.1"} 0',
+            'upstream_seconds_bucket{span="say \\"hi\\"\\n",le="1"} 1',
+            'upstream_seconds_bucket{span="say \\"hi\\"\\n",le="+Inf"} 1',
+            'upstream_seconds_sum{span="say \\"hi\\"\\n"} 0.200000',
+            'upstream_seconds_count{span="say \\"hi\\"\\n"} 1',
+        ])
+
+    def test_unlabelled_series_have_no_braces(self):
+        histogram = metrics.Histogram('job_seconds', 'Job time.', buckets=(1,))
+        histogram.observe(0.5)
+        self.assertIn('job_seconds_sum 0.500000', histogram.render())
+        self.assertIn('job_seconds_bucket{le="1"} 1', histogram.render())
+
+    def test_render_includes_every_histogram_and_dropped_logs(self):
+        text = metrics.render()
+        for name in ('http_request_duration_seconds', 'span_duration_seconds', 'chatbot_stage_duration_seconds'):
+            self.assertIn(f'# TYPE {name} histogram', text)
+        self.assertRegex(text, r'\nlog_records_dropped_total \d+\n$')
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_SERVER_TIMING=True)
+class ServerTimingTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def view(self, request):
+        with metrics.span('groq'):
+            pass
+        # Spans on a pool thread count too, when submitted in context
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pool.submit(metrics.in_context(metrics.record), 'groq', 0.25).result()
+        response = HttpResponse('ok')
+        response['Server-Timing'] = 'specialization;dur=12.0'
+        return response
+
+    def assert_server_timing(self, response):
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^specialization;dur=12\.0, groq;desc="2x";dur=25\d\.\d, total;dur=\d+\.\d$',
+        )
+        self.assertEqual(list(metrics.REQUESTS.snapshot()), [('GET', 'unmatched', '200')])
+
+    def test_header_lists_the_view_timings_then_the_spans(self):
+        self.assert_server_timing(metrics.MetricsMiddleware(self.view)(RequestFactory().get('/')))
+
+    def test_async_requests_get_the_same_header(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = metrics.MetricsMiddleware(view)
+        self.assert_server_timing(async_to_sync(middleware)(RequestFactory().get('/')))
+
+    def test_spans_outside_a_request_only_reach_the_histogram(self):
+        metrics.record('groq', 0.5)
+        self.assertEqual(metrics.SPANS.snapshot()[('groq',)][1], 0.5)
+
+
+class StalledHandler(logging.Handler):
+    """Blocks in ``emit`` until released, like a file handler on a stalled disk."""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.released = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.entered.set()
+        self.released.wait(10)
+        self.messages.append(record.getMessage())
+
+
+class BufferedLoggingTests(SimpleTestCase):
+    def record(self, message, level=logging.INFO, name='classify.views'):
+        return logging.LogRecord(name, level, __file__, 0, message, None, None)
+
+    def test_records_are_dropped_and_counted_when_the_queue_is_full(self):
+        target = StalledHandler()
+        handler = logs.BufferedHandler([target], queue_size=2)
+        self.addCleanup(handler.close)
+        self.addCleanup(target.released.set)
+        handler.handle(self.record('first'))
+        # The listener holds the first record; the next two fill the queue
+        self.assertTrue(target.entered.wait(10))
+        for i in range(5):
+            handler.handle(self.record(f'queued {i}'))
+        self.assertEqual(handler.dropped, 3)
+        self.assertGreaterEqual(logs.dropped_records(), 3)
+
+        target.released.set()
+        handler.close()
+        self.assertEqual(target.messages, ['first', 'queued 0', 'queued 1'])
+
+    def test_sampling_keeps_the_configured_share(self):
+        sampling = logs.SamplingFilter(rate=0.25, rates={'classify': 0.5, 'classify.views': 0})
+        draws = [i / 100 for i in range(100)]
+
+        def kept(name, level=logging.INFO):
+            with mock.patch.object(logs.random, 'random', side_effect=draws):
+                return sum(sampling.filter(self.record('m', level, name)) for _ in draws)
+
+        self.assertEqual(kept('user.views'), 25)
+        self.assertEqual(kept('classify.speech'), 50)
+        # The longest matching prefix wins, and names only match whole parts
+        self.assertEqual(kept('classify.views'), 0)
+        self.assertEqual(kept('classifyx'), 25)
+        self.assertEqual(kept('classify.views', logging.WARNING), 100)
+
+
+class ConnectionReuseTests(TransactionTestCase):
+    def serve(self, requests):
+        """``requests`` requests on a new thread, as a gthread worker serves them."""
+        def run():
+            for _ in range(requests):
+                request_started.send(sender=self.__class__)
+                Doctor.objects.exists()
+                request_finished.send(sender=self.__class__)
+            connections.close_all()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+    def connections_opened(self, conn_max_age, requests=5):
+        settings_dict = connections.settings['default']
+        original = settings_dict['CONN_MAX_AGE']
+        settings_dict['CONN_MAX_AGE'] = conn_max_age
+        try:
+            db.reset()
+            self.serve(requests)
+            return db.connection_stats()['connections_opened']
+        finally:
+            settings_dict['CONN_MAX_AGE'] = original
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('in-memory SQLite connections are never closed')
+
+    def test_persistent_connections_are_reused_across_requests(self):
+        self.assertEqual(self.connections_opened(600), 1)
+
+    def test_per_request_connections_are_reopened(self):
+        self.assertEqual(self.connections_opened(0), 5)
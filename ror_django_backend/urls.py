@@ -18,11 +18,14 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from . import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/classify/', include('classify.urls')),
-    path('api/users/',include('user.urls'))
+    path('api/users/',include('user.urls')),
+    path('api/db-stats/', views.database_stats, name='db-stats'),
+    path('api/metrics/', views.metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,36 @@
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import BasePermission
+from . import db, metrics
+
+
+class HasMetricsToken(BasePermission):
+    """
+    Operational endpoints: only for requests bearing METRICS_TOKEN, and
+    hidden as if unrouted while it is unset.
+    """
+
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        if not token:
+            raise NotFound()
+        scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(value.strip().encode(), token.encode())
+
+
+# The bearer token is not a user JWT, so the default authentication stays off
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([HasMetricsToken])
+def database_stats(request):
+    return JsonResponse(db.connection_stats(), status=200)
+
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([HasMetricsToken])
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class UserConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'user'
+
+    def ready(self):
+        from django.core.signals import request_started
+        from . import signals  # noqa: F401
+        from . import geocode_queue
+        # Not here directly: ready() also runs for migrate and other commands,
+        # and must not touch the database
+        request_started.connect(geocode_queue.start_worker, dispatch_uid='geocode_worker_start')
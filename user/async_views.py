@@ -0,0 +1,37 @@
+"""
+Async variants of the user endpoints that wait on upstreams, for ASGI
+deployments; see ``classify.async_views``.
+"""
+import logging
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions
+from . import authentication, profile_cache
+from .utils import aget_nearby_medical_centers, find_hospital_distance
+
+logger = logging.getLogger(__name__)
+
+
+@require_GET
+async def nearby_hospital(request):
+    phone_number = request.GET.get('id')
+    user_role = request.GET.get('user_role')
+    specialization = request.GET.get('specialization')
+    try:
+        identity = authentication.authenticate(request)
+    except exceptions.AuthenticationFailed as e:
+        return JsonResponse({'error': str(e.detail)}, status=401)
+
+    if identity:
+        pk, user_role = identity
+        profile = await profile_cache.aget_profile(user_role, pk=pk)
+    else:
+        profile = await profile_cache.aget_profile(user_role, phonenumber=phone_number)
+    if not profile:
+        return JsonResponse({'error': 'User not found'}, status=404)
+    if not profile['latitude'] or not profile['longitude']:
+        return JsonResponse({'error': 'Location not available'}, status=400)
+    hospitals = await aget_nearby_medical_centers(profile['latitude'], profile['longitude'], specialization=specialization)
+    calculate_hospital_distance = find_hospital_distance(hospitals=hospitals, user_lat=profile['latitude'], user_long=profile['longitude'])
+
+    return JsonResponse({'hospitals': calculate_hospital_distance}, status=200)
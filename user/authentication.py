@@ -0,0 +1,127 @@
+"""
+Stateless authentication with the app's own JWTs.
+
+Tokens carry the user's primary key and role, so a request is authenticated
+from the token alone, without looking the user up by phone number. Decoded
+claims of recently seen tokens are kept in a small LRU; a hit skips the
+HMAC check and only compares the expiry.
+"""
+import time
+import datetime
+import threading
+from collections import OrderedDict
+import jwt
+from django.conf import settings
+from rest_framework import authentication, exceptions
+
+ALGORITHM = 'HS256'
+ROLES = ('doctor', 'patient')
+
+_decoded = OrderedDict()
+_decoded_lock = threading.Lock()
+
+
+def generate_token(user):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    payload = {
+        # 'id' stays the phone number for clients that read it
+        'id': user.phonenumber,
+        'pk': user.pk,
+        # The model, not the role column, whose default is 'Patient'
+        'role': user._meta.model_name,
+        'iat': now,
+        'exp': now + datetime.timedelta(seconds=settings.AUTH_TOKEN_LIFETIME),
+    }
+    return jwt.encode(payload, settings.SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_token(token):
+    """Verified claims of ``token``; raises ``jwt.InvalidTokenError``."""
+    with _decoded_lock:
+        claims = _decoded.get(token)
+        if claims is not None:
+            _decoded.move_to_end(token)
+    if claims is not None:
+        if claims['exp'] <= time.time():
+            with _decoded_lock:
+                _decoded.pop(token, None)
+            raise jwt.ExpiredSignatureError('Signature has expired')
+        return claims
+
+    claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM], options={'require': ['exp']})
+    if settings.AUTH_TOKEN_CACHE_SIZE:
+        with _decoded_lock:
+            _decoded[token] = claims
+            while len(_decoded) > settings.AUTH_TOKEN_CACHE_SIZE:
+                _decoded.popitem(last=False)
+    return claims
+
+
+def clear_cache():
+    with _decoded_lock:
+        _decoded.clear()
+
+
+class TokenUser:
+    """The caller as described by their token; no database row is loaded."""
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims):
+        self.pk = claims['pk']
+        self.role = claims['role']
+        self.phonenumber = claims.get('id')
+
+    def __str__(self):
+        return f'{self.role}:{self.pk}'
+
+
+class JWTAuthentication(authentication.BaseAuthentication):
+    """
+    ``Authorization: Bearer <token>`` with a token from ``generate_token``.
+
+    Requests without a token stay anonymous. Tokens issued before the
+    ``pk``/``role`` claims existed are ignored too, so those clients keep
+    working through the query-parameter lookups until they log in again.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if not header or header[0].decode().lower() != self.keyword.lower():
+            return None
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed('Invalid Authorization header')
+        token = header[1].decode()
+        try:
+            claims = decode_token(token)
+        except jwt.ExpiredSignatureError:
+            raise exceptions.AuthenticationFailed('Token has expired')
+        except jwt.InvalidTokenError:
+            raise exceptions.AuthenticationFailed('Invalid token')
+        if 'pk' not in claims or claims.get('role') not in ROLES:
+            return None
+        return TokenUser(claims), token
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+def token_identity(request):
+    """``(pk, role)`` of the authenticated caller, or None."""
+    user = getattr(request, 'user', None)
+    if isinstance(user, TokenUser):
+        return user.pk, user.role
+    return None
+
+
+def authenticate(request):
+    """
+    ``(pk, role)`` from a plain Django request's bearer token, or None; for
+    views outside DRF. Raises ``AuthenticationFailed`` like the DRF class.
+    """
+    authenticated = JWTAuthentication().authenticate(request)
+    if authenticated is None:
+        return None
+    user, _ = authenticated
+    return user.pk, user.role
@@ -0,0 +1,135 @@
+"""
+Read-optimized doctor directory for ``get_available_doctors``.
+
+Each page of a (specialization, location_name) facet is rendered once into
+its final JSON bytes plus an ETag and kept in the default cache, with a
+short-lived per-process L1 in front of it. Snapshots are filed under a
+directory version read from the default cache on every request; any change
+to a doctor bumps the version. Where that cache is shared (Redis, Memcached)
+every worker sees the new version on its next request. With the default
+per-process LocMemCache only the worker that saw the change does; the
+others serve their snapshots until those expire from their cache, after
+DOCTOR_DIRECTORY_TTL seconds, plus at most DOCTOR_DIRECTORY_L1_TTL in L1.
+
+A page is ``{"doctors": [...], "next_cursor": ...}``, the same shape as
+``find_nearest_doctors``; ``next_cursor`` is null on the last page.
+"""
+import time
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from . import pagination
+from .models import Doctor
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('name', 'specialization', 'experience_years', 'location_name', 'latitude', 'longitude', 'bio')
+VERSION_KEY = 'doctor-directory:version'
+# Part of every snapshot key; bump it when the body layout changes so that a
+# shared cache never serves pages rendered by an older release
+LAYOUT = 2
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+# Striped so that concurrent misses on one facet build it once
+_build_locks = [threading.Lock() for _ in range(16)]
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # add() so that racing workers agree on a single starting version
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def invalidate():
+    """Retire every snapshot in the default cache and this process's L1; called whenever doctors change."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        cache.incr(VERSION_KEY)
+    with _memory_lock:
+        _memory.clear()
+
+
+def facet_key(version, specialization, location_name, fields, after, limit):
+    facet = hashlib.sha1(json.dumps([specialization, location_name, fields, after, limit]).encode()).hexdigest()
+    return f'doctor-directory:{LAYOUT}:{version}:{facet}'
+
+
+def facet_queryset(specialization=None, location_name=None, after=None):
+    """Doctors of a facet in id order after the id ``after``."""
+    doctors = Doctor.objects.all()
+    if specialization:
+        doctors = doctors.filter(specialization=specialization)
+    if location_name:
+        doctors = doctors.filter(location_name=location_name)
+    if after is not None:
+        doctors = doctors.filter(pk__gt=after)
+    return doctors.order_by('pk')
+
+
+def build_snapshot(specialization=None, location_name=None, fields=FIELDS, after=None, limit=None):
+    """
+    ``(etag, body, last_id)`` for one page of a facet, serialized exactly as
+    the API returns it. Pages run in id order after the id ``after``;
+    ``last_id`` is the id to continue from, or None on the last page.
+    """
+    rows = facet_queryset(specialization, location_name, after).values_list('pk', *fields)
+    rows = list(rows[:limit + 1] if limit else rows)
+    last_id = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last_id = rows[-1][0]
+    data = {
+        'doctors': [dict(zip(fields, row[1:])) for row in rows],
+        'next_cursor': pagination.encode_cursor(last_id) if last_id is not None else None,
+    }
+    # Same layout as DRF's JSONRenderer, so clients see no difference
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+    return f'"{hashlib.sha1(body).hexdigest()}"', body, last_id
+
+
+def _recall(key):
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is None:
+            return None
+        expires_at, snapshot = entry
+        if expires_at <= time.monotonic():
+            del _memory[key]
+            return None
+        _memory.move_to_end(key)
+        return snapshot
+
+
+def _remember(key, snapshot):
+    expires_at = time.monotonic() + settings.DOCTOR_DIRECTORY_L1_TTL
+    with _memory_lock:
+        _memory[key] = (expires_at, snapshot)
+        _memory.move_to_end(key)
+        while len(_memory) > settings.DOCTOR_DIRECTORY_MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def get_snapshot(specialization=None, location_name=None, fields=FIELDS, after=None, limit=None):
+    fields = list(fields)
+    key = facet_key(current_version(), specialization or None, location_name or None, fields, after, limit)
+    snapshot = _recall(key)
+    if snapshot is not None:
+        return snapshot
+
+    with _build_locks[int(key[-4:], 16) % len(_build_locks)]:
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = build_snapshot(specialization, location_name, fields, after, limit)
+            cache.set(key, snapshot, timeout=settings.DOCTOR_DIRECTORY_TTL)
+        _remember(key, snapshot)
+    return snapshot
@@ -0,0 +1,91 @@
+import numpy as np
+from .geo import EARTH_RADIUS_KM
+
+# WGS-84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+
+def haversine_km(latitude, longitude, lats, lons):
+    """Great-circle distance from one point to arrays of points, in km."""
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty_km(latitude, longitude, lats, lons, max_iterations=100, tolerance=1e-12):
+    """
+    Vincenty's inverse formula on the WGS-84 ellipsoid for arrays of points,
+    in km. Every point iterates together; the few nearly antipodal pairs that
+    do not converge fall back to the great-circle distance.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    f = WGS84_F
+    L = np.radians(lons - longitude)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(latitude)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lats)))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    converged = np.zeros(lats.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            converged = np.abs(lam - previous) < tolerance
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        ))
+        distance = WGS84_B * A * (sigma - delta_sigma) / 1000
+
+    fallback = ~converged | ~np.isfinite(distance)
+    if fallback.any():
+        distance = np.where(fallback, haversine_km(latitude, longitude, lats, lons), distance)
+    return distance
+
+
+DISTANCE_METHODS = {
+    'haversine': haversine_km,
+    'ellipsoidal': vincenty_km,
+}
+
+
+def distances_km(latitude, longitude, lats, lons, method='haversine'):
+    return DISTANCE_METHODS[method](latitude, longitude, np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+
+
+def nearest(latitude, longitude, lats, lons, k=None, method='haversine'):
+    """
+    Return ``(indices, distances_km)`` of the ``k`` nearest points, closest
+    first. Only those k are sorted; the rest are split off with a partial
+    sort (``argpartition``).
+    """
+    distances = distances_km(latitude, longitude, lats, lons, method)
+    if k is not None and k < len(distances):
+        indices = np.argpartition(distances, k)[:k] if k > 0 else np.array([], dtype=int)
+    else:
+        indices = np.arange(len(distances))
+    indices = indices[np.argsort(distances[indices], kind='stable')]
+    return indices, distances[indices]
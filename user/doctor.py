@@ -1,11 +1,20 @@
-from .models import Doctor, Patient
+import time
+import threading
+from functools import reduce
+import operator
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from .models import Doctor
+from .geo import bounding_box, geohash_cover, haversine, doctor_index
 
+INDEX_VERSION_KEY = 'doctor-index:version'
 
+_index_lock = threading.Lock()
 
 
 def doctor_data(specialization = None, location_name = None):
     doctors = Doctor.objects.all()
-    print('incoming')
     if specialization:
         doctors = doctors.filter(specialization = specialization)
     if location_name:
@@ -13,3 +22,84 @@ def doctor_data(specialization = None, location_name = None):
     return doctors
 
 
+def doctors_in_bounding_box(latitude, longitude, radius_km):
+    """
+    Doctors whose coordinates fall inside the box enclosing the radius.
+
+    The geohash prefixes let the database use the geohash index; the
+    latitude/longitude ranges trim the cells down to the exact box.
+    """
+    min_lat, min_lon, max_lat, max_lon = bounding_box(latitude, longitude, radius_km)
+    doctors = Doctor.objects.filter(
+        latitude__range=(min_lat, max_lat),
+        longitude__range=(min_lon, max_lon),
+    )
+    cells = geohash_cover(min_lat, min_lon, max_lat, max_lon)
+    if cells:
+        doctors = doctors.filter(reduce(operator.or_, (Q(geohash__startswith=cell) for cell in cells)))
+    return doctors
+
+
+def index_version():
+    version = cache.get(INDEX_VERSION_KEY)
+    if version is None:
+        cache.add(INDEX_VERSION_KEY, 1, timeout=None)
+        version = cache.get(INDEX_VERSION_KEY, 1)
+    return version
+
+
+def index_changed():
+    """Bump the index version after doctors change; called once the change commits."""
+    try:
+        version = cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        cache.add(INDEX_VERSION_KEY, 1, timeout=None)
+        version = cache.incr(INDEX_VERSION_KEY)
+    doctor_index.advance(version)
+
+
+def _index_current(version):
+    return (
+        doctor_index.loaded
+        and doctor_index.version == version
+        and time.monotonic() - doctor_index.loaded_at < settings.DOCTOR_SPATIAL_INDEX_MAX_AGE
+    )
+
+
+def get_doctor_index():
+    """
+    The process's doctor index, reloaded when another process has changed
+    doctors (the version in the default cache moved on) or once it is
+    DOCTOR_SPATIAL_INDEX_MAX_AGE seconds old.
+    """
+    version = index_version()
+    if not _index_current(version):
+        with _index_lock:
+            if not _index_current(version):
+                doctor_index.load(
+                    Doctor.objects.filter(latitude__isnull=False, longitude__isnull=False)
+                    .values_list('pk', 'latitude', 'longitude')
+                    .iterator(),
+                    version=version,
+                )
+    return doctor_index
+
+
+def nearby_doctor_distances(latitude, longitude, radius_km=10):
+    """``(pk, distance_km)`` of every doctor within ``radius_km``, nearest first and ties by pk."""
+    if settings.DOCTOR_SPATIAL_INDEX:
+        pairs = get_doctor_index().query_radius(latitude, longitude, radius_km)
+    else:
+        pairs = []
+        for pk, doctor_lat, doctor_lon in doctors_in_bounding_box(latitude, longitude, radius_km).values_list('pk', 'latitude', 'longitude'):
+            distance = haversine(latitude, longitude, doctor_lat, doctor_lon)
+            if distance <= radius_km:
+                pairs.append((pk, distance))
+    return sorted(pairs, key=lambda pair: (pair[1], pair[0]))
+
+
+def nearby_doctors(latitude, longitude, radius_km=10):
+    """Return ``(doctor, distance_km)`` pairs within ``radius_km``, nearest first."""
+    distances = nearby_doctor_distances(latitude, longitude, radius_km)
+    doctors = Doctor.objects.in_bulk([pk for pk, _ in distances])
+    return [(doctors[pk], distance) for pk, distance in distances if pk in doctors]
@@ -0,0 +1,248 @@
+import math
+import time
+import threading
+
+
+EARTH_RADIUS_KM = 6371
+GEOHASH_PRECISION = 7
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Upper bound on the number of geohash prefixes sent in one query; coarser
+# cells are used when a finer covering would need more than this.
+MAX_COVER_CELLS = 16
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """Return the (lat, lon) size in degrees of a geohash cell."""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = math.floor(precision * 5 / 2)
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Return (min_lat, min_lon, max_lat, max_lon) enclosing the radius. Circles
+    that reach a pole or cross the antimeridian get the full longitude range,
+    since a single box cannot wrap around.
+    """
+    distance = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(distance)
+    min_lat = max(latitude - dlat, -90.0)
+    max_lat = min(latitude + dlat, 90.0)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, -180.0, max_lat, 180.0
+    # The widest point of the circle lies poleward of its centre, so the
+    # longitude span is asin(sin d / cos lat), not d / cos lat
+    dlon = math.degrees(math.asin(min(1.0, math.sin(distance) / math.cos(math.radians(latitude)))))
+    if longitude - dlon < -180.0 or longitude + dlon > 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    return min_lat, longitude - dlon, max_lat, longitude + dlon
+
+
+def geohash_bbox(geohash):
+    """Return (min_lat, min_lon, max_lat, max_lon) of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for ch in geohash:
+        bits = GEOHASH_BASE32.index(ch)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if bits >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def geohash_cells(min_lat, min_lon, max_lat, max_lon, precision):
+    """Geohash cells of the given precision that intersect a bounding box."""
+    lat_step, lon_step = geohash_cell_size(precision)
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            cells.add(geohash_encode(min(lat, max_lat), min(lon, max_lon), precision))
+            if lon >= max_lon:
+                break
+            lon += lon_step
+        if lat >= max_lat:
+            break
+        lat += lat_step
+    return sorted(cells)
+
+
+def geohash_cover(min_lat, min_lon, max_lat, max_lon, max_cells=MAX_COVER_CELLS):
+    """
+    Geohash prefixes covering a bounding box, at the finest precision that
+    needs no more than ``max_cells`` cells.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lon_step = geohash_cell_size(precision)
+        lat_cells = math.floor(max_lat / lat_step) - math.floor(min_lat / lat_step) + 1
+        lon_cells = math.floor(max_lon / lon_step) - math.floor(min_lon / lon_step) + 1
+        if lat_cells * lon_cells <= max_cells:
+            return geohash_cells(min_lat, min_lon, max_lat, max_lon, precision)
+    return []
+
+
+class DoctorSpatialIndex:
+    """
+    In-process 2-d tree over doctor coordinates.
+
+    The tree is static once built; inserts, moves and deletes are kept in a
+    small delta that is scanned linearly on every query, and the tree is
+    rebuilt from the live points once the delta grows past ``rebuild_ratio``
+    of the tree size. ``version`` and ``loaded_at`` tell ``get_doctor_index``
+    (user.doctor) when to reload it for changes made by other processes.
+    """
+
+    def __init__(self, rebuild_ratio=0.1, min_rebuild=256):
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild = min_rebuild
+        self._lock = threading.RLock()
+        self._points = {}
+        self._tree = []
+        self._stale = set()
+        self._pending = {}
+        self.loaded = False
+        self.version = None
+        self.loaded_at = None
+
+    def load(self, rows, version=None):
+        """Replace the index contents with ``(pk, latitude, longitude)`` rows."""
+        with self._lock:
+            self._points = {pk: (lat, lon) for pk, lat, lon in rows if lat is not None and lon is not None}
+            self._rebuild()
+            self.loaded = True
+            self.version = version
+            self.loaded_at = time.monotonic()
+
+    def advance(self, version):
+        """
+        Record that this process's own change produced ``version``. Only a
+        direct successor of the loaded version counts; a gap means another
+        process changed doctors too, and the next lookup reloads.
+        """
+        with self._lock:
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+
+    def update(self, pk, latitude, longitude):
+        with self._lock:
+            if latitude is None or longitude is None:
+                self.remove(pk)
+                return
+            self._points[pk] = (latitude, longitude)
+            self._stale.add(pk)
+            self._pending[pk] = (latitude, longitude)
+            self._maybe_rebuild()
+
+    def remove(self, pk):
+        with self._lock:
+            if self._points.pop(pk, None) is None:
+                return
+            self._stale.add(pk)
+            self._pending.pop(pk, None)
+            self._maybe_rebuild()
+
+    def __len__(self):
+        return len(self._points)
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Return ``(pk, latitude, longitude)`` for points inside the box."""
+        with self._lock:
+            tree, stale, pending = self._tree, self._stale, dict(self._pending)
+        found = []
+        if tree:
+            self._search(tree, 0, len(tree), 0, (min_lat, min_lon), (max_lat, max_lon), found)
+        found = [point for point in found if point[0] not in stale]
+        for pk, (lat, lon) in pending.items():
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                found.append((pk, lat, lon))
+        return found
+
+    def query_radius(self, latitude, longitude, radius_km):
+        """Return ``(pk, distance_km)`` for points within ``radius_km``."""
+        results = []
+        for pk, lat, lon in self.query_bbox(*bounding_box(latitude, longitude, radius_km)):
+            distance = haversine(latitude, longitude, lat, lon)
+            if distance <= radius_km:
+                results.append((pk, distance))
+        return results
+
+    def _maybe_rebuild(self):
+        if len(self._stale) > max(self.min_rebuild, self.rebuild_ratio * len(self._tree)):
+            self._rebuild()
+
+    def _rebuild(self):
+        tree = [(pk, lat, lon) for pk, (lat, lon) in self._points.items()]
+        self._build(tree, 0, len(tree), 0)
+        self._tree = tree
+        self._stale = set()
+        self._pending = {}
+
+    def _build(self, points, lo, hi, depth):
+        # Lay the tree out in place: the median of each slice is its root,
+        # split on latitude at even depths and longitude at odd ones.
+        if hi - lo <= 1:
+            return
+        axis = 1 + depth % 2
+        points[lo:hi] = sorted(points[lo:hi], key=lambda point: point[axis])
+        mid = (lo + hi) // 2
+        self._build(points, lo, mid, depth + 1)
+        self._build(points, mid + 1, hi, depth + 1)
+
+    def _search(self, points, lo, hi, depth, low, high, found):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        point = points[mid]
+        axis = depth % 2
+        if low[0] <= point[1] <= high[0] and low[1] <= point[2] <= high[1]:
+            found.append(point)
+        value = point[1 + axis]
+        if low[axis] <= value:
+            self._search(points, lo, mid, depth + 1, low, high, found)
+        if value <= high[axis]:
+            self._search(points, mid + 1, hi, depth + 1, low, high, found)
+
+
+doctor_index = DoctorSpatialIndex()
@@ -0,0 +1,156 @@
+"""
+Background reverse geocoding for new registrations.
+
+Registration saves the user with ``location_name`` unset and records a
+GeocodeJob; a daemon thread in the same process picks due jobs up in
+batches, resolves each distinct coordinate once and back-fills the address.
+Jobs live in the database, so a restart loses nothing: the thread also
+starts on each process's first request and picks up jobs left pending, or
+running under an expired lease, by a previous process. The
+``drain_geocode_jobs`` command can clear a backlog.
+"""
+import random
+import logging
+import threading
+from functools import partial
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from .models import Doctor, Patient, GeocodeJob
+from .geocoding import coordinate_key, reverse_geocode
+from . import directory
+from . import profile_cache
+
+logger = logging.getLogger(__name__)
+
+MODELS = {'doctor': Doctor, 'patient': Patient}
+
+
+def enqueue(user):
+    """Queue a reverse geocode of ``user``'s coordinates once the current transaction commits."""
+    try:
+        latitude, longitude = float(user.latitude), float(user.longitude)
+    except (TypeError, ValueError):
+        return None
+    job = GeocodeJob.objects.create(role=user.role, user_id=user.pk, latitude=latitude, longitude=longitude)
+    transaction.on_commit(worker.wake)
+    return job
+
+
+def claim_batch(limit):
+    """
+    Claim up to ``limit`` due jobs. Claimed jobs are marked running with a
+    lease; if the process dies mid-batch the lease runs out and another
+    worker picks them up again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            GeocodeJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='pending') | Q(status='running'), next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:limit]
+        )
+        if jobs:
+            GeocodeJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status='running',
+                next_attempt_at=now + timedelta(seconds=settings.GEOCODE_JOB_LEASE),
+            )
+    return jobs
+
+
+def process_batch(limit=None, wait=None):
+    """Resolve one batch of due jobs; returns the number of jobs handled."""
+    jobs = claim_batch(limit or settings.GEOCODE_BATCH_SIZE)
+    addresses = {}
+    for job in jobs:
+        key = coordinate_key(job.latitude, job.longitude)
+        if key not in addresses:
+            addresses[key] = reverse_geocode(job.latitude, job.longitude, wait=wait)
+
+        address = addresses[key]
+        if address:
+            # Only fill in a location the user has not set in the meantime
+            updated = MODELS[job.role].objects.filter(pk=job.user_id, location_name__isnull=True).update(location_name=address)
+            if updated:
+                # update() sends no post_save, so the caches are told directly
+                transaction.on_commit(partial(profile_cache.refresh, job.role, job.user_id))
+                if job.role == 'doctor':
+                    transaction.on_commit(directory.invalidate)
+            job.status = 'done'
+            job.last_error = ''
+        else:
+            job.attempts += 1
+            job.last_error = 'Reverse geocoding returned no address'
+            if job.attempts >= settings.GEOCODE_JOB_MAX_ATTEMPTS:
+                job.status = 'failed'
+            else:
+                job.status = 'pending'
+                delay = settings.GEOCODE_JOB_BACKOFF * 2 ** (job.attempts - 1)
+                job.next_attempt_at = timezone.now() + timedelta(seconds=delay * random.uniform(1, 1.5))
+        job.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error'])
+    return len(jobs)
+
+
+def next_due_in():
+    """Seconds until the next pending job is due, or None if there is none."""
+    next_attempt_at = (
+        GeocodeJob.objects.filter(status__in=['pending', 'running'])
+        .order_by('next_attempt_at')
+        .values_list('next_attempt_at', flat=True)
+        .first()
+    )
+    if next_attempt_at is None:
+        return None
+    return max(0.0, (next_attempt_at - timezone.now()).total_seconds())
+
+
+class GeocodeWorker:
+    """In-process daemon thread, started by ``start`` or the first wake-up."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the thread unless it is running; its first pass handles every due job."""
+        if not settings.GEOCODE_WORKER_ENABLED:
+            return
+        # A forked child sees the parent's thread as stopped and starts its own
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='geocode-worker', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self.start()
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.clear()
+            try:
+                while process_batch(wait=settings.GEOCODE_WORKER_RATE_WAIT):
+                    pass
+                sleep = next_due_in()
+            except Exception:
+                logger.error("Geocode worker failed to process a batch", exc_info=True)
+                sleep = settings.GEOCODE_JOB_BACKOFF
+            finally:
+                close_old_connections()
+            # Jobs due but claimed elsewhere report 0s; don't spin on them
+            poll = settings.GEOCODE_WORKER_POLL
+            self._event.wait(timeout=poll if sleep is None else min(max(sleep, 1.0), poll))
+
+
+worker = GeocodeWorker()
+
+
+def start_worker(sender, **kwargs):
+    """``request_started`` receiver: only processes that serve requests run the worker."""
+    worker.start()
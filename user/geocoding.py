@@ -0,0 +1,124 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from django.conf import settings
+from geopy.geocoders import Nominatim
+from ror_django_backend import metrics
+from .models import ReverseGeocode
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second with bursts of up to ``capacity``."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=0):
+        """Take a token, waiting up to ``timeout`` seconds; False if none came free."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class AddressLRU:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            address = self._entries.get(key)
+            if address is not None:
+                self._entries.move_to_end(key)
+            return address
+
+    def set(self, key, address):
+        with self._lock:
+            self._entries[key] = address
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+memory = AddressLRU(settings.GEOCODE_MEMORY_ENTRIES)
+# Nominatim's usage policy allows one request per second
+rate_limiter = TokenBucket(settings.NOMINATIM_RATE, settings.NOMINATIM_BURST)
+
+
+@lru_cache(maxsize=4)
+def _geolocator(domain, scheme, user_agent, timeout):
+    return Nominatim(user_agent=user_agent, domain=domain, scheme=scheme, timeout=timeout)
+
+
+def get_geolocator():
+    # One geocoder (and so one HTTP session) per configuration
+    return _geolocator(
+        settings.NOMINATIM_DOMAIN,
+        settings.NOMINATIM_SCHEME,
+        settings.NOMINATIM_USER_AGENT,
+        settings.NOMINATIM_TIMEOUT,
+    )
+
+
+def coordinate_key(latitude, longitude):
+    """Round coordinates to GEOCODE_PRECISION decimals (4 is about 11 m)."""
+    precision = settings.GEOCODE_PRECISION
+    return f'{round(float(latitude), precision):.{precision}f},{round(float(longitude), precision):.{precision}f}'
+
+
+def reverse_geocode(latitude, longitude, wait=None):
+    """
+    Address for a coordinate, from memory, then the database, and only then
+    from Nominatim. Returns None when the coordinate is invalid, the lookup
+    fails, or no request slot frees up within ``wait`` seconds.
+    """
+    try:
+        key = coordinate_key(latitude, longitude)
+    except (TypeError, ValueError):
+        return None
+
+    address = memory.get(key)
+    if address is not None:
+        return address
+
+    address = ReverseGeocode.objects.filter(key=key).values_list('address', flat=True).first()
+    if address is not None:
+        memory.set(key, address)
+        return address
+
+    if not rate_limiter.acquire(timeout=settings.NOMINATIM_RATE_WAIT if wait is None else wait):
+        logger.warning(f"Reverse geocoding of {key} skipped: Nominatim rate limit reached")
+        return None
+
+    try:
+        with metrics.span('nominatim'):
+            location = get_geolocator().reverse(key, language='en')
+    except Exception as e:
+        logger.error(f"Reverse geocoding of {key} failed: {str(e)}")
+        return None
+    if not location:
+        return None
+
+    address = location.address[:512]
+    ReverseGeocode.objects.update_or_create(key=key, defaults={'address': address})
+    memory.set(key, address)
+    return address
@@ -0,0 +1,102 @@
+import json
+import re
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from user import directory
+from user.doctor import doctors_in_bounding_box
+from user.models import Doctor, Patient
+from user.pagination import DOCTOR_FIELDS
+from user.seed import seed_doctors, DEFAULT_CENTER, LOCATION_NAMES
+
+SQLITE_SCAN = re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)')
+
+
+def hot_queries(after):
+    """``(name, queryset)`` for each query on a request path, as the views build them."""
+    latitude, longitude = DEFAULT_CENTER
+    return [
+        ('get-doctors first page', directory.facet_queryset()[:settings.DOCTOR_PAGE_SIZE + 1]),
+        ('get-doctors specialization', directory.facet_queryset('cardiology')[:settings.DOCTOR_PAGE_SIZE + 1]),
+        ('get-doctors location', directory.facet_queryset(None, LOCATION_NAMES[0])[:settings.DOCTOR_PAGE_SIZE + 1]),
+        ('get-doctors specialization+location',
+         directory.facet_queryset('cardiology', LOCATION_NAMES[0])[:settings.DOCTOR_PAGE_SIZE + 1]),
+        ('get-doctors deep page', directory.facet_queryset('cardiology', None, after)[:settings.DOCTOR_PAGE_SIZE + 1]),
+        ('medical_chatbot doctors',
+         Doctor.objects.filter(specialization='cardiology').order_by('pk')
+         .values(*DOCTOR_FIELDS)[:settings.CHATBOT_DOCTOR_LIMIT]),
+        ('nearest doctors bounding box',
+         doctors_in_bounding_box(latitude, longitude, 10).values_list('pk', 'latitude', 'longitude')),
+        ('doctor login', Doctor.objects.filter(phonenumber='+919000000000')),
+        ('patient login', Patient.objects.filter(phonenumber='+919000000000')),
+    ]
+
+
+def postgresql_scans(queryset):
+    """``(plan text, [(table, rows read)])`` of the sequential scans in the executed plan."""
+    plan = json.loads(queryset.explain(format='json', analyze=True))[0]['Plan']
+    scans, nodes = [], [plan]
+    while nodes:
+        node = nodes.pop()
+        nodes.extend(node.get('Plans', []))
+        if node['Node Type'] == 'Seq Scan':
+            # Rows a scan reads include those its filter threw away
+            rows = (node['Actual Rows'] + node.get('Rows Removed by Filter', 0)) * node['Actual Loops']
+            scans.append((node['Relation Name'], rows))
+    return queryset.explain(analyze=True), scans
+
+
+def sqlite_scans(queryset):
+    """
+    SQLite has no EXPLAIN ANALYZE: a full-table ``SCAN`` in the query plan
+    counts as reading every row, unless a bare LIMIT stops it early.
+    """
+    text = queryset.explain()
+    sql = str(queryset.query)
+    scans = []
+    for table in SQLITE_SCAN.findall(text):
+        rows = connection.cursor().execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        if ' WHERE ' not in sql and queryset.query.high_mark is not None:
+            rows = min(rows, queryset.query.high_mark)
+        scans.append((table, rows))
+    return text, scans
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot doctor/patient queries on a seeded database; fail on large sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=20000)
+        parser.add_argument('--max-seq-rows', type=int, default=1000,
+                            help='Largest sequential scan tolerated in a hot query')
+        parser.add_argument('--verbose-plans', action='store_true')
+
+    def handle(self, *args, **options):
+        explain = {'postgresql': postgresql_scans, 'sqlite': sqlite_scans}.get(connection.vendor)
+        if explain is None:
+            raise CommandError(f"Query plan audit does not support {connection.vendor}")
+
+        failures = []
+        # Everything is seeded inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            seed_doctors(options['doctors'])
+            with connection.cursor() as cursor:
+                # Fresh statistics, or the planner costs the new rows as an empty table
+                cursor.execute(f'ANALYZE {Doctor._meta.db_table}' if connection.vendor == 'postgresql' else 'ANALYZE')
+            after = Doctor.objects.order_by('pk').values_list('pk', flat=True)[options['doctors'] * 9 // 10]
+
+            for name, queryset in hot_queries(after):
+                text, scans = explain(queryset)
+                worst = max((rows for _, rows in scans), default=0)
+                ok = worst <= options['max_seq_rows']
+                scanned = ', '.join(f'{table} ({rows} rows)' for table, rows in scans) or 'none'
+                self.stdout.write(f"{'ok' if ok else 'FAIL':>4} {name}: sequential scans: {scanned}")
+                if options['verbose_plans'] or not ok:
+                    self.stdout.write('     ' + text.replace('\n', '\n     '))
+                if not ok:
+                    failures.append(name)
+            transaction.set_rollback(True)
+        directory.invalidate()
+
+        if failures:
+            raise CommandError(f"Sequential scans over {options['max_seq_rows']} rows in: {', '.join(failures)}")
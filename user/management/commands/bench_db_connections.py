@@ -0,0 +1,86 @@
+import threading
+from django.core.management.base import BaseCommand
+from django.core.signals import request_started, request_finished
+from django.db import connections
+from ror_django_backend import db
+from ror_django_backend.bench import summarize, Timer
+from user.models import Doctor
+
+MODES = ('per-request', 'persistent', 'pool')
+
+
+def configure(settings_dict, mode, conn_max_age, pool_size):
+    """Point the shared ``default`` settings at ``mode``; every thread's wrapper reads them."""
+    options = settings_dict.setdefault('OPTIONS', {})
+    options.pop('pool', None)
+    settings_dict['CONN_MAX_AGE'] = {'per-request': 0, 'persistent': conn_max_age, 'pool': 0}[mode]
+    settings_dict['CONN_HEALTH_CHECKS'] = True
+    if mode == 'pool':
+        options['pool'] = {'min_size': pool_size, 'max_size': pool_size}
+
+
+class Command(BaseCommand):
+    help = 'Connection setup cost per request: a new connection per request vs persistent connections vs a psycopg pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Request threads, as in a gunicorn gthread worker')
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--conn-max-age', type=int, default=600)
+
+    def handle(self, *args, **options):
+        settings_dict = connections.settings['default']
+        original = {key: settings_dict.get(key) for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        original_options = dict(settings_dict.get('OPTIONS', {}))
+        connections.close_all()
+        per_thread = options['requests'] // options['threads']
+
+        def serve(samples):
+            # What the request handler does around each view: request_started and
+            # request_finished close connections that are past CONN_MAX_AGE
+            for i in range(per_thread):
+                with Timer() as timer:
+                    request_started.send(sender=self.__class__)
+                    Doctor.objects.filter(phonenumber=f'+91{i:010d}').exists()
+                    request_finished.send(sender=self.__class__)
+                samples.append(timer.elapsed)
+            connections.close_all()
+
+        results = {}
+        try:
+            for mode in options['modes']:
+                if mode == 'pool' and connections['default'].vendor != 'postgresql':
+                    self.stdout.write(f"{mode:>12}: skipped, pooling needs PostgreSQL with psycopg[pool]")
+                    continue
+                configure(settings_dict, mode, options['conn_max_age'], options['threads'])
+                db.reset()
+                samples = []
+                threads = [threading.Thread(target=serve, args=(samples,)) for _ in range(options['threads'])]
+                with Timer() as total:
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                stats = db.connection_stats()
+                if mode == 'pool':
+                    pool = stats['pool']
+                    connections['default'].close_pool()
+                    opened = f"pool connections={pool.get('connections_num', 0)} ({pool.get('connections_ms', 0)}ms)"
+                else:
+                    opened = f"connections={stats['connections_opened']}"
+                results[mode] = summarize(samples)
+                self.stdout.write(
+                    f"{mode:>12}: {len(samples) / total.elapsed:.0f} req/s mean={results[mode]['mean_ms']}ms "
+                    f"p50={results[mode]['p50_ms']}ms p99={results[mode]['p99_ms']}ms {opened}"
+                )
+        finally:
+            settings_dict.update(original)
+            settings_dict['OPTIONS'] = original_options
+            connections.close_all()
+
+        if 'per-request' in results:
+            for mode in ('persistent', 'pool'):
+                if mode in results:
+                    saved = results['per-request']['mean_ms'] - results[mode]['mean_ms']
+                    self.stdout.write(f"{mode} saves {saved:.3f}ms of connection setup per request")
@@ -0,0 +1,98 @@
+import random
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from ror_django_backend.bench import summarize, Timer
+from user import directory
+from user.doctor import doctor_data
+from user.models import SPECIALIZATION_CHOICES
+from user.seed import seed_doctors, LOCATION_NAMES
+from user.views import get_available_doctors
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def legacy_get_available_doctors(request):
+    # get_available_doctors as it was: hydrate every Doctor, copy fields into dicts
+    specialization = request.query_params.get('specialization', None)
+    location_name = request.query_params.get('location_name', None)
+    data = []
+    for doc in doctor_data(specialization=specialization, location_name=location_name):
+        data.append({
+            'name': doc.name,
+            'specialization': doc.specialization,
+            'experience_years': doc.experience_years,
+            'location_name': doc.location_name,
+            'latitude': doc.latitude,
+            'longitude': doc.longitude,
+            'bio': doc.bio
+        })
+    return Response(data, status=200)
+
+
+class Command(BaseCommand):
+    help = 'Throughput of get-doctors: per-request queryset vs pre-serialized directory snapshots (and 304 revalidation)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=50000)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--unfiltered', type=float, default=0.05,
+                            help='Share of requests listing every doctor')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        queries = []
+        for _ in range(options['requests']):
+            if rng.random() < options['unfiltered']:
+                queries.append({})
+            elif rng.random() < 0.5:
+                queries.append({'specialization': rng.choice(SPECIALIZATION_CHOICES)[0]})
+            else:
+                queries.append({'specialization': rng.choice(SPECIALIZATION_CHOICES)[0],
+                                'location_name': rng.choice(LOCATION_NAMES)})
+
+        # Everything is seeded inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            with Timer() as seeding:
+                seed_doctors(options['doctors'], seed=options['seed'])
+            directory.invalidate()
+            self.stdout.write(f"Seeded {options['doctors']} doctors in {seeding.elapsed:.1f}s")
+
+            factory = APIRequestFactory()
+            etags = {}
+
+            def snapshot(query):
+                response = get_available_doctors(factory.get('/api/users/get-doctors', query))
+                etags[tuple(sorted(query.items()))] = response['ETag']
+                return response
+
+            def revalidate(query):
+                etag = etags[tuple(sorted(query.items()))]
+                return get_available_doctors(factory.get('/api/users/get-doctors', query, HTTP_IF_NONE_MATCH=etag))
+
+            def legacy(query):
+                response = legacy_get_available_doctors(factory.get('/api/users/get-doctors', query))
+                response.render()
+                return response
+
+            # The first snapshot pass builds each facet; the second is served from memory
+            for name, view in (('queryset', legacy), ('cold', snapshot), ('warm', snapshot), ('304', revalidate)):
+                samples, sent = [], 0
+                with Timer() as total:
+                    for query in queries:
+                        with Timer() as timer:
+                            response = view(query)
+                        samples.append(timer.elapsed)
+                        sent += len(response.content)
+                stats = summarize(samples)
+                self.stdout.write(
+                    f"{name:>8}: {len(queries) / total.elapsed:.0f} req/s p50={stats['p50_ms']}ms "
+                    f"p99={stats['p99_ms']}ms bytes/request={sent // len(queries)}"
+                )
+
+            transaction.set_rollback(True)
+        directory.invalidate()
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ror_django_backend.bench import summarize, Timer
+from user import directory
+from user.models import Doctor
+from user.seed import seed_doctors
+
+
+class Command(BaseCommand):
+    help = 'Doctor listing cost as the directory grows: unbounded list vs first and deep keyset pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 20000, 50000])
+        parser.add_argument('--limit', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        # Everything is seeded inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            seeded = 0
+            for batch, size in enumerate(sorted(options['sizes'])):
+                # Each batch numbers its phones from zero, so give it its own prefix
+                seed_doctors(size - seeded, seed=seeded, phone_prefix=f'+91{batch}')
+                seeded = size
+                deep = Doctor.objects.order_by('pk').values_list('pk', flat=True)[size * 9 // 10]
+
+                variants = (
+                    ('unbounded', {}),
+                    ('first page', {'limit': limit}),
+                    ('deep page', {'limit': limit, 'after': deep}),
+                    ('id,name page', {'limit': limit, 'after': deep, 'fields': ('id', 'name')}),
+                )
+                for name, kwargs in variants:
+                    samples = []
+                    for _ in range(options['repeat'] if kwargs else 1):
+                        # build_snapshot skips the snapshot cache, so this is the database cost
+                        with Timer() as timer:
+                            _, body, _ = directory.build_snapshot(**kwargs)
+                        samples.append(timer.elapsed)
+                    stats = summarize(samples)
+                    self.stdout.write(f"n={size:>6} {name:>12}: p50={stats['p50_ms']}ms bytes={len(body)}")
+            transaction.set_rollback(True)
+        directory.invalidate()
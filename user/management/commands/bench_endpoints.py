@@ -0,0 +1,141 @@
+import sys
+import json
+import platform
+import subprocess
+import django
+from contextlib import redirect_stdout
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from ror_django_backend import scenarios
+from ror_django_backend.stubs import parse_latency
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def change(old, new):
+    return round((new - old) / old * 100, 1) if old else None
+
+
+class Command(BaseCommand):
+    help = ('Throughput, p50/p95/p99 latency and database queries of every endpoint against local stub '
+            'upstreams, as JSON; compare with --baseline to catch regressions between commits')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=[scenario.name for scenario in scenarios.SCENARIOS],
+                            help='Scenario to run; repeat for several (default: all)')
+        parser.add_argument('--list', action='store_true', help='List the scenarios and exit')
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests before each scenario')
+        parser.add_argument('--concurrency', type=int, default=1, help='Client threads')
+        parser.add_argument('--doctors', type=int, default=2000)
+        parser.add_argument('--patients', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--latency', default='20',
+                            help='Upstream latency in ms, or a distribution such as lognormal:200:0.5')
+        parser.add_argument('--upstream-latency', action='append', default=[], metavar='NAME=SPEC',
+                            help=f"Latency of one upstream ({', '.join(scenarios.Upstreams.names)})")
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of upstream calls failed with a 503')
+        parser.add_argument('--allow-errors', action='store_true',
+                            help='Do not fail when a scenario gets non-2xx responses (implied by --error-rate)')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+        parser.add_argument('--max-regression', type=float, default=None,
+                            help='Fail if any p95 grows by more than this many percent over the baseline')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for scenario in scenarios.SCENARIOS:
+                self.stdout.write(f'{scenario.name:>24}  {scenario.method.upper():<5} {scenario.url_name}')
+            return
+        uncovered = scenarios.uncovered_routes()
+        if uncovered:
+            self.stderr.write(f"Routes without a scenario: {', '.join(uncovered)}")
+
+        try:
+            latency = parse_latency(options['latency'])
+            latencies = {}
+            for item in options['upstream_latency']:
+                name, _, spec = item.partition('=')
+                if name not in scenarios.Upstreams.names:
+                    raise ValueError(f'Unknown upstream: {name}')
+                latencies[name] = parse_latency(spec)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        selected = [scenario for scenario in scenarios.SCENARIOS
+                    if not options['scenario'] or scenario.name in options['scenario']]
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'started_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'options': {name: options[name] for name in (
+                    'requests', 'warmup', 'concurrency', 'doctors', 'patients', 'seed',
+                    'latency', 'upstream_latency', 'error_rate')},
+            },
+            'scenarios': {},
+        }
+        # The stubs outlive the data, so background work it queued (geocoding)
+        # never reaches a real upstream; views that print go to stderr so
+        # stdout stays valid JSON
+        with scenarios.Upstreams(latency, latencies, options['error_rate'], options['seed']) as upstreams, \
+                scenarios.BenchData(options['doctors'], options['patients'], options['seed']) as data, \
+                scenarios.EventLoop() as loop, \
+                scenarios.counting_queries() as queries, \
+                redirect_stdout(sys.stderr):
+            for scenario in selected:
+                result = scenarios.run(scenario, data, upstreams, queries, loop, options['requests'],
+                                       options['concurrency'], options['warmup'])
+                report['scenarios'][scenario.name] = result
+                self.stderr.write(
+                    f"{scenario.name:>24}: {result['throughput_rps']:>8} req/s p50={result['p50_ms']}ms "
+                    f"p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+                    f"queries={result['db_queries_per_request']} errors={result['errors']}"
+                    + (f" FAILED status={result['status']}" if result['non_2xx'] else '')
+                )
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['max_regression'])
+
+        # Timings of failed requests say nothing about the endpoint
+        failed = [name for name, result in report['scenarios'].items() if result['non_2xx']]
+        if failed and not (options['allow_errors'] or options['error_rate']):
+            raise CommandError(f"Non-2xx responses in: {', '.join(failed)}")
+
+    def compare(self, report, path, max_regression):
+        with open(path) as f:
+            baseline = json.load(f)
+        self.stderr.write(f"Compared with {baseline['meta'].get('commit') or path}:")
+        regressions = []
+        for name, result in report['scenarios'].items():
+            old = baseline['scenarios'].get(name)
+            if old is None:
+                continue
+            p95 = change(old['p95_ms'], result['p95_ms'])
+            self.stderr.write(
+                f"{name:>24}: p50 {change(old['p50_ms'], result['p50_ms'])}% "
+                f"p95 {p95}% p99 {change(old['p99_ms'], result['p99_ms'])}% "
+                f"throughput {change(old['throughput_rps'], result['throughput_rps'])}% "
+                f"queries {old['db_queries_per_request']} -> {result['db_queries_per_request']}"
+            )
+            if max_regression is not None and p95 is not None and p95 > max_regression:
+                regressions.append(f'{name} p95 +{p95}%')
+        if regressions:
+            raise CommandError(f"Regressions over {max_regression}%: {', '.join(regressions)}")
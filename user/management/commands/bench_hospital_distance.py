@@ -0,0 +1,48 @@
+import random
+from geopy.distance import geodesic
+from django.core.management.base import BaseCommand
+from ror_django_backend.bench import Timer
+from user.seed import random_point, DEFAULT_CENTER
+from user.utils import find_hospital_distance
+
+
+def geodesic_loop(hospitals, user_lat, user_long):
+    # find_hospital_distance as it was: one geodesic() per hospital, unsorted
+    for hospital in hospitals:
+        distance = geodesic((hospital['lat'], hospital['lon']), (user_lat, user_long)).kilometers
+        hospital['distance'] = round(distance, 2)
+    return hospitals
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark hospital distance computation: geodesic loop vs vectorized haversine/ellipsoidal top-k'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        user_lat, user_long = DEFAULT_CENTER
+        for size in options['sizes']:
+            hospitals = []
+            for i in range(size):
+                lat, lon = random_point(rng, DEFAULT_CENTER, 20)
+                hospitals.append({'name': f'Hospital {i}', 'speciality': 'Unknown', 'lat': lat, 'lon': lon})
+
+            variants = [
+                ('geodesic loop', lambda: geodesic_loop(hospitals, user_lat, user_long)),
+                ('haversine all', lambda: find_hospital_distance(hospitals, user_lat, user_long, method='haversine')),
+                ('haversine top-k', lambda: find_hospital_distance(hospitals, user_lat, user_long, k=options['k'], method='haversine')),
+                ('ellipsoidal top-k', lambda: find_hospital_distance(hospitals, user_lat, user_long, k=options['k'], method='ellipsoidal')),
+            ]
+            for name, run in variants:
+                # The geodesic loop is slow enough at 100k that one pass will do
+                repeat = 1 if name == 'geodesic loop' and size >= 10000 else options['repeat']
+                best = None
+                for _ in range(repeat):
+                    with Timer() as timer:
+                        run()
+                    best = timer.elapsed if best is None else min(best, timer.elapsed)
+                self.stdout.write(f'n={size:>6} {name:>17}: {best * 1000:.3f}ms')
@@ -0,0 +1,51 @@
+import random
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from ror_django_backend.bench import summarize, Timer
+from ror_django_backend.stubs import StubServer, FakeOverpassHandler
+from user.seed import random_point, DEFAULT_CENTER
+from user.utils import get_nearby_medical_centers
+from user.overpass import wait_for_refreshes
+
+
+class Command(BaseCommand):
+    help = 'Count upstream Overpass calls per 1000 hospital lookups with and without the geo-tile cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--neighbourhoods', type=int, default=20)
+        parser.add_argument('--spread-km', type=float, default=3,
+                            help='How far patients are scattered around each neighbourhood centre')
+        parser.add_argument('--specialized', type=float, default=0.5,
+                            help='Share of lookups filtered by a specialization')
+        parser.add_argument('--latency-ms', type=float, default=50)
+        parser.add_argument('--ttl', type=int, default=86400,
+                            help='Tile freshness in seconds; 0 serves every tile stale and refreshes it in the background')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        centres = [random_point(rng, DEFAULT_CENTER, 30) for _ in range(options['neighbourhoods'])]
+        lookups = []
+        for _ in range(options['requests']):
+            latitude, longitude = random_point(rng, rng.choice(centres), options['spread_km'])
+            specialization = rng.choice(['cardiology', 'pediatrics', 'orthopedics']) if rng.random() < options['specialized'] else None
+            lookups.append((latitude, longitude, specialization))
+
+        with StubServer(FakeOverpassHandler, latency=options['latency_ms'] / 1000) as stub:
+            for name, tiles in (('uncached', False), ('geo tiles', True)):
+                cache.clear()
+                stub.reset_counters()
+                samples = []
+                with override_settings(OVERPASS_URL=stub.url, HOSPITAL_TILE_CACHE=tiles, HOSPITAL_TILE_TTL=options['ttl']):
+                    for latitude, longitude, specialization in lookups:
+                        with Timer() as timer:
+                            get_nearby_medical_centers(latitude, longitude, specialization=specialization)
+                        samples.append(timer.elapsed)
+                    wait_for_refreshes()
+                stats = summarize(samples)
+                self.stdout.write(
+                    f'{name:>9}: upstream calls/1000={stub.requests * 1000 / len(lookups):.1f} '
+                    f"p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms"
+                )
@@ -0,0 +1,79 @@
+import random
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ror_django_backend.bench import summarize, Timer
+from user.models import Doctor
+from user.geo import DoctorSpatialIndex, haversine
+from user.doctor import doctors_in_bounding_box
+from user.seed import seed_doctors, random_point, DEFAULT_CENTER
+
+
+class Command(BaseCommand):
+    help = 'Compare nearest-doctor lookups (full scan, SQL prefilter, in-process index) on synthetic doctors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=100000)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--radius-km', type=float, default=10)
+        parser.add_argument('--spread-km', type=float, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--skip-scan', action='store_true', help='Skip the (slow) full table scan baseline')
+
+    def handle(self, *args, **options):
+        # Everything is seeded inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            with Timer() as seeding:
+                seed_doctors(options['doctors'], seed=options['seed'], spread_km=options['spread_km'])
+            self.stdout.write(f"Seeded {options['doctors']} doctors in {seeding.elapsed:.1f}s")
+
+            rng = random.Random(options['seed'] + 1)
+            points = [random_point(rng, DEFAULT_CENTER, options['spread_km']) for _ in range(options['requests'])]
+            radius = options['radius_km']
+
+            strategies = [('bbox', self.bounding_box), ('index', self.spatial_index)]
+            if not options['skip_scan']:
+                strategies.insert(0, ('scan', self.full_scan))
+
+            index = DoctorSpatialIndex()
+            with Timer() as building:
+                index.load(Doctor.objects.values_list('pk', 'latitude', 'longitude').iterator())
+            self.stdout.write(f'Built spatial index over {len(index)} doctors in {building.elapsed * 1000:.0f}ms')
+            self.index = index
+
+            for name, strategy in strategies:
+                samples, rows, found = [], 0, 0
+                for latitude, longitude in points:
+                    with Timer() as timer:
+                        fetched, nearby = strategy(latitude, longitude, radius)
+                    samples.append(timer.elapsed)
+                    rows += fetched
+                    found += nearby
+                stats = summarize(samples)
+                self.stdout.write(
+                    f"{name:>6}: p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms "
+                    f"rows/request={rows / len(points):.1f} matches/request={found / len(points):.1f}"
+                )
+
+            transaction.set_rollback(True)
+
+    def full_scan(self, latitude, longitude, radius):
+        rows, nearby = 0, 0
+        for doctor in Doctor.objects.all():
+            rows += 1
+            if doctor.latitude is not None and doctor.longitude is not None:
+                if haversine(latitude, longitude, doctor.latitude, doctor.longitude) <= radius:
+                    nearby += 1
+        return rows, nearby
+
+    def bounding_box(self, latitude, longitude, radius):
+        rows, nearby = 0, 0
+        for doctor in doctors_in_bounding_box(latitude, longitude, radius):
+            rows += 1
+            if haversine(latitude, longitude, doctor.latitude, doctor.longitude) <= radius:
+                nearby += 1
+        return rows, nearby
+
+    def spatial_index(self, latitude, longitude, radius):
+        distances = dict(self.index.query_radius(latitude, longitude, radius))
+        doctors = list(Doctor.objects.filter(pk__in=list(distances)))
+        return len(doctors), len(doctors)
@@ -0,0 +1,91 @@
+import random
+import threading
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from ror_django_backend.bench import summarize, Timer
+from user import profile_cache, utils
+from user.models import Patient
+
+PHONE_PREFIX = '+91888'
+
+
+class Command(BaseCommand):
+    help = 'Profile reads with and without the profile cache: latency, hit ratio and database queries avoided'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--write-ratio', type=float, default=0.01,
+                            help='Share of requests that update the profile')
+        parser.add_argument('--threads', type=int, default=16,
+                            help='Concurrent readers of one cold profile, for the stampede check')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # Saves must commit for the write-through to run, so the users are
+        # created for real and deleted afterwards
+        Patient.objects.filter(phonenumber__startswith=PHONE_PREFIX).delete()
+        Patient.objects.bulk_create(
+            Patient(name=f'Bench {i}', phonenumber=f'{PHONE_PREFIX}{i:07d}', role='patient',
+                    latitude=12.97, longitude=77.59)
+            for i in range(options['users'])
+        )
+        try:
+            # A few users account for most requests, as in real sessions
+            weights = [1 / (rank + 1) for rank in range(options['users'])]
+            phones = rng.choices([f'{PHONE_PREFIX}{i:07d}' for i in range(options['users'])],
+                                 weights=weights, k=options['requests'])
+            writes = {i for i in range(options['requests']) if rng.random() < options['write_ratio']}
+
+            def uncached(phone):
+                return utils.profile_to_dict(utils.get_user_profile(phone, 'patient'), 'patient')
+
+            def cached(phone):
+                return profile_cache.get_profile('patient', phonenumber=phone)
+
+            for name, read in (('database', uncached), ('cached', cached)):
+                cache.clear()
+                profile_cache.clear()
+                profile_cache.reset_stats()
+                samples = []
+                for i, phone in enumerate(phones):
+                    if i in writes:
+                        user = Patient.objects.get(phonenumber=phone)
+                        user.bio = f'update {i}'
+                        user.save()
+                    with Timer() as timer:
+                        profile = read(phone)
+                    samples.append(timer.elapsed)
+                    if i in writes:
+                        assert profile['bio'] == f'update {i}', 'read after write returned a stale profile'
+                stats = summarize(samples)
+                line = f"{name:>9}: p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms"
+                if name == 'cached':
+                    counts = profile_cache.stats()
+                    line += (f" hit_ratio={counts['hit_ratio']} (l1={counts['l1_hits']} shared={counts['hits']}) "
+                             f"queries={counts['misses']} avoided={len(phones) - counts['misses']}")
+                else:
+                    line += f" queries={len(phones)}"
+                self.stdout.write(line)
+
+            # Stampede: many threads miss on the same cold profile at once
+            cache.clear()
+            profile_cache.clear()
+            profile_cache.reset_stats()
+            barrier = threading.Barrier(options['threads'])
+
+            def reader():
+                barrier.wait()
+                cached(f'{PHONE_PREFIX}{0:07d}')
+
+            threads = [threading.Thread(target=reader) for _ in range(options['threads'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.stdout.write(f"stampede: {options['threads']} concurrent misses, "
+                              f"{profile_cache.stats()['misses']} database load(s)")
+        finally:
+            Patient.objects.filter(phonenumber__startswith=PHONE_PREFIX).delete()
+            profile_cache.clear()
@@ -0,0 +1,93 @@
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+from ror_django_backend.bench import summarize, Timer, QueryCounter
+from user import authentication
+from user.models import Patient
+from user.views import view_profile
+
+PHONE_NUMBER = '910000000001'
+
+
+class Command(BaseCommand):
+    help = 'Per-request auth overhead: decode + phone lookup vs token claims, with and without the decoded-token LRU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--tokens', type=int, default=50,
+                            help='Distinct callers (tokens) cycling through the requests')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        auth = authentication.JWTAuthentication()
+
+        # Everything is seeded inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            patients = [
+                Patient.objects.create(name='Bench', phonenumber=f'{PHONE_NUMBER}{i}', role='patient',
+                                       latitude=12.97, longitude=77.59)
+                for i in range(options['tokens'])
+            ]
+            tokens = [authentication.generate_token(patient) for patient in patients]
+            requests = [
+                factory.get('/api/users/view-profile/', HTTP_AUTHORIZATION=f'Bearer {tokens[i % len(tokens)]}')
+                for i in range(options['requests'])
+            ]
+
+            def lookup(request):
+                # What a protected call had to do with the old tokens
+                token = request.META['HTTP_AUTHORIZATION'].split()[1]
+                claims = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+                return Patient.objects.get(phonenumber=claims['id'])
+
+            def claims(request):
+                return auth.authenticate(request)
+
+            modes = (
+                ('decode + lookup', lookup, None),
+                ('claims, no cache', claims, 0),
+                ('claims, cached', claims, settings.AUTH_TOKEN_CACHE_SIZE),
+            )
+            for name, authenticate, cache_size in modes:
+                authentication.clear_cache()
+                with override_settings(AUTH_TOKEN_CACHE_SIZE=cache_size or 0):
+                    samples = []
+                    queries = QueryCounter()
+                    with connection.execute_wrapper(queries):
+                        for request in requests:
+                            with Timer() as timer:
+                                authenticate(request)
+                            samples.append(timer.elapsed)
+                stats = summarize(samples)
+                self.stdout.write(
+                    f"{name:>17}: mean={stats['mean_ms'] * 1000:.1f}us p99={stats['p99_ms'] * 1000:.1f}us "
+                    f"queries/request={queries.count / len(requests):.2f}"
+                )
+
+            # The whole view: the old query parameters vs the bearer token
+            authentication.clear_cache()
+            views = (
+                ('view-profile ?id=', lambda i: factory.get(
+                    '/api/users/view-profile/', {'id': patients[i % len(patients)].phonenumber, 'role': 'patient'})),
+                ('view-profile token', lambda i: factory.get(
+                    '/api/users/view-profile/', HTTP_AUTHORIZATION=f'Bearer {tokens[i % len(tokens)]}')),
+            )
+            for name, make_request in views:
+                samples = []
+                queries = QueryCounter()
+                with connection.execute_wrapper(queries):
+                    for i in range(options['requests']):
+                        request = make_request(i)
+                        with Timer() as timer:
+                            response = view_profile(request)
+                        samples.append(timer.elapsed)
+                        assert response.status_code == 200, response.content
+                stats = summarize(samples)
+                self.stdout.write(
+                    f"{name:>17}: p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms "
+                    f"queries/request={queries.count / options['requests']:.2f}"
+                )
+            transaction.set_rollback(True)
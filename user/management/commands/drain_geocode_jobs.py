@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from user.models import GeocodeJob
+from user.geocode_queue import process_batch
+
+
+class Command(BaseCommand):
+    help = 'Resolve every due reverse-geocode job now and back-fill the addresses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--wait', type=float, default=60,
+                            help='Seconds each lookup may wait for a Nominatim request slot')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Put jobs that exhausted their attempts back in the queue first')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            retried = GeocodeJob.objects.filter(status='failed').update(status='pending', attempts=0)
+            self.stdout.write(f'Re-queued {retried} failed jobs')
+
+        batches = handled = 0
+        # Off the request path, each lookup can wait far longer for a request
+        # slot than the web workers' NOMINATIM_RATE_WAIT; --wait still bounds
+        # it, and a job whose lookup gets no slot is retried later
+        while options['max_batches'] is None or batches < options['max_batches']:
+            count = process_batch(limit=options['batch_size'], wait=options['wait'])
+            if not count:
+                break
+            batches += 1
+            handled += count
+
+        remaining = GeocodeJob.objects.filter(status__in=['pending', 'running']).count()
+        failed = GeocodeJob.objects.filter(status='failed').count()
+        self.stdout.write(f'Processed {handled} jobs in {batches} batches; {remaining} pending, {failed} failed')
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+from user.geo import geohash_encode
+
+
+def populate_geohash(apps, schema_editor):
+    Doctor = apps.get_model('user', 'Doctor')
+    doctors = Doctor.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for doctor in doctors.iterator():
+        doctor.geohash = geohash_encode(doctor.latitude, doctor.longitude)
+        doctor.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0008_alter_doctor_specialization'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, max_length=12, null=True),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
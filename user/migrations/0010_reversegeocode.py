@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_doctor_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReverseGeocode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, unique=True)),
+                ('address', models.CharField(max_length=512)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
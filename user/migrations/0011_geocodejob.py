@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0010_reversegeocode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('doctor', 'Doctor'), ('patient', 'Patient')], max_length=20)),
+                ('user_id', models.BigIntegerField()),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.CharField(blank=True, default='', max_length=256)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='user_geocod_status_b6a929_idx')],
+            },
+        ),
+    ]
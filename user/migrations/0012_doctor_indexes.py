@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0011_geocodejob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['specialization', 'id'], name='doctor_specialization_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['specialization', 'location_name', 'id'], name='doctor_spec_location_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['location_name', 'id'], name='doctor_location_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(condition=models.Q(('latitude__isnull', False), ('longitude__isnull', False)), fields=['latitude', 'longitude'], name='doctor_coordinates_idx'),
+        ),
+    ]
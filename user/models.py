@@ -1,5 +1,7 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.hashers import make_password, check_password
+from .geo import geohash_encode
 
 # Abstract User model for shared fields
 class AbstractUser(models.Model):
@@ -59,9 +61,41 @@ class Doctor(AbstractUser):
     longitude = models.FloatField(blank=True, null=True) 
 
     bio = models.CharField(max_length=256, blank=True,null=True)
+    # Grid cell of (latitude, longitude), used to prefilter radius searches
+    geohash = models.CharField(max_length=12, blank=True, null=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pages of the doctor listing and the chatbot's doctor list,
+            # filtered by specialization and/or location and ordered by id
+            models.Index(fields=['specialization', 'id'], name='doctor_specialization_idx'),
+            models.Index(fields=['specialization', 'location_name', 'id'], name='doctor_spec_location_idx'),
+            models.Index(fields=['location_name', 'id'], name='doctor_location_idx'),
+            # Bounding-box prefilter of radius searches; doctors without
+            # coordinates never match one, so they are left out of the index
+            models.Index(
+                fields=['latitude', 'longitude'],
+                name='doctor_coordinates_idx',
+                condition=models.Q(latitude__isnull=False, longitude__isnull=False),
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
+    def update_geohash(self):
+        try:
+            self.geohash = geohash_encode(float(self.latitude), float(self.longitude))
+        except (TypeError, ValueError):
+            self.geohash = None
+
+    def save(self, *args, **kwargs):
+        self.update_geohash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
 
 class Patient(AbstractUser):
     medical_history = models.TextField(default='')
@@ -78,4 +112,35 @@ class Patient(AbstractUser):
     
     
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+class ReverseGeocode(models.Model):
+    # Rounded "latitude,longitude", see user.geocoding.coordinate_key
+    key = models.CharField(max_length=32, unique=True)
+    address = models.CharField(max_length=512)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.key
+
+
+class GeocodeJob(models.Model):
+    """Pending reverse-geocode of a newly registered user's coordinates."""
+    STATUS_CHOICES = [('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')]
+
+    role = models.CharField(max_length=20, choices=[('doctor', 'Doctor'), ('patient', 'Patient')])
+    user_id = models.BigIntegerField()
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    # When the job is next due; for running jobs, when their claim expires
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=256, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f'{self.role}:{self.user_id} ({self.status})'
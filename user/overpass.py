@@ -0,0 +1,253 @@
+import re
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait
+import httpx
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from ror_django_backend import metrics
+from .geo import bounding_box, geohash_bbox, geohash_cells, geohash_encode, haversine
+
+logger = logging.getLogger(__name__)
+
+session = requests.Session()
+# For the async views: one httpx client per event loop
+_async_sessions = weakref.WeakKeyDictionary()
+
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='overpass-refresh')
+_refreshing = set()
+_refresh_futures = set()
+_refreshing_lock = threading.Lock()
+
+def clean_specialization(specialization):
+    # The value is interpolated into an Overpass regex; keep it to plain words
+    return re.sub(r'[^\w ]', '', specialization or '')
+
+
+def selectors(specialization, area):
+    """Overpass statements for medical centres inside ``area`` (an around/bbox filter)."""
+    if not specialization:
+        return [
+            f'node["amenity"="hospital"]({area});',
+            f'node["amenity"="clinic"]({area});',
+            f'node["healthcare"="hospital"]({area});',
+            f'node["healthcare"="clinic"]({area});',
+        ]
+    return [
+        f'{element}["amenity"="hospital"]["healthcare:speciality"~"{specialization}"]({area});'
+        for element in ('node', 'way', 'relation')
+    ]
+
+
+def build_query(specialization, areas):
+    statements = [statement for area in areas for statement in selectors(specialization, area)]
+    out = 'out center;' if specialization else 'out body;'
+    return '[out:json];\n(\n' + '\n'.join(statements) + '\n);\n' + out
+
+
+def get_async_session():
+    loop = asyncio.get_running_loop()
+    client = _async_sessions.get(loop)
+    if client is None:
+        pool_size = settings.OVERPASS_ASYNC_POOL_SIZE
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=min(pool_size, settings.OVERPASS_ASYNC_KEEPALIVE),
+            ),
+            timeout=settings.OVERPASS_TIMEOUT,
+        )
+        _async_sessions[loop] = client
+    return client
+
+
+def run_query(query):
+    with metrics.span('overpass'):
+        response = session.get(settings.OVERPASS_URL, params={'data': query}, timeout=settings.OVERPASS_TIMEOUT)
+    response.raise_for_status()
+    return parse_elements(response.json())
+
+
+async def arun_query(query):
+    with metrics.span('overpass'):
+        response = await get_async_session().get(settings.OVERPASS_URL, params={'data': query})
+    response.raise_for_status()
+    return parse_elements(response.json())
+
+
+def parse_elements(data):
+    hospitals = []
+    seen = set()
+    for element in data['elements']:
+        if (element['type'], element['id']) in seen:
+            continue
+        seen.add((element['type'], element['id']))
+        if element['type'] == 'node':
+            lat, lon = element['lat'], element['lon']
+        else:  # way or relation
+            lat, lon = element['center']['lat'], element['center']['lon']
+        hospitals.append({
+            'name': element.get('tags', {}).get('name', 'Unnamed Hospital'),
+            'speciality': element.get('tags', {}).get('healthcare:speciality', 'Unknown'),
+            'lat': lat,
+            'lon': lon
+        })
+    return hospitals
+
+
+def fetch_around(latitude, longitude, specialization, radius):
+    """Single uncached radius query, as sent before tiles were introduced."""
+    return run_query(build_query(clean_specialization(specialization), [f'around:{radius},{latitude},{longitude}']))
+
+
+async def afetch_around(latitude, longitude, specialization, radius):
+    return await arun_query(build_query(clean_specialization(specialization), [f'around:{radius},{latitude},{longitude}']))
+
+
+# Geo tiles
+#
+# Hospitals are cached per geohash tile and specialization filter. A radius
+# query is answered from the tiles covering its bounding box and filtered
+# locally; tiles missing from the cache are fetched together in one upstream
+# query, and stale tiles are served immediately while a background refresh
+# replaces them.
+
+def covering_tiles(latitude, longitude, radius_km, precision):
+    return geohash_cells(*bounding_box(latitude, longitude, radius_km), precision)
+
+
+def tile_key(tile, specialization):
+    return f'overpass:tile:{tile}:{specialization}'
+
+
+def tile_query(tiles, specialization):
+    areas = []
+    for tile in tiles:
+        south, west, north, east = geohash_bbox(tile)
+        areas.append(f'{south},{west},{north},{east}')
+    return build_query(specialization, areas)
+
+
+def tile_entries(tiles, specialization, hospitals):
+    """Split the hospitals of one tile query by tile; returns ``(by_tile, cache entries)``."""
+    precision = len(tiles[0])
+    by_tile = {tile: [] for tile in tiles}
+    for hospital in hospitals:
+        tile = geohash_encode(hospital['lat'], hospital['lon'], precision)
+        if tile in by_tile:
+            by_tile[tile].append(hospital)
+
+    now = time.time()
+    entries = {tile_key(tile, specialization): {'fetched_at': now, 'hospitals': found} for tile, found in by_tile.items()}
+    return by_tile, entries
+
+
+def fetch_tiles(tiles, specialization):
+    """Fetch ``tiles`` in one upstream query and cache each one."""
+    by_tile, entries = tile_entries(tiles, specialization, run_query(tile_query(tiles, specialization)))
+    cache.set_many(entries, timeout=settings.HOSPITAL_TILE_TTL + settings.HOSPITAL_TILE_STALE_TTL)
+    return by_tile
+
+
+async def afetch_tiles(tiles, specialization):
+    by_tile, entries = tile_entries(tiles, specialization, await arun_query(tile_query(tiles, specialization)))
+    await cache.aset_many(entries, timeout=settings.HOSPITAL_TILE_TTL + settings.HOSPITAL_TILE_STALE_TTL)
+    return by_tile
+
+
+def _refresh(tiles, specialization):
+    try:
+        fetch_tiles(tiles, specialization)
+    except Exception as e:
+        logger.warning(f"Background refresh of {len(tiles)} Overpass tiles failed: {str(e)}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.difference_update((tile, specialization) for tile in tiles)
+
+
+def schedule_refresh(tiles, specialization):
+    with _refreshing_lock:
+        tiles = [tile for tile in tiles if (tile, specialization) not in _refreshing]
+        _refreshing.update((tile, specialization) for tile in tiles)
+    if tiles:
+        future = _refresh_executor.submit(_refresh, tiles, specialization)
+        with _refreshing_lock:
+            _refresh_futures.add(future)
+        # Outside the lock: a future that is already done runs the callback here
+        future.add_done_callback(_forget_refresh)
+
+
+def _forget_refresh(future):
+    with _refreshing_lock:
+        _refresh_futures.discard(future)
+
+
+def wait_for_refreshes(timeout=None):
+    with _refreshing_lock:
+        futures = list(_refresh_futures)
+    wait(futures, timeout=timeout)
+
+
+def sort_tiles(tiles, specialization, cached):
+    """``(hospitals found, stale tiles, missing tiles)`` given the cached tile entries."""
+    now = time.time()
+    found, stale, missing = [], [], []
+    for tile in tiles:
+        entry = cached.get(tile_key(tile, specialization))
+        if entry is None:
+            missing.append(tile)
+            continue
+        if now - entry['fetched_at'] > settings.HOSPITAL_TILE_TTL:
+            stale.append(tile)
+        found.extend(entry['hospitals'])
+    return found, stale, missing
+
+
+def within_radius(hospitals, latitude, longitude, radius_km):
+    return [
+        dict(hospital) for hospital in hospitals
+        if haversine(latitude, longitude, hospital['lat'], hospital['lon']) <= radius_km
+    ]
+
+
+def nearby_from_tiles(latitude, longitude, specialization, radius):
+    specialization = clean_specialization(specialization)
+    radius_km = radius / 1000
+    tiles = covering_tiles(latitude, longitude, radius_km, settings.HOSPITAL_TILE_PRECISION)
+    cached = cache.get_many([tile_key(tile, specialization) for tile in tiles])
+    found, stale, missing = sort_tiles(tiles, specialization, cached)
+
+    if stale:
+        schedule_refresh(stale, specialization)
+    if missing:
+        try:
+            for hospitals in fetch_tiles(missing, specialization).values():
+                found.extend(hospitals)
+        except Exception as e:
+            logger.error(f"Error fetching Overpass tiles: {str(e)}")
+
+    return within_radius(found, latitude, longitude, radius_km)
+
+
+async def anearby_from_tiles(latitude, longitude, specialization, radius):
+    """``nearby_from_tiles`` for async views; stale tiles still refresh on the background pool."""
+    specialization = clean_specialization(specialization)
+    radius_km = radius / 1000
+    tiles = covering_tiles(latitude, longitude, radius_km, settings.HOSPITAL_TILE_PRECISION)
+    cached = await cache.aget_many([tile_key(tile, specialization) for tile in tiles])
+    found, stale, missing = sort_tiles(tiles, specialization, cached)
+
+    if stale:
+        schedule_refresh(stale, specialization)
+    if missing:
+        try:
+            for hospitals in (await afetch_tiles(missing, specialization)).values():
+                found.extend(hospitals)
+        except Exception as e:
+            logger.error(f"Error fetching Overpass tiles: {str(e)}")
+
+    return within_radius(found, latitude, longitude, radius_km)
@@ -0,0 +1,84 @@
+"""
+Keyset pagination and field projection for the doctor listing APIs.
+
+Pages are cut with a ``cursor`` holding the sort key of the last row sent,
+so fetching page N costs the same as page 1 however deep it is, and rows
+added or removed meanwhile do not shift later pages. Cursors are opaque to
+clients: URL-safe base64 of a JSON array.
+"""
+import json
+import math
+import base64
+import binascii
+from django.conf import settings
+
+# Columns clients may ask for; phone numbers and passwords are never listed
+DOCTOR_FIELDS = ('id', 'name', 'specialization', 'experience_years', 'location_name', 'latitude', 'longitude', 'bio')
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def parse_fields(value, default, allowed=DOCTOR_FIELDS):
+    """Comma-separated ``fields=`` parameter as a tuple, ``default`` when absent."""
+    if not value:
+        return tuple(default)
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise PaginationError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return fields
+
+
+def parse_limit(value):
+    if not value:
+        return settings.DOCTOR_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be positive")
+    return min(limit, settings.DOCTOR_PAGE_MAX)
+
+
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def valid_key(value, kind):
+    # bool is an int to isinstance, and ids must fit a bigint column
+    if isinstance(value, bool):
+        return False
+    if kind is int:
+        return isinstance(value, int) and -2**63 <= value < 2**63
+    if kind is float:
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, kind)
+
+
+def decode_cursor(token, kinds):
+    """
+    The sort-key values packed into ``token``, one per type in ``kinds``
+    (e.g. ``(float, int)`` for a distance and an id), or None without a
+    cursor. Cursors are client input, so anything else is a PaginationError.
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise PaginationError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(kinds):
+        raise PaginationError("Invalid cursor")
+    if not all(valid_key(value, kind) for value, kind in zip(values, kinds)):
+        raise PaginationError("Invalid cursor")
+    return values
+
+
+def next_link(request, cursor):
+    """``Link`` header value pointing at the page after ``cursor``."""
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f'<{request.build_absolute_uri(request.path)}?{params.urlencode()}>; rel="next"'
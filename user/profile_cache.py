@@ -0,0 +1,208 @@
+"""
+Cache of serialized user profiles, the ``profile_to_dict`` output.
+
+A profile is filed under both (role, phone number) and (role, primary key),
+in a short-lived per-process L1 in front of the default Django cache. Saves
+write the new profile through to both tiers once their transaction commits,
+so readers never go back to the database for a change made here. Where the
+default cache is shared (Redis, Memcached), PROFILE_CACHE_L1_TTL bounds how
+long another worker's L1 can lag behind. The default LocMemCache is
+per-process and only the saving worker's copy is written through, so there
+entries are kept no longer than PROFILE_CACHE_L1_TTL in either tier.
+Concurrent misses on one profile are loaded once per process.
+"""
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from .models import Doctor, Patient
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+MODELS = {'doctor': Doctor, 'patient': Patient}
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+_load_locks = [threading.Lock() for _ in range(64)]
+_async_load_locks = weakref.WeakKeyDictionary()
+_stats = {'l1_hits': 0, 'hits': 0, 'misses': 0}
+
+
+def profile_key(role, field, value):
+    return f'profile:{role}:{field}:{value}'
+
+
+def _count(name):
+    with _memory_lock:
+        _stats[name] += 1
+
+
+def _recall(key):
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is None:
+            return None
+        expires_at, profile = entry
+        if expires_at <= time.monotonic():
+            del _memory[key]
+            return None
+        _memory.move_to_end(key)
+        return profile
+
+
+def _remember(keys, profile):
+    expires_at = time.monotonic() + settings.PROFILE_CACHE_L1_TTL
+    with _memory_lock:
+        for key in keys:
+            _memory[key] = (expires_at, profile)
+            _memory.move_to_end(key)
+        while len(_memory) > settings.PROFILE_CACHE_MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def shared_timeout():
+    """How long profiles stay in the default cache; see the module docstring."""
+    if isinstance(caches['default'], LocMemCache):
+        return settings.PROFILE_CACHE_L1_TTL
+    return settings.PROFILE_CACHE_TTL
+
+
+def _keys(role, user):
+    return [profile_key(role, 'phonenumber', user.phonenumber), profile_key(role, 'pk', user.pk)]
+
+
+def store(user):
+    """Write ``user``'s current profile through to both cache tiers."""
+    role = user._meta.model_name
+    profile = utils.profile_to_dict(user, role)
+    keys = _keys(role, user)
+    cache.set_many({key: profile for key in keys}, timeout=shared_timeout())
+    _remember(keys, profile)
+    return profile
+
+
+def forget(role, phonenumber=None, pk=None):
+    keys = []
+    if phonenumber is not None:
+        keys.append(profile_key(role, 'phonenumber', phonenumber))
+    if pk is not None:
+        keys.append(profile_key(role, 'pk', pk))
+    cache.delete_many(keys)
+    with _memory_lock:
+        for key in keys:
+            _memory.pop(key, None)
+
+
+def refresh(role, pk):
+    """Re-read a profile changed behind the ORM's back, e.g. by ``update()``."""
+    user = MODELS[role].objects.filter(pk=pk).first()
+    if user is None:
+        forget(role, pk=pk)
+    else:
+        store(user)
+
+
+def get_profile(role, phonenumber=None, pk=None):
+    """
+    ``profile_to_dict`` of the user with ``phonenumber`` (or ``pk``), or
+    None if there is no such user. The caller gets its own copy.
+    """
+    model = MODELS.get(role)
+    if model is None:
+        return None
+    field, value = ('pk', pk) if pk is not None else ('phonenumber', phonenumber)
+    key = profile_key(role, field, value)
+
+    profile = _recall(key)
+    if profile is not None:
+        _count('l1_hits')
+        return dict(profile)
+
+    with _load_locks[hash(key) % len(_load_locks)]:
+        # Whoever held the lock may just have loaded it
+        profile = _recall(key)
+        if profile is None:
+            profile = cache.get(key)
+            if profile is not None:
+                _count('hits')
+                _remember([key], profile)
+            else:
+                _count('misses')
+                try:
+                    user = model.objects.get(**{field: value})
+                except model.DoesNotExist:
+                    return None
+                profile = store(user)
+        else:
+            _count('l1_hits')
+    return dict(profile)
+
+
+def _async_locks():
+    loop = asyncio.get_running_loop()
+    locks = _async_load_locks.get(loop)
+    if locks is None:
+        locks = _async_load_locks[loop] = [asyncio.Lock() for _ in range(len(_load_locks))]
+    return locks
+
+
+async def aget_profile(role, phonenumber=None, pk=None):
+    """``get_profile`` for async views, using the async cache and ORM APIs."""
+    model = MODELS.get(role)
+    if model is None:
+        return None
+    field, value = ('pk', pk) if pk is not None else ('phonenumber', phonenumber)
+    key = profile_key(role, field, value)
+
+    profile = _recall(key)
+    if profile is not None:
+        _count('l1_hits')
+        return dict(profile)
+
+    # Coroutines on one loop queue up on an asyncio lock per stripe
+    async with _async_locks()[hash(key) % len(_load_locks)]:
+        profile = _recall(key)
+        if profile is not None:
+            _count('l1_hits')
+            return dict(profile)
+        profile = await cache.aget(key)
+        if profile is not None:
+            _count('hits')
+            _remember([key], profile)
+            return dict(profile)
+        _count('misses')
+        try:
+            user = await model.objects.aget(**{field: value})
+        except model.DoesNotExist:
+            return None
+        profile = utils.profile_to_dict(user, role)
+        keys = _keys(role, user)
+        await cache.aset_many({key: profile for key in keys}, timeout=shared_timeout())
+        _remember(keys, profile)
+    return dict(profile)
+
+
+def stats():
+    """Hit counters of this process; every miss is one database query."""
+    with _memory_lock:
+        counts = dict(_stats)
+    lookups = sum(counts.values())
+    counts['hit_ratio'] = round((counts['l1_hits'] + counts['hits']) / lookups, 4) if lookups else None
+    return counts
+
+
+def reset_stats():
+    with _memory_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def clear():
+    with _memory_lock:
+        _memory.clear()
@@ -0,0 +1,75 @@
+import math
+import random
+from django.db import transaction
+from .models import Doctor, Patient, SPECIALIZATION_CHOICES
+from . import directory
+from .doctor import index_changed
+from .geo import EARTH_RADIUS_KM
+
+
+# Bengaluru; synthetic users are scattered around this point
+DEFAULT_CENTER = (12.9716, 77.5946)
+
+LOCATION_NAMES = [
+    'Indiranagar', 'Koramangala', 'Whitefield', 'Jayanagar', 'Malleshwaram',
+    'Hebbal', 'Yelahanka', 'Electronic City', 'Banashankari', 'Marathahalli',
+]
+
+
+def random_point(rng, center=DEFAULT_CENTER, spread_km=200):
+    """Uniformly random point within ``spread_km`` of ``center``."""
+    distance = spread_km * math.sqrt(rng.random())
+    bearing = rng.uniform(0, 2 * math.pi)
+    dlat = math.degrees(distance * math.cos(bearing) / EARTH_RADIUS_KM)
+    dlon = math.degrees(distance * math.sin(bearing) / (EARTH_RADIUS_KM * math.cos(math.radians(center[0]))))
+    return center[0] + dlat, center[1] + dlon
+
+
+def synthetic_doctors(count, seed=0, center=DEFAULT_CENTER, spread_km=200, phone_prefix='+9190'):
+    """Yield unsaved ``Doctor`` rows with reproducible random attributes."""
+    rng = random.Random(seed)
+    for i in range(count):
+        latitude, longitude = random_point(rng, center, spread_km)
+        doctor = Doctor(
+            name=f'Dr. Synthetic {i}',
+            phonenumber=f'{phone_prefix}{i:08d}',
+            role='doctor',
+            specialization=rng.choice(SPECIALIZATION_CHOICES)[0],
+            experience_years=rng.randint(0, 40),
+            location_name=rng.choice(LOCATION_NAMES),
+            latitude=latitude,
+            longitude=longitude,
+            bio='',
+        )
+        # bulk_create skips save(), so fill in the geohash here
+        doctor.update_geohash()
+        yield doctor
+
+
+def seed_doctors(count, seed=0, batch_size=2000, **kwargs):
+    doctors = Doctor.objects.bulk_create(synthetic_doctors(count, seed=seed, **kwargs), batch_size=batch_size)
+    # bulk_create sends no post_save either
+    transaction.on_commit(directory.invalidate)
+    transaction.on_commit(index_changed)
+    return doctors
+
+
+def synthetic_patients(count, seed=0, center=DEFAULT_CENTER, spread_km=50, phone_prefix='+9180'):
+    """Yield unsaved ``Patient`` rows with reproducible random attributes."""
+    rng = random.Random(seed)
+    for i in range(count):
+        latitude, longitude = random_point(rng, center, spread_km)
+        yield Patient(
+            name=f'Synthetic Patient {i}',
+            phonenumber=f'{phone_prefix}{i:08d}',
+            role='patient',
+            age=rng.randint(1, 90),
+            gender=rng.choice(['female', 'male']),
+            location_name=rng.choice(LOCATION_NAMES),
+            latitude=latitude,
+            longitude=longitude,
+        )
+
+
+def seed_patients(count, seed=0, batch_size=2000, **kwargs):
+    return Patient.objects.bulk_create(synthetic_patients(count, seed=seed, **kwargs), batch_size=batch_size)
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Doctor, Patient
+from .geo import doctor_index
+from . import directory
+from . import doctor
+from . import profile_cache
+
+
+@receiver(post_save, sender=Doctor)
+def update_doctor_index(sender, instance, **kwargs):
+    pk, latitude, longitude = instance.pk, instance.latitude, instance.longitude
+
+    def patch():
+        # The index loads lazily on first use; until then there is nothing to patch.
+        if doctor_index.loaded:
+            try:
+                doctor_index.update(pk, float(latitude), float(longitude))
+            except (TypeError, ValueError):
+                doctor_index.remove(pk)
+        if settings.DOCTOR_SPATIAL_INDEX:
+            doctor.index_changed()
+
+    transaction.on_commit(patch)
+
+
+@receiver(post_delete, sender=Doctor)
+def remove_from_doctor_index(sender, instance, **kwargs):
+    pk = instance.pk
+
+    def patch():
+        if doctor_index.loaded:
+            doctor_index.remove(pk)
+        if settings.DOCTOR_SPATIAL_INDEX:
+            doctor.index_changed()
+
+    transaction.on_commit(patch)
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def invalidate_doctor_directory(sender, **kwargs):
+    # After commit, or another request could snapshot the old rows under the new version
+    transaction.on_commit(directory.invalidate)
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=Patient)
+def write_through_profile(sender, instance, **kwargs):
+    transaction.on_commit(lambda: profile_cache.store(instance))
+
+
+@receiver(post_delete, sender=Doctor)
+@receiver(post_delete, sender=Patient)
+def forget_profile(sender, instance, **kwargs):
+    # The primary key is cleared once the delete completes, so read it now
+    role, phonenumber, pk = instance._meta.model_name, instance.phonenumber, instance.pk
+    transaction.on_commit(lambda: profile_cache.forget(role, phonenumber=phonenumber, pk=pk))
@@ -1,3 +1,581 @@
-from django.test import TestCase
+import json
+import math
+import time
+import base64
+from datetime import timedelta
+from unittest import mock
+import jwt
+import numpy as np
+from geopy.distance import geodesic, great_circle
+from django.conf import settings
+from django.core.cache import cache
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from ror_django_backend.stubs import StubServer, FakeNominatimHandler, FakeOverpassHandler
+from . import authentication, directory, distance, geocode_queue, geocoding, overpass, pagination, profile_cache
+from .doctor import INDEX_VERSION_KEY, doctors_in_bounding_box, get_doctor_index, nearby_doctor_distances
+from .geo import EARTH_RADIUS_KM, doctor_index, haversine
+from .authentication import generate_token
+from .models import Doctor, GeocodeJob, Patient, ReverseGeocode
+from .seed import seed_doctors, seed_patients, synthetic_doctors
 
-# Create your tests here.
+
+@override_settings(GEOCODE_WORKER_ENABLED=False)
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_doctors(30, spread_km=5)
+        cls.patient = seed_patients(1, spread_km=1)[0]
+
+    def setUp(self):
+        cache.clear()
+        directory.invalidate()
+
+    def doctor_pages(self, **params):
+        ids, url, params = [], reverse('get_available_doctors'), {'fields': 'id', **params}
+        while True:
+            # The Link URL carries every parameter of the next page
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            ids += [doctor['id'] for doctor in body['doctors']]
+            self.assertEqual('Link' in response, body['next_cursor'] is not None)
+            if not body['next_cursor']:
+                return ids
+            self.assertIn(f"cursor={body['next_cursor']}", response['Link'])
+            url = response['Link'][1:response['Link'].index('>')]
+            params = {}
+
+    def nearest_pages(self, **params):
+        names, cursor = [], None
+        while True:
+            query = {'phonenumber': self.patient.phonenumber, 'role': 'patient', 'fields': 'name', **params}
+            if cursor:
+                query['cursor'] = cursor
+            response = self.client.get(reverse('find_nearest_doctors'), query)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            names += [doctor['name'] for doctor in body['nearby_doctors']]
+            self.assertIn('next_cursor', body)
+            cursor = body['next_cursor']
+            if not cursor:
+                return names
+
+    def test_doctor_pages_cover_every_doctor_once(self):
+        ids = self.doctor_pages(limit=7)
+        self.assertEqual(len(ids), 30)
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_nearest_pages_match_a_single_page(self):
+        names = self.nearest_pages(limit=100)
+        self.assertGreater(len(names), 4)
+        self.assertEqual(self.nearest_pages(limit=4), names)
+
+    def test_malformed_cursors_are_rejected(self):
+        cursors = {
+            'get_available_doctors': [
+                pagination.encode_cursor('abc'), pagination.encode_cursor(1.5), pagination.encode_cursor(True),
+                pagination.encode_cursor(2**70), pagination.encode_cursor(1, 2), 'not base64!',
+            ],
+            'find_nearest_doctors': [
+                pagination.encode_cursor('abc', 1), pagination.encode_cursor(1.0, 'abc'),
+                pagination.encode_cursor([1], 2), pagination.encode_cursor(1.0), '[]',
+            ],
+        }
+        base = {'phonenumber': self.patient.phonenumber, 'role': 'patient'}
+        for name, tokens in cursors.items():
+            for token in tokens:
+                with self.subTest(route=name, cursor=token):
+                    response = self.client.get(reverse(name), {**base, 'cursor': token})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+    def test_valid_cursor_types(self):
+        self.assertEqual(pagination.decode_cursor(pagination.encode_cursor(3), (int,)), [3])
+        # JSON turns 2.0 into 2; either is a valid distance
+        self.assertEqual(pagination.decode_cursor(pagination.encode_cursor(2, 5), (float, int)), [2, 5])
+
+
+def destination(latitude, longitude, bearing, distance_km):
+    """Point ``distance_km`` from the start along the great circle at ``bearing`` degrees."""
+    lat, lon, bearing = math.radians(latitude), math.radians(longitude), math.radians(bearing)
+    d = distance_km / EARTH_RADIUS_KM
+    lat2 = math.asin(math.sin(lat) * math.cos(d) + math.cos(lat) * math.sin(d) * math.cos(bearing))
+    lon2 = lon + math.atan2(math.sin(bearing) * math.sin(d) * math.cos(lat), math.cos(d) - math.sin(lat) * math.sin(lat2))
+    return math.degrees(lat2), (math.degrees(lon2) + 540) % 360 - 180
+
+
+@override_settings(GEOCODE_WORKER_ENABLED=False)
+class NearbyDoctorTests(TestCase):
+    # (latitude, longitude, radius_km): near Bengaluru, far north with a wide
+    # radius, and straddling the antimeridian
+    QUERIES = [(12.97, 77.59, 10), (70.0, 20.0, 1500), (0.5, 179.9, 300), (-60.0, -179.0, 800)]
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_doctors(200, spread_km=20)
+        points = []
+        for latitude, longitude, radius in cls.QUERIES:
+            # Rings just inside and just outside each circle
+            for bearing in range(0, 360, 15):
+                for distance in (radius * 0.99, radius * 1.01):
+                    points.append(destination(latitude, longitude, bearing, distance))
+        doctors = list(synthetic_doctors(len(points), seed=1, phone_prefix='+9191'))
+        for doctor, (latitude, longitude) in zip(doctors, points):
+            doctor.latitude, doctor.longitude = latitude, longitude
+            doctor.update_geohash()
+        Doctor.objects.bulk_create(doctors)
+
+    def setUp(self):
+        cache.clear()
+        doctor_index.loaded = False
+
+    def scan(self, latitude, longitude, radius_km):
+        pairs = [
+            (pk, haversine(latitude, longitude, lat, lon))
+            for pk, lat, lon in Doctor.objects.values_list('pk', 'latitude', 'longitude')
+        ]
+        return sorted((pair for pair in pairs if pair[1] <= radius_km), key=lambda pair: (pair[1], pair[0]))
+
+    def test_bounding_box_holds_every_doctor_in_the_radius(self):
+        for latitude, longitude, radius in self.QUERIES:
+            in_box = set(doctors_in_bounding_box(latitude, longitude, radius).values_list('pk', flat=True))
+            expected = {pk for pk, _ in self.scan(latitude, longitude, radius)}
+            self.assertTrue(expected, (latitude, longitude))
+            self.assertLessEqual(expected, in_box, (latitude, longitude))
+
+    def test_prefilter_and_index_match_a_full_scan(self):
+        for spatial_index in (False, True):
+            with override_settings(DOCTOR_SPATIAL_INDEX=spatial_index):
+                for latitude, longitude, radius in self.QUERIES:
+                    self.assertEqual(
+                        nearby_doctor_distances(latitude, longitude, radius),
+                        self.scan(latitude, longitude, radius),
+                        (spatial_index, latitude, longitude),
+                    )
+
+    @override_settings(DOCTOR_SPATIAL_INDEX=True)
+    def test_index_follows_changes_by_other_processes(self):
+        size = len(get_doctor_index())
+        # Another process adds a doctor and bumps the shared version
+        Doctor.objects.bulk_create(synthetic_doctors(1, seed=2, phone_prefix='+9192'))
+        cache.incr(INDEX_VERSION_KEY)
+        self.assertEqual(len(get_doctor_index()), size + 1)
+
+    @override_settings(DOCTOR_SPATIAL_INDEX=True)
+    def test_own_changes_do_not_reload_the_index(self):
+        loaded_at = get_doctor_index().loaded_at
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor = next(synthetic_doctors(1, seed=3, phone_prefix='+9193'))
+            doctor.save()
+        index = get_doctor_index()
+        self.assertEqual(index.loaded_at, loaded_at)
+        self.assertIn(doctor.pk, dict(index.query_radius(doctor.latitude, doctor.longitude, 1)))
+
+    @override_settings(DOCTOR_SPATIAL_INDEX=True, DOCTOR_SPATIAL_INDEX_MAX_AGE=60)
+    def test_index_is_rebuilt_when_old(self):
+        size = len(get_doctor_index())
+        # A write that sends no signals, with the version in another process's cache
+        Doctor.objects.bulk_create(synthetic_doctors(1, seed=4, phone_prefix='+9194'))
+        self.assertEqual(len(get_doctor_index()), size)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(len(get_doctor_index()), size + 1)
+
+class DistanceTests(SimpleTestCase):
+    origin = (12.9716, 77.5946)
+    points = [
+        (12.9716, 77.5946),   # the origin itself
+        (12.9352, 77.6245),   # across town
+        (13.0827, 80.2707),   # another city
+        (0.0, 10.0),          # along the equator
+        (-33.8688, 151.2093), # another hemisphere
+        (64.1466, -21.9426),  # far north, far west
+    ]
+
+    def arrays(self):
+        return np.array([lat for lat, _ in self.points]), np.array([lon for _, lon in self.points])
+
+    def test_haversine_matches_geopy(self):
+        computed = distance.distances_km(*self.origin, *self.arrays())
+        expected = [great_circle(self.origin, point, radius=EARTH_RADIUS_KM).km for point in self.points]
+        np.testing.assert_allclose(computed, expected, rtol=1e-9, atol=1e-9)
+
+    def test_ellipsoidal_matches_geopy_geodesic(self):
+        computed = distance.distances_km(*self.origin, *self.arrays(), method='ellipsoidal')
+        expected = [geodesic(self.origin, point).km for point in self.points]
+        # Vincenty and Karney's algorithm agree to well under a millimetre
+        np.testing.assert_allclose(computed, expected, rtol=0, atol=1e-6)
+
+    def test_nearly_antipodal_points_fall_back_to_the_great_circle(self):
+        computed = distance.distances_km(0, 0, [0.5], [179.7], method='ellipsoidal')
+        self.assertTrue(np.isfinite(computed).all())
+        self.assertAlmostEqual(computed[0] / geodesic((0, 0), (0.5, 179.7)).km, 1, delta=0.01)
+
+    def test_nearest_matches_a_full_sort(self):
+        rng = np.random.default_rng(7)
+        lats, lons = rng.uniform(12.5, 13.5, 500), rng.uniform(77, 78, 500)
+        full = distance.distances_km(*self.origin, lats, lons)
+        order = np.argsort(full, kind='stable')
+        for k in (0, 1, 5, 499, 500, 600, None):
+            with self.subTest(k=k):
+                indices, distances = distance.nearest(*self.origin, lats, lons, k=k)
+                expected = order if k is None else order[:k]
+                np.testing.assert_array_equal(indices, expected)
+                np.testing.assert_array_equal(distances, full[expected])
+
+
+@override_settings(GEOCODE_WORKER_ENABLED=False)
+class DirectorySnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_doctors(5, spread_km=5)
+
+    def setUp(self):
+        cache.clear()
+        directory.invalidate()
+
+    def rename_first_doctor(self):
+        # update() sends no signal, as a change made by another worker
+        # would not reach this one's directory
+        Doctor.objects.filter(pk=Doctor.objects.order_by('pk').first().pk).update(name='Dr. Renamed')
+
+    def test_bumped_version_is_seen_on_the_next_request(self):
+        directory.get_snapshot()
+        self.rename_first_doctor()
+        cache.incr(directory.VERSION_KEY)
+        self.assertIn(b'Dr. Renamed', directory.get_snapshot()[1])
+
+    def test_l1_entries_expire(self):
+        directory.get_snapshot()
+        self.rename_first_doctor()
+        # The snapshot has expired from the cache, the version never moved
+        version = directory.current_version()
+        cache.clear()
+        cache.set(directory.VERSION_KEY, version, timeout=None)
+        self.assertNotIn(b'Dr. Renamed', directory.get_snapshot()[1])
+        later = time.monotonic() + settings.DOCTOR_DIRECTORY_L1_TTL + 1
+        with mock.patch.object(directory.time, 'monotonic', return_value=later):
+            self.assertIn(b'Dr. Renamed', directory.get_snapshot()[1])
+
+
+class HospitalTileTests(SimpleTestCase):
+    point = (12.9716, 77.5946)
+
+    def setUp(self):
+        cache.clear()
+        self.overpass = StubServer(FakeOverpassHandler)
+        self.overpass.__enter__()
+        self.addCleanup(self.overpass.__exit__, None, None, None)
+        settings_override = override_settings(OVERPASS_URL=self.overpass.url, HOSPITAL_TILE_CACHE=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def names(self, hospitals):
+        return sorted(hospital['name'] for hospital in hospitals)
+
+    def test_missing_tiles_are_fetched_in_one_query(self):
+        hospitals = overpass.nearby_from_tiles(*self.point, None, 5000)
+        self.assertEqual(self.overpass.requests, 1)
+        self.assertTrue(hospitals)
+        # The stub answers around: with a square; the radius itself is a circle
+        around = overpass.within_radius(overpass.fetch_around(*self.point, None, 5000), *self.point, 5)
+        self.assertEqual(self.names(hospitals), self.names(around))
+
+    def test_cached_tiles_answer_without_upstream_calls(self):
+        overpass.nearby_from_tiles(*self.point, None, 5000)
+        self.overpass.reset_counters()
+        overpass.nearby_from_tiles(*self.point, None, 5000)
+        # A nearby point inside the same tiles
+        overpass.nearby_from_tiles(self.point[0] + 0.01, self.point[1] + 0.01, None, 3000)
+        async_to_sync(overpass.anearby_from_tiles)(*self.point, None, 5000)
+        self.assertEqual(self.overpass.requests, 0)
+
+    def test_stale_tiles_are_served_and_refreshed_once(self):
+        fresh = overpass.nearby_from_tiles(*self.point, None, 5000)
+        self.overpass.reset_counters()
+        with override_settings(HOSPITAL_TILE_TTL=-1):
+            self.assertEqual(self.names(overpass.nearby_from_tiles(*self.point, None, 5000)), self.names(fresh))
+            overpass.wait_for_refreshes(timeout=10)
+        self.assertEqual(self.overpass.requests, 1)
+        self.overpass.reset_counters()
+        overpass.nearby_from_tiles(*self.point, None, 5000)
+        self.assertEqual(self.overpass.requests, 0)
+
+    def test_specializations_are_cached_separately(self):
+        overpass.nearby_from_tiles(*self.point, None, 5000)
+        overpass.nearby_from_tiles(*self.point, 'cardiology', 5000)
+        self.assertEqual(self.overpass.requests, 2)
+
+
+@override_settings(GEOCODE_WORKER_ENABLED=False)
+class ProfileWriteThroughTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        profile_cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient = Patient.objects.create(name='Asha', phonenumber='+919800000001', role='patient', age=30)
+        self.auth = {'Authorization': f'Bearer {generate_token(self.patient)}'}
+
+    def view(self, **params):
+        response = self.client.get(reverse('view_profile'), params, headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['profile']
+
+    def update(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('update_profile'), json.dumps(fields),
+                                         content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+
+    def test_saved_profile_is_served_without_queries(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.view()['name'], 'Asha')
+
+    def test_update_is_written_through(self):
+        self.update(bio='Runs on weekends')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.view()['bio'], 'Runs on weekends')
+        # Once the L1 entry is gone, the profile comes from the default cache
+        profile_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.view()['bio'], 'Runs on weekends')
+
+    def test_change_by_another_worker_is_seen_after_the_l1_ttl(self):
+        self.view()
+        # Another worker's save writes through to its own LocMemCache, not this one
+        Patient.objects.filter(pk=self.patient.pk).update(bio='Changed elsewhere')
+        self.assertNotEqual(self.view()['bio'], 'Changed elsewhere')
+        later = settings.PROFILE_CACHE_L1_TTL + 1
+        with mock.patch('time.time', return_value=time.time() + later), \
+                mock.patch('time.monotonic', return_value=time.monotonic() + later):
+            self.assertEqual(self.view()['bio'], 'Changed elsewhere')
+
+    def test_shared_cache_keeps_profiles_for_the_full_ttl(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual(profile_cache.shared_timeout(), settings.PROFILE_CACHE_TTL)
+        self.assertEqual(profile_cache.shared_timeout(), settings.PROFILE_CACHE_L1_TTL)
+
+    def test_new_process_reads_the_database(self):
+        self.update(bio='Runs on weekends')
+        # Nothing in either tier, as in a worker that has just started
+        cache.clear()
+        profile_cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.view()['bio'], 'Runs on weekends')
+
+    def test_old_phone_number_is_forgotten(self):
+        self.update(phonenumber='+919800000002')
+        self.assertIsNone(profile_cache.get_profile('patient', phonenumber='+919800000001'))
+        self.assertEqual(profile_cache.get_profile('patient', phonenumber='+919800000002')['name'], 'Asha')
+
+    def test_deleted_profile_is_forgotten(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.delete()
+        self.assertIsNone(profile_cache.get_profile('patient', phonenumber='+919800000001'))
+
+
+@override_settings(GEOCODE_WORKER_ENABLED=False)
+class TokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        profile_cache.clear()
+        authentication.clear_cache()
+        self.addCleanup(authentication.clear_cache)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient = Patient.objects.create(name='Asha', phonenumber='+919800000001', role='patient',
+                                                  latitude=12.9716, longitude=77.5946)
+        self.overpass = StubServer(FakeOverpassHandler)
+        self.overpass.__enter__()
+        self.addCleanup(self.overpass.__exit__, None, None, None)
+        settings_override = override_settings(OVERPASS_URL=self.overpass.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def valid(self):
+        return generate_token(self.patient)
+
+    def expired(self):
+        with override_settings(AUTH_TOKEN_LIFETIME=-10):
+            return generate_token(self.patient)
+
+    def tampered(self):
+        # Claims another patient's pk but keeps the original signature
+        header, payload, signature = self.valid().split('.')
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        claims['pk'] += 1
+        payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip('=')
+        return '.'.join((header, payload, signature))
+
+    def legacy(self):
+        # As issued before the pk and role claims existed
+        return jwt.encode({'id': self.patient.phonenumber, 'exp': time.time() + 3600},
+                          settings.SECRET_KEY, algorithm=authentication.ALGORITHM)
+
+    def bearer(self, token):
+        return {'Authorization': f'Bearer {token}'}
+
+    def test_valid_token_names_the_caller(self):
+        claims = authentication.decode_token(self.valid())
+        self.assertEqual((claims['pk'], claims['role'], claims['id']), (self.patient.pk, 'patient', '+919800000001'))
+
+    def test_expired_and_tampered_tokens_are_rejected(self):
+        with self.assertRaises(jwt.ExpiredSignatureError):
+            authentication.decode_token(self.expired())
+        with self.assertRaises(jwt.InvalidSignatureError):
+            authentication.decode_token(self.tampered())
+        self.assertEqual(len(authentication._decoded), 0)
+
+    def test_remembered_tokens_still_expire(self):
+        token = self.valid()
+        claims = authentication.decode_token(token)
+        # A remembered token skips the signature check...
+        with mock.patch.object(authentication.jwt, 'decode', side_effect=AssertionError('decoded again')):
+            self.assertEqual(authentication.decode_token(token), claims)
+        # ...but not the expiry, and is forgotten once it has passed
+        with mock.patch.object(authentication.time, 'time', return_value=claims['exp'] + 1):
+            with self.assertRaises(jwt.ExpiredSignatureError):
+                authentication.decode_token(token)
+        self.assertNotIn(token, authentication._decoded)
+
+    def test_view_profile(self):
+        response = self.client.get(reverse('view_profile'), headers=self.bearer(self.valid()))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['profile']['name'], 'Asha')
+        for token in (self.expired(), self.tampered()):
+            self.assertEqual(self.client.get(reverse('view_profile'), headers=self.bearer(token)).status_code, 401)
+
+    def test_legacy_token_falls_back_to_the_query_parameters(self):
+        headers = self.bearer(self.legacy())
+        self.assertEqual(self.client.get(reverse('view_profile'), headers=headers).status_code, 400)
+        response = self.client.get(reverse('view_profile'), {'id': '+919800000001', 'role': 'patient'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_profile(self):
+        def update(token):
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.patch(reverse('update_profile'), json.dumps({'bio': f'bio from {token[-6:]}'}),
+                                         content_type='application/json', headers=self.bearer(token))
+
+        self.assertEqual(update(self.tampered()).status_code, 401)
+        self.assertEqual(update(self.expired()).status_code, 401)
+        token = self.valid()
+        self.assertEqual(update(token).status_code, 200)
+        self.patient.refresh_from_db()
+        self.assertEqual(self.patient.bio, f'bio from {token[-6:]}')
+
+    def test_nearby_hospital(self):
+        response = self.client.get(reverse('nearby_hospital'), headers=self.bearer(self.valid()))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['hospitals'])
+        for token in (self.expired(), self.tampered()):
+            self.assertEqual(self.client.get(reverse('nearby_hospital'), headers=self.bearer(token)).status_code, 401)
+
+    async def test_async_nearby_hospital(self):
+        response = await self.async_client.get(reverse('nearby_hospital_async'), headers=self.bearer(self.valid()))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['hospitals'])
+        for token in (self.expired(), self.tampered()):
+            response = await self.async_client.get(reverse('nearby_hospital_async'), headers=self.bearer(token))
+            self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(reverse('nearby_hospital_async'),
+                                               {'id': '+919800000001', 'user_role': 'patient'},
+                                               headers=self.bearer(self.legacy()))
+        self.assertEqual(response.status_code, 200)
+
+
+class ReverseGeocodeTests(TestCase):
+    point = (12.97161, 77.59459)
+
+    def setUp(self):
+        self.nominatim = StubServer(FakeNominatimHandler)
+        self.nominatim.__enter__()
+        self.addCleanup(self.nominatim.__exit__, None, None, None)
+        host, port = self.nominatim.server_address[:2]
+        settings_override = override_settings(NOMINATIM_DOMAIN=f'{host}:{port}', NOMINATIM_SCHEME='http')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for name, fresh in (('memory', geocoding.AddressLRU(16)), ('rate_limiter', geocoding.TokenBucket(rate=1e6, capacity=1e6))):
+            self.addCleanup(setattr, geocoding, name, getattr(geocoding, name))
+            setattr(geocoding, name, fresh)
+
+    def test_repeat_lookup_is_answered_from_memory(self):
+        address = geocoding.reverse_geocode(*self.point)
+        self.assertTrue(address.startswith('Stub Street'))
+        self.assertEqual(self.nominatim.requests, 1)
+        # Rounded to the same key, so the same address
+        with self.assertNumQueries(0):
+            self.assertEqual(geocoding.reverse_geocode(12.97158, 77.59462), address)
+        self.assertEqual(self.nominatim.requests, 1)
+
+    def test_stored_address_is_used_without_nominatim(self):
+        key = geocoding.coordinate_key(*self.point)
+        ReverseGeocode.objects.create(key=key, address='Stored Street, Bengaluru')
+        with self.assertNumQueries(1):
+            self.assertEqual(geocoding.reverse_geocode(*self.point), 'Stored Street, Bengaluru')
+        self.assertEqual(self.nominatim.requests, 0)
+        self.assertEqual(geocoding.memory.get(key), 'Stored Street, Bengaluru')
+
+    def test_lookups_beyond_the_rate_are_skipped(self):
+        geocoding.rate_limiter = geocoding.TokenBucket(rate=0.01, capacity=1)
+        self.assertIsNotNone(geocoding.reverse_geocode(*self.point, wait=0))
+        self.assertIsNone(geocoding.reverse_geocode(13.0827, 80.2707, wait=0))
+        self.assertEqual(self.nominatim.requests, 1)
+        # Cached addresses need no request slot
+        self.assertIsNotNone(geocoding.reverse_geocode(*self.point, wait=0))
+
+    def test_token_bucket_refills_at_its_rate(self):
+        bucket = geocoding.TokenBucket(rate=20, capacity=2)
+        self.assertEqual([bucket.acquire() for _ in range(3)], [True, True, False])
+        started = time.monotonic()
+        self.assertTrue(bucket.acquire(timeout=1))
+        self.assertGreater(time.monotonic() - started, 0.03)
+        self.assertFalse(bucket.acquire(timeout=0.01))
+
+
+class GeocodeWorkerStartTests(TransactionTestCase):
+    """Jobs left behind by a previous process are picked up without a new registration."""
+
+    def setUp(self):
+        self.patient = seed_patients(1, spread_km=1)[0]
+        self.patient.location_name = None
+        self.patient.save()
+        server = StubServer(FakeNominatimHandler)
+        server.__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+        host, port = server.server_address[:2]
+        settings_override = override_settings(NOMINATIM_DOMAIN=f'{host}:{port}', NOMINATIM_SCHEME='http', GEOCODE_WORKER_ENABLED=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        limiter = geocoding.rate_limiter
+        geocoding.rate_limiter = geocoding.TokenBucket(rate=1e6, capacity=1e6)
+        self.addCleanup(setattr, geocoding, 'rate_limiter', limiter)
+        # A fresh worker that makes one pass and exits, so no thread outlives the test
+        self.worker = geocode_queue.GeocodeWorker()
+        self.worker._run = lambda: geocode_queue.process_batch(wait=0)
+        patcher = mock.patch.object(geocode_queue, 'worker', self.worker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def job(self, **fields):
+        return GeocodeJob.objects.create(
+            role='patient', user_id=self.patient.pk,
+            latitude=self.patient.latitude, longitude=self.patient.longitude, **fields,
+        )
+
+    def test_first_request_resumes_pending_and_expired_jobs(self):
+        pending = self.job()
+        expired = self.job(status='running', next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.client.get(reverse('get_available_doctors'))
+        self.worker._thread.join(timeout=10)
+
+        self.assertEqual({job.status for job in GeocodeJob.objects.filter(pk__in=[pending.pk, expired.pk])}, {'done'})
+        self.patient.refresh_from_db()
+        self.assertTrue(self.patient.location_name.startswith('Stub Street'))
+
+    def test_disabled_worker_is_not_started(self):
+        self.job()
+        with override_settings(GEOCODE_WORKER_ENABLED=False):
+            self.client.get(reverse('get_available_doctors'))
+        self.assertIsNone(self.worker._thread)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('patient/register', views.register_patient, name='register_patient'),
@@ -11,4 +11,5 @@ urlpatterns = [
     path('view-profile/',views.view_profile,name='view_profile'),
     path('doctors/nearest/', views.find_nearest_doctors, name='find_nearest_doctors'),  
     path('nearby-hospital/',views.nearby_hospital, name='nearby_hospital'),
+    path('nearby-hospital/async/', async_views.nearby_hospital, name='nearby_hospital_async'),
 ]
\ No newline at end of file
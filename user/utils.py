@@ -1,27 +1,22 @@
-from geopy.geocoders import Nominatim
+from django.conf import settings
 from .models import Doctor, Patient
+from . import overpass
+from . import distance
+from . import profile_cache
+from .geocoding import reverse_geocode
+import httpx
 import requests
-from geopy.distance import geodesic
 
 
 
 
-def get_location_from_coordinates(latitude, longitude):
-    geolocator = Nominatim(user_agent="geoapiExercises")
-    try:
-        location = geolocator.reverse(f"{latitude}, {longitude}", language='en')
-        return location.address
-    except Exception as e:
-        return None
-
-
-
-def modify_profile(request, phone_number, role):
+def modify_profile(request, phone_number, role, user=None):
     latitude = request.data.get('latitude')
     longitude = request.data.get('longitude')
     location_name = request.data.get('location_name')
     
-    user = get_user_profile(phone_number, role)
+    if user is None:
+        user = get_user_profile(phone_number, role)
     fields_to_update = {
         'doctor': ['name', 'phonenumber', 'specialization', 'experience_years','bio','latitude','longitude','location_name'],
         'patient': ['name', 'phonenumber', 'medical_history', 'age', 'height', 'weight', 'gender', 'bloodgroup', 'location_name','bio','latitude','longitude']
@@ -30,6 +25,7 @@ def modify_profile(request, phone_number, role):
     if role not in fields_to_update:
         return 'Error invalid role'
 
+    old_phonenumber = user.phonenumber
     for field in fields_to_update[role]:
         if field in request.data and request.data.get(field) is not None:
             setattr(user, field, request.data.get(field))
@@ -39,14 +35,12 @@ def modify_profile(request, phone_number, role):
         try:
             if latitude.strip() == '':
                 raise ValueError("Empty string provided for latitude")
-            
-            print(latitude,type(longitude))
 
             user.latitude = latitude
             user.longitude = longitude
 
             if latitude is not None and latitude is not None:
-                address = get_location_from_coordinates(user.latitude, user.longitude)
+                address = reverse_geocode(user.latitude, user.longitude)
                 if address:
                     user.location_name = address      
 
@@ -54,6 +48,9 @@ def modify_profile(request, phone_number, role):
             return 'Error invalid latitude or longitude'
 
     user.save()
+    # The save writes the profile through under its current phone number
+    if user.phonenumber != old_phonenumber:
+        profile_cache.forget(role, phonenumber=old_phonenumber)
 
     return 'Profile updated successfully'
 
@@ -73,6 +70,18 @@ def get_user_profile(phone_number, user_role='patient'):
     except (Doctor.DoesNotExist, Patient.DoesNotExist):
         return None 
 
+
+
+def get_profile_by_pk(pk, user_role):
+    """Profile of an authenticated caller, whose token already names the row."""
+    model = {'doctor': Doctor, 'patient': Patient}.get(user_role)
+    if model is None:
+        return None
+    try:
+        return model.objects.get(pk=pk)
+    except model.DoesNotExist:
+        return None
+
     
 def profile_to_dict(profile, user_role):
     if user_role == 'doctor':
@@ -105,56 +114,45 @@ def profile_to_dict(profile, user_role):
 
 
 def get_nearby_medical_centers(latitude, longitude, specialization, radius=10000):  # radius in meters
-    overpass_url = "http://overpass-api.de/api/interpreter"
-    print("special",specialization)
-    if not specialization:
-        overpass_query = f"""
-    [out:json];
-    (
-      node["amenity"="hospital"](around:{radius},{latitude},{longitude});
-      node["amenity"="clinic"](around:{radius},{latitude},{longitude});
-      node["healthcare"="hospital"](around:{radius},{latitude},{longitude});
-      node["healthcare"="clinic"](around:{radius},{latitude},{longitude});
-    );
-    out body;
-    """
-    else:
+    if specialization:
         radius = 20000
-        overpass_query = f"""
-        [out:json];
-        (
-        node["amenity"="hospital"]["healthcare:speciality"~"{specialization}"](around:{radius},{latitude},{longitude});
-        way["amenity"="hospital"]["healthcare:speciality"~"{specialization}"](around:{radius},{latitude},{longitude});
-        relation["amenity"="hospital"]["healthcare:speciality"~"{specialization}"](around:{radius},{latitude},{longitude});
-        );
-        out center;
-        """
-    response = requests.get(overpass_url, params={'data': overpass_query})
-    if response.status_code == 200:
-        data = response.json()
-        hospitals = []
-        for element in data['elements']:
-            if element['type'] == 'node':
-                lat, lon = element['lat'], element['lon']
-            else:  # way or relation
-                lat, lon = element['center']['lat'], element['center']['lon']
-            hospitals.append({
-                'name': element['tags'].get('name', 'Unnamed Hospital'),
-                'speciality': element['tags'].get('healthcare:speciality', 'Unknown'),
-                'lat': lat,
-                'lon': lon
-            })
-        return hospitals
-    else:
+    if settings.HOSPITAL_TILE_CACHE:
+        return overpass.nearby_from_tiles(latitude, longitude, specialization, radius)
+    try:
+        return overpass.fetch_around(latitude, longitude, specialization, radius)
+    except (requests.RequestException, ValueError, KeyError):
         return []
 
 
 
-def find_hospital_distance(hospitals,user_lat,user_long):
+async def aget_nearby_medical_centers(latitude, longitude, specialization, radius=10000):
+    """``get_nearby_medical_centers`` for async views."""
+    if specialization:
+        radius = 20000
+    if settings.HOSPITAL_TILE_CACHE:
+        return await overpass.anearby_from_tiles(latitude, longitude, specialization, radius)
+    try:
+        return await overpass.afetch_around(latitude, longitude, specialization, radius)
+    except (httpx.HTTPError, ValueError, KeyError):
+        return []
+
 
-    for index,hospital in enumerate(hospitals):
-        hospital_lat = hospital['lat']
-        hospital_lon = hospital['lon']
-        distance = geodesic((hospital_lat, hospital_lon), (user_lat, user_long)).kilometers
-        hospital['distance'] = round(distance, 2)
-    return hospitals
\ No newline at end of file
+def find_hospital_distance(hospitals, user_lat, user_long, k=None, method=None):
+    """
+    Return copies of ``hospitals`` with a ``distance`` in km, nearest first,
+    keeping only the ``k`` nearest when ``k`` is given.
+    """
+    if not hospitals:
+        return []
+    indices, distances = distance.nearest(
+        float(user_lat),
+        float(user_long),
+        [hospital['lat'] for hospital in hospitals],
+        [hospital['lon'] for hospital in hospitals],
+        k=k,
+        method=method or settings.HOSPITAL_DISTANCE_METHOD,
+    )
+    return [
+        {**hospitals[index], 'distance': round(float(km), 2)}
+        for index, km in zip(indices, distances)
+    ]
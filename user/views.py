@@ -1,46 +1,21 @@
-import jwt
-import datetime
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
-from django.http import JsonResponse    
+from django.http import JsonResponse, HttpResponse
+from django.utils.http import parse_etags
 from django.conf import settings
 from .models import Doctor, Patient
 from . import doctor
 from . import utils
-from geopy.geocoders import Nominatim
-import math
-from geopy.distance import geodesic
+from . import geocode_queue
+from . import directory
+from . import pagination
+from . import profile_cache
+from .geocoding import reverse_geocode
+from .authentication import generate_token, token_identity
 
 
-
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371 
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
- 
-
-def get_location_from_coordinates(latitude, longitude):
-    geolocator = Nominatim(user_agent="geoapiExercises")
-    try:
-        location = geolocator.reverse(f"{latitude}, {longitude}", language='en')
-        return location.address
-    except Exception as e:
-        return None
-    
-
-def generate_token(user):
-    payload = {
-        'id': user.phonenumber,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
-    }
-    return jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
-
+NEAREST_DOCTOR_FIELDS = ('name', 'specialization', 'experience_years', 'location_name', 'latitude', 'longitude')
 
 
 @api_view(['POST'])
@@ -94,8 +69,9 @@ def register_patient(request):
 
     location_name = None
 
-    if latitude is not None and latitude is not None:
-        address = get_location_from_coordinates(latitude, longitude)
+    # With GEOCODE_ASYNC the address is back-filled by the geocode worker
+    if not settings.GEOCODE_ASYNC and latitude is not None and latitude is not None:
+        address = reverse_geocode(latitude, longitude)
         if address:
             location_name = address
         
@@ -109,6 +85,8 @@ def register_patient(request):
         role='patient'
     )
     patient.save()
+    if settings.GEOCODE_ASYNC:
+        geocode_queue.enqueue(patient)
 
     token = generate_token(patient)
     return JsonResponse({'phonenumber': patient.phonenumber, 'token': token}, status=201)
@@ -129,8 +107,8 @@ def register_doctor(request):
     
     location_name=None
     
-    if latitude is not None and latitude is not None:
-        address = get_location_from_coordinates(latitude, longitude)
+    if not settings.GEOCODE_ASYNC and latitude is not None and latitude is not None:
+        address = reverse_geocode(latitude, longitude)
         if address:
             location_name = address
         
@@ -143,6 +121,8 @@ def register_doctor(request):
         role='doctor'
     )
     doctor.save()
+    if settings.GEOCODE_ASYNC:
+        geocode_queue.enqueue(doctor)
 
     token = generate_token(doctor)
     return JsonResponse({'phonenumber': doctor.phonenumber, 'token': token}, status=201)
@@ -153,10 +133,18 @@ def register_doctor(request):
 def update_profile(request):
     phone_number = request.query_params.get('id')
     user_role = request.query_params.get('user_role')
-    if not phone_number:
+    user = None
+    identity = token_identity(request)
+    if identity:
+        # The token names the caller, so the query parameters are not needed
+        pk, user_role = identity
+        user = utils.get_profile_by_pk(pk, user_role)
+        if user is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+    elif not phone_number:
         return Response({'error': 'Phone number is required'}, status=400)
     
-    result = utils.modify_profile(request, phone_number, user_role)
+    result = utils.modify_profile(request, phone_number, user_role, user=user)
 
     if 'Error' in result :
         return JsonResponse({'error':result}, status=400)
@@ -171,19 +159,31 @@ def update_profile(request):
 def get_available_doctors(request):
     specialization = request.query_params.get('specialization', None)
     location_name = request.query_params.get('location_name', None)
-    doctors = doctor.doctor_data(specialization=specialization, location_name=location_name)
-    data = []
-    for doc in doctors:
-        data.append({
-            'name': doc.name,
-            'specialization': doc.specialization,
-            'experience_years': doc.experience_years,
-            'location_name': doc.location_name,
-            'latitude': doc.latitude,
-            'longitude': doc.longitude,
-            'bio': doc.bio
-    })
-    return Response(data, status=200)
+    try:
+        fields = pagination.parse_fields(request.query_params.get('fields'), directory.FIELDS)
+        limit = pagination.parse_limit(request.query_params.get('limit'))
+        cursor = pagination.decode_cursor(request.query_params.get('cursor'), (int,))
+    except pagination.PaginationError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    etag, body, last_id = directory.get_snapshot(
+        specialization=specialization,
+        location_name=location_name,
+        fields=fields,
+        after=cursor[0] if cursor else None,
+        limit=limit,
+    )
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    # next_cursor in the body; the Link header repeats it as a full URL
+    if last_id is not None:
+        response['Link'] = pagination.next_link(request, pagination.encode_cursor(last_id))
+    # Clients may keep the list but must revalidate it on every use
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 
 @api_view(['GET'])
@@ -191,14 +191,18 @@ def get_available_doctors(request):
 def view_profile(request):
     phone_number = request.query_params.get('id')
     user_role = request.query_params.get('role')
+    identity = token_identity(request)
 
-    if not phone_number or not user_role:
+    if identity:
+        pk, user_role = identity
+        profile = profile_cache.get_profile(user_role, pk=pk)
+    elif not phone_number or not user_role:
         return JsonResponse({'error': 'Phone number and role are required'}, status=400)
-    
-    profile = utils.get_user_profile(phone_number, user_role)
+    else:
+        profile = profile_cache.get_profile(user_role, phonenumber=phone_number)
 
     if profile:
-        return JsonResponse({'message': 'User found', 'profile': utils.profile_to_dict(profile, user_role)}, status=200)
+        return JsonResponse({'message': 'User found', 'profile': profile}, status=200)
     else:
         return JsonResponse({'message': 'User not found'}, status=404)
     
@@ -223,24 +227,37 @@ def find_nearest_doctors(request):
     if not patient_lat or not patient_lon:
         return JsonResponse({'error': 'Patient location not available'}, status=400)
 
-    doctors = Doctor.objects.all()
+    try:
+        fields = pagination.parse_fields(request.query_params.get('fields'), NEAREST_DOCTOR_FIELDS)
+        limit = pagination.parse_limit(request.query_params.get('limit'))
+        cursor = pagination.decode_cursor(request.query_params.get('cursor'), (float, int))
+    except pagination.PaginationError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Nearest first, ties by id; the cursor is the (distance, id) of the last doctor sent
+    distances = doctor.nearby_doctor_distances(patient_lat, patient_lon, radius_km=10)
+    if cursor:
+        distances = [(pk, distance) for pk, distance in distances if (distance, pk) > tuple(cursor)]
+    page = distances[:limit]
+    rows = {row['pk']: row for row in Doctor.objects.filter(pk__in=[pk for pk, _ in page]).values('pk', *fields)}
 
     nearby_doctors = []
-    for doctor in doctors:
-        if doctor.latitude is not None and doctor.longitude is not None:
-            distance = haversine(patient_lat, patient_lon, doctor.latitude, doctor.longitude)
-            if distance <= 10:
-                nearby_doctors.append({
-                    'name': doctor.name,
-                    'specialization': doctor.specialization,
-                    'experience_years': doctor.experience_years,
-                    'location_name': doctor.location_name,
-                    'latitude': doctor.latitude,
-                    'longitude': doctor.longitude,
-                    'distance_km': round(distance, 2) 
-                })
-
-    return JsonResponse({'nearby_doctors': nearby_doctors}, status=200)
+    for pk, distance in page:
+        if pk not in rows:
+            continue
+        item = {field: rows[pk][field] for field in fields}
+        item['distance_km'] = round(distance, 2)
+        nearby_doctors.append(item)
+
+    # Same shape as get_available_doctors: next_cursor is null on the last page
+    response_data = {'nearby_doctors': nearby_doctors, 'next_cursor': None}
+    if len(distances) > limit:
+        last_pk, last_distance = page[-1]
+        response_data['next_cursor'] = pagination.encode_cursor(last_distance, last_pk)
+    response = JsonResponse(response_data, status=200)
+    if response_data['next_cursor']:
+        response['Link'] = pagination.next_link(request, response_data['next_cursor'])
+    return response
 
 
 @api_view(['GET'])
@@ -249,10 +266,13 @@ def nearby_hospital(request):
     phone_number = request.query_params.get('id')
     user_role = request.query_params.get('user_role')
     specialization = request.query_params.get('specialization')
+    identity = token_identity(request)
 
-    profile = utils.get_user_profile(phone_number, user_role)
-    profile = utils.profile_to_dict(profile,user_role)
-    print("profile",profile)
+    if identity:
+        pk, user_role = identity
+        profile = profile_cache.get_profile(user_role, pk=pk)
+    else:
+        profile = profile_cache.get_profile(user_role, phonenumber=phone_number)
     if not profile:
         return JsonResponse({'error': 'User not found'}, status=404)
     if not profile['latitude'] or not profile['longitude']: